@@ -0,0 +1,130 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import json
+import tempfile
+import time
+from twunnel3 import account_store, logger
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 1
+    }
+}
+
+logger.configure(configuration)
+
+def create_accounts(number_of_accounts):
+    accounts = []
+    
+    i = 0
+    while i < number_of_accounts:
+        account = {}
+        account["NAME"] = "name" + str(i)
+        account["PASSWORD"] = "password" + str(i)
+        
+        accounts.append(account)
+        
+        i = i + 1
+    
+    return accounts
+
+def authenticate(accounts, name, password):
+    i = 0
+    while i < len(accounts):
+        if accounts[i]["NAME"].encode() == name:
+            if accounts[i]["PASSWORD"].encode() == password:
+                return True
+            
+            return False
+        
+        i = i + 1
+    
+    return False
+
+def measure_reload(loop, store):
+    maximum_stall_times = [0]
+    
+    def tick(tick_time):
+        maximum_stall_times[0] = max(maximum_stall_times[0], time.perf_counter() - tick_time)
+        
+        if store.reloading:
+            loop.call_soon(tick, time.perf_counter())
+        else:
+            loop.stop()
+    
+    store.reload()
+    
+    loop.call_soon(tick, time.perf_counter())
+    loop.run_forever()
+    
+    return maximum_stall_times[0] * 1000
+
+def measure(function, name, password, number_of_iterations):
+    start_time = time.perf_counter()
+    
+    i = 0
+    while i < number_of_iterations:
+        function(name, password)
+        
+        i = i + 1
+    
+    return (time.perf_counter() - start_time) / number_of_iterations * 1000000
+
+def main():
+    number_of_iterations = 2000
+    
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    
+    print("accounts    list (us)    store (us)    store miss (us)    load (ms)    reload stall (ms)")
+    
+    for number_of_accounts in [10, 100, 1000, 10000, 100000]:
+        accounts = create_accounts(number_of_accounts)
+        
+        name = accounts[-1]["NAME"].encode()
+        password = accounts[-1]["PASSWORD"].encode()
+        
+        list_time = measure(lambda name, password: authenticate(accounts, name, password), name, password, max(number_of_iterations * 10 // number_of_accounts, 10))
+        
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as file:
+            json.dump(accounts, file)
+        
+        configuration = \
+        {
+            "ACCOUNTS": [],
+            "ACCOUNTS_FILE":
+            {
+                "TYPE": "JSON",
+                "FILE": file.name,
+                "RELOAD_INTERVAL": 3600
+            }
+        }
+        
+        account_store.set_default_configuration(configuration, ["ACCOUNTS_FILE"])
+        
+        start_time = time.perf_counter()
+        
+        store = account_store.AccountStore(configuration)
+        
+        load_time = (time.perf_counter() - start_time) * 1000
+        
+        store.file_modification_time = None
+        
+        reload_stall_time = measure_reload(loop, store)
+        
+        os.unlink(file.name)
+        
+        store_time = measure(store.authenticate, name, password, number_of_iterations)
+        store_miss_time = measure(store.authenticate, b"unknown", password, number_of_iterations)
+        
+        print("%8d    %9.2f    %10.2f    %15.2f    %9.2f    %17.2f" % (number_of_accounts, list_time, store_time, store_miss_time, load_time, reload_stall_time))
+    
+    loop.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,504 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import json
+import math
+import multiprocessing
+import platform
+import subprocess
+import time
+from twunnel3 import local_proxy_server, logger, proxy_server, remote_proxy_server
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 1
+    }
+}
+
+logger.configure(configuration)
+
+OUTPUT_FILE = "end_to_end.json"
+if len(sys.argv) > 1:
+    OUTPUT_FILE = sys.argv[1]
+
+BASELINE_FILE = None
+if len(sys.argv) > 2:
+    BASELINE_FILE = sys.argv[2]
+
+CERTIFICATE_DIRECTORY = os.path.abspath(os.path.join("..", "examples", "files", "SSL"))
+if len(sys.argv) > 3:
+    CERTIFICATE_DIRECTORY = os.path.abspath(sys.argv[3])
+
+THROUGHPUT_SIZE = 64 * 1024 * 1024
+THROUGHPUT_WRITE_SIZE = 65536
+NUMBER_OF_THROUGHPUT_ROUNDS = 3
+NUMBER_OF_CONNECTIONS = 2000
+NUMBER_OF_PARALLEL_CONNECTIONS = 50
+TIMEOUT = 120
+
+ECHO_PORT = 9500
+SINK_PORT = 9501
+HTTPS_PORT = 9510
+SOCKS4_PORT = 9511
+SOCKS5_PORT = 9512
+SSL_PORT = 9520
+SSL_SOCKS5_PORT = 9521
+
+def create_proxy_server_configuration(type, port):
+    configuration = \
+    {
+        "TYPE": type,
+        "ADDRESS": "127.0.0.1",
+        "PORT": port,
+        "ACCOUNT":
+        {
+            "NAME": "",
+            "PASSWORD": ""
+        }
+    }
+    
+    return configuration
+
+TOPOLOGIES = \
+[
+    ("DIRECT", []),
+    ("HTTPS", [create_proxy_server_configuration("HTTPS", HTTPS_PORT)]),
+    ("SOCKS4", [create_proxy_server_configuration("SOCKS4", SOCKS4_PORT)]),
+    ("SOCKS5", [create_proxy_server_configuration("SOCKS5", SOCKS5_PORT)]),
+    ("HTTPS_SOCKS4_SOCKS5", [create_proxy_server_configuration("HTTPS", HTTPS_PORT), create_proxy_server_configuration("SOCKS4", SOCKS4_PORT), create_proxy_server_configuration("SOCKS5", SOCKS5_PORT)]),
+    ("SOCKS5_SSL", [create_proxy_server_configuration("SOCKS5", SSL_SOCKS5_PORT)])
+]
+
+METRICS = \
+[
+    ("THROUGHPUT", "throughput (MiB/s)", 1.0 / (1024 * 1024)),
+    ("CONNECTIONS_PER_SECOND", "connections/s", 1.0),
+    ("HANDSHAKE_LATENCY_P50", "handshake p50 (ms)", 1000.0),
+    ("HANDSHAKE_LATENCY_P99", "handshake p99 (ms)", 1000.0)
+]
+
+def get_percentile(values, percentile):
+    if len(values) == 0:
+        return None
+    
+    values = sorted(values)
+    
+    return values[max(int(math.ceil(percentile / 100.0 * len(values))) - 1, 0)]
+
+def get_median(values):
+    return get_percentile(values, 50)
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return ""
+
+def format_metric(value, scale):
+    if value is None:
+        return "-"
+    
+    return "%.2f" % (value * scale)
+
+class EchoProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        self.transport.write(data)
+
+class SinkProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        self.length = 0
+    
+    def data_received(self, data):
+        if self.length < THROUGHPUT_SIZE and self.length + len(data) >= THROUGHPUT_SIZE:
+            self.transport.write(b"\x00")
+        
+        self.length = self.length + len(data)
+
+class PingProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        self.succeeded = False
+        
+        self.factory.benchmark.latencies.append(time.perf_counter() - self.factory.start_time)
+        
+        self.transport.write(b"\x00")
+    
+    def connection_lost(self, exception):
+        self.factory.connection_finished(self.succeeded)
+    
+    def data_received(self, data):
+        self.succeeded = True
+        
+        self.transport.close()
+
+class PingProtocolFactory(object):
+    def __init__(self, benchmark):
+        self.benchmark = benchmark
+        self.start_time = time.perf_counter()
+        self.finished = False
+    
+    def __call__(self):
+        protocol = PingProtocol()
+        protocol.factory = self
+        return protocol
+    
+    def connection_done(self, future):
+        if future.cancelled() or future.exception() is not None:
+            self.connection_finished(False)
+    
+    def connection_failed(self, exception):
+        self.connection_finished(False)
+    
+    def connection_finished(self, succeeded):
+        if self.finished:
+            return
+        
+        self.finished = True
+        
+        self.benchmark.connection_finished(succeeded)
+
+class ConnectionBenchmark(object):
+    def __init__(self, tunnel):
+        self.tunnel = tunnel
+        self.future = asyncio.Future()
+        self.start_time = 0
+        self.duration = 0
+        self.latencies = []
+        self.number_of_started_connections = 0
+        self.number_of_finished_connections = 0
+        self.number_of_failed_connections = 0
+    
+    def start(self):
+        self.start_time = time.perf_counter()
+        
+        i = 0
+        while i < NUMBER_OF_PARALLEL_CONNECTIONS:
+            self.create_connection()
+            
+            i = i + 1
+        
+        return self.future
+    
+    def create_connection(self):
+        if self.number_of_started_connections >= NUMBER_OF_CONNECTIONS:
+            return
+        
+        self.number_of_started_connections = self.number_of_started_connections + 1
+        
+        factory = PingProtocolFactory(self)
+        
+        future = self.tunnel.create_connection(factory, address="127.0.0.1", port=ECHO_PORT)
+        future.add_done_callback(factory.connection_done)
+    
+    def connection_finished(self, succeeded):
+        self.number_of_finished_connections = self.number_of_finished_connections + 1
+        
+        if not succeeded:
+            self.number_of_failed_connections = self.number_of_failed_connections + 1
+        
+        if self.number_of_finished_connections == NUMBER_OF_CONNECTIONS:
+            self.duration = time.perf_counter() - self.start_time
+            
+            if not self.future.done():
+                self.future.set_result(None)
+        else:
+            self.create_connection()
+
+class ThroughputProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+        self.paused = False
+        self.length = 0
+        self.start_time = time.perf_counter()
+        
+        self.write_data()
+    
+    def connection_lost(self, exception):
+        self.factory.connection_failed(exception)
+    
+    def pause_writing(self):
+        self.paused = True
+    
+    def resume_writing(self):
+        self.paused = False
+        
+        self.write_data()
+    
+    def write_data(self):
+        while not self.paused and self.length < THROUGHPUT_SIZE:
+            self.transport.write(self.factory.data)
+            
+            self.length = self.length + len(self.factory.data)
+    
+    def data_received(self, data):
+        if not self.factory.future.done():
+            self.factory.future.set_result(THROUGHPUT_SIZE / (time.perf_counter() - self.start_time))
+        
+        self.transport.close()
+
+class ThroughputProtocolFactory(object):
+    def __init__(self):
+        self.data = b"\x00" * THROUGHPUT_WRITE_SIZE
+        self.future = asyncio.Future()
+    
+    def __call__(self):
+        protocol = ThroughputProtocol()
+        protocol.factory = self
+        return protocol
+    
+    def connection_done(self, future):
+        if future.cancelled() or future.exception() is not None:
+            self.connection_failed(future.exception())
+    
+    def connection_failed(self, exception):
+        if not self.future.done():
+            self.future.set_exception(Exception("connection failed"))
+
+def create_ssl_proxy_servers(loop, servers):
+    configuration = \
+    {
+        "PROXY_SERVERS": [],
+        "REMOTE_PROXY_SERVER":
+        {
+            "TYPE": "SSL",
+            "ADDRESS": "127.0.0.1",
+            "PORT": SSL_PORT,
+            "CERTIFICATE":
+            {
+                "FILE": os.path.join(CERTIFICATE_DIRECTORY, "C.pem"),
+                "KEY":
+                {
+                    "FILE": os.path.join(CERTIFICATE_DIRECTORY, "CK.pem")
+                }
+            },
+            "ACCOUNTS":
+            [
+                {
+                    "NAME": "",
+                    "PASSWORD": ""
+                }
+            ]
+        }
+    }
+    
+    servers.append(loop.run_until_complete(remote_proxy_server.create_server(configuration)))
+    
+    configuration = \
+    {
+        "PROXY_SERVERS": [],
+        "LOCAL_PROXY_SERVER":
+        {
+            "TYPE": "SOCKS5",
+            "ADDRESS": "127.0.0.1",
+            "PORT": SSL_SOCKS5_PORT,
+            "ACCOUNTS":
+            [
+                {
+                    "NAME": "",
+                    "PASSWORD": ""
+                }
+            ]
+        },
+        "REMOTE_PROXY_SERVERS":
+        [
+            {
+                "TYPE": "SSL",
+                "ADDRESS": "127.0.0.1",
+                "PORT": SSL_PORT,
+                "CERTIFICATE":
+                {
+                    "AUTHORITY":
+                    {
+                        "FILE": os.path.join(CERTIFICATE_DIRECTORY, "CA.pem")
+                    },
+                    "ADDRESS": ""
+                },
+                "ACCOUNT":
+                {
+                    "NAME": "",
+                    "PASSWORD": ""
+                }
+            }
+        ]
+    }
+    
+    servers.append(loop.run_until_complete(local_proxy_server.create_server(configuration)))
+
+def run_proxy_servers(ready, stop):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    
+    servers = []
+    
+    for type, port in [("HTTPS", HTTPS_PORT), ("SOCKS4", SOCKS4_PORT), ("SOCKS5", SOCKS5_PORT)]:
+        configuration = \
+        {
+            "PROXY_SERVERS": [],
+            "LOCAL_PROXY_SERVER":
+            {
+                "TYPE": type,
+                "ADDRESS": "127.0.0.1",
+                "PORT": port,
+                "ACCOUNTS":
+                [
+                    {
+                        "NAME": "",
+                        "PASSWORD": ""
+                    }
+                ]
+            }
+        }
+        
+        servers.append(loop.run_until_complete(local_proxy_server.create_server(configuration)))
+    
+    try:
+        create_ssl_proxy_servers(loop, servers)
+    except Exception as exception:
+        print("warning: the SSL proxy servers could not be created (" + str(exception) + ")")
+    
+    ready.set()
+    
+    loop.run_until_complete(loop.run_in_executor(None, stop.wait))
+    
+    for server in servers:
+        server.close()
+    
+    loop.close()
+
+def run_topology(loop, proxy_servers):
+    results = {}
+    results["THROUGHPUT"] = None
+    results["CONNECTIONS_PER_SECOND"] = None
+    results["HANDSHAKE_LATENCY_P50"] = None
+    results["HANDSHAKE_LATENCY_P99"] = None
+    results["NUMBER_OF_FAILED_CONNECTIONS"] = 0
+    
+    configuration = \
+    {
+        "PROXY_SERVERS": proxy_servers
+    }
+    
+    tunnel = proxy_server.create_tunnel(configuration)
+    
+    throughputs = []
+    
+    i = 0
+    while i < NUMBER_OF_THROUGHPUT_ROUNDS:
+        factory = ThroughputProtocolFactory()
+        
+        future = tunnel.create_connection(factory, address="127.0.0.1", port=SINK_PORT)
+        future.add_done_callback(factory.connection_done)
+        
+        try:
+            throughputs.append(loop.run_until_complete(asyncio.wait_for(factory.future, TIMEOUT)))
+        except Exception:
+            results["NUMBER_OF_FAILED_CONNECTIONS"] = results["NUMBER_OF_FAILED_CONNECTIONS"] + 1
+        
+        i = i + 1
+    
+    results["THROUGHPUT"] = get_median(throughputs)
+    
+    benchmark = ConnectionBenchmark(tunnel)
+    
+    try:
+        loop.run_until_complete(asyncio.wait_for(benchmark.start(), TIMEOUT))
+    except Exception:
+        benchmark.number_of_failed_connections = benchmark.number_of_failed_connections + NUMBER_OF_CONNECTIONS - benchmark.number_of_finished_connections
+    
+    if benchmark.duration > 0 and benchmark.number_of_failed_connections < NUMBER_OF_CONNECTIONS:
+        results["CONNECTIONS_PER_SECOND"] = (NUMBER_OF_CONNECTIONS - benchmark.number_of_failed_connections) / benchmark.duration
+    
+    results["HANDSHAKE_LATENCY_P50"] = get_percentile(benchmark.latencies, 50)
+    results["HANDSHAKE_LATENCY_P99"] = get_percentile(benchmark.latencies, 99)
+    results["NUMBER_OF_FAILED_CONNECTIONS"] = results["NUMBER_OF_FAILED_CONNECTIONS"] + benchmark.number_of_failed_connections
+    
+    return results
+
+def print_comparison(results, baseline_results):
+    print("")
+    print("compared to " + (baseline_results["COMMIT"] or "unknown commit"))
+    print("%-20s    %-20s    %12s    %12s    %8s" % ("topology", "metric", "baseline", "current", "change"))
+    
+    for name, proxy_servers in TOPOLOGIES:
+        if name not in results["TOPOLOGIES"] or name not in baseline_results["TOPOLOGIES"]:
+            continue
+        
+        for key, description, scale in METRICS:
+            value = results["TOPOLOGIES"][name][key]
+            baseline_value = baseline_results["TOPOLOGIES"][name].get(key)
+            
+            change = "-"
+            if value is not None and baseline_value:
+                change = "%+.1f%%" % ((value - baseline_value) / baseline_value * 100)
+            
+            print("%-20s    %-20s    %12s    %12s    %8s" % (name, description, format_metric(baseline_value, scale), format_metric(value, scale), change))
+
+def main():
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    
+    process = multiprocessing.Process(target=run_proxy_servers, args=(ready, stop))
+    process.start()
+    
+    ready.wait()
+    
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    
+    echo_server = loop.run_until_complete(loop.create_server(EchoProtocol, "127.0.0.1", ECHO_PORT))
+    sink_server = loop.run_until_complete(loop.create_server(SinkProtocol, "127.0.0.1", SINK_PORT))
+    
+    results = {}
+    results["COMMIT"] = get_commit()
+    results["TIME"] = time.time()
+    results["PYTHON"] = platform.python_version()
+    results["PLATFORM"] = platform.platform()
+    results["PARAMETERS"] = {}
+    results["PARAMETERS"]["THROUGHPUT_SIZE"] = THROUGHPUT_SIZE
+    results["PARAMETERS"]["THROUGHPUT_WRITE_SIZE"] = THROUGHPUT_WRITE_SIZE
+    results["PARAMETERS"]["NUMBER_OF_THROUGHPUT_ROUNDS"] = NUMBER_OF_THROUGHPUT_ROUNDS
+    results["PARAMETERS"]["NUMBER_OF_CONNECTIONS"] = NUMBER_OF_CONNECTIONS
+    results["PARAMETERS"]["NUMBER_OF_PARALLEL_CONNECTIONS"] = NUMBER_OF_PARALLEL_CONNECTIONS
+    results["TOPOLOGIES"] = {}
+    
+    print("%-20s    %18s    %13s    %18s    %18s    %8s" % ("topology", "throughput (MiB/s)", "connections/s", "handshake p50 (ms)", "handshake p99 (ms)", "failures"))
+    
+    for name, proxy_servers in TOPOLOGIES:
+        topology_results = run_topology(loop, proxy_servers)
+        
+        results["TOPOLOGIES"][name] = topology_results
+        
+        print("%-20s    %18s    %13s    %18s    %18s    %8d" % (name, format_metric(topology_results["THROUGHPUT"], 1.0 / (1024 * 1024)), format_metric(topology_results["CONNECTIONS_PER_SECOND"], 1.0), format_metric(topology_results["HANDSHAKE_LATENCY_P50"], 1000.0), format_metric(topology_results["HANDSHAKE_LATENCY_P99"], 1000.0), topology_results["NUMBER_OF_FAILED_CONNECTIONS"]))
+    
+    with open(OUTPUT_FILE, "w") as file:
+        json.dump(results, file, indent=4, sort_keys=True)
+    
+    print("")
+    print("results: " + OUTPUT_FILE)
+    
+    if BASELINE_FILE is not None:
+        with open(BASELINE_FILE) as file:
+            baseline_results = json.load(file)
+        
+        print_comparison(results, baseline_results)
+    
+    echo_server.close()
+    sink_server.close()
+    
+    loop.run_until_complete(asyncio.sleep(1))
+    loop.close()
+    
+    stop.set()
+    
+    process.join()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,295 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import socket
+import struct
+import time
+from twunnel3 import local_proxy_server, logger, proxy_server
+from twunnel3.local_proxy_server__https import HTTPSInputProtocolFactory
+from twunnel3.local_proxy_server__socks4 import SOCKS4InputProtocolFactory
+from twunnel3.local_proxy_server__socks5 import SOCKS5InputProtocolFactory
+from twunnel3.proxy_server__https import HTTPSTunnelOutputProtocolFactory
+from twunnel3.proxy_server__socks4 import SOCKS4TunnelOutputProtocolFactory
+from twunnel3.proxy_server__socks5 import SOCKS5TunnelOutputProtocolFactory
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 1
+    }
+}
+
+logger.configure(configuration)
+
+NUMBER_OF_ITERATIONS = 10000
+NUMBER_OF_CHUNKS = 1000000
+
+LONG_DOMAIN_NAME = ("a" * 63 + ".") * 3 + "a" * 63
+
+class Transport(object):
+    def __init__(self):
+        self.length = 0
+        self.closed = False
+    
+    def write(self, data):
+        self.length = self.length + len(data)
+    
+    def close(self):
+        self.closed = True
+    
+    def pause_reading(self):
+        pass
+    
+    def resume_reading(self):
+        pass
+    
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+    
+    def get_extra_info(self, name, default=None):
+        return default
+
+class OutputProtocolConnectionManager(object):
+    def __init__(self):
+        self.admission_controller = self
+        self.number_of_connections = 0
+    
+    def input_protocol__connection_made(self, input_protocol):
+        input_protocol.admission_state = 1
+    
+    def input_protocol__connection_lost(self, input_protocol):
+        pass
+    
+    def input_protocol__handshake_failed(self, input_protocol, reason):
+        pass
+    
+    def input_protocol__early_data_received(self, input_protocol, data_length):
+        pass
+    
+    def connect(self, remote_address, remote_port, input_protocol):
+        self.number_of_connections = self.number_of_connections + 1
+    
+    def admit_account(self, name):
+        return True
+    
+    def release_account(self, name):
+        pass
+
+class TunnelProtocol(object):
+    def __init__(self):
+        self.number_of_connections = 0
+    
+    def tunnel_output_protocol__connection_made(self, transport, data):
+        self.number_of_connections = self.number_of_connections + 1
+    
+    def tunnel_output_protocol__connection_ready(self):
+        pass
+    
+    def tunnel_output_protocol__request_sent(self):
+        pass
+
+def split(messages, chunk_length):
+    chunks = []
+    
+    for message in messages:
+        i = 0
+        while i < len(message):
+            chunks.append(message[i:i + chunk_length])
+            
+            i = i + chunk_length
+    
+    return chunks
+
+def create_headers(length):
+    headers = b""
+    
+    i = 0
+    while len(headers) < length:
+        headers = headers + b"X-Header-" + str(i).encode() + b": " + b"x" * 64 + b"\r\n"
+        
+        i = i + 1
+    
+    return headers
+
+def create_input_protocol_factory(type, input_protocol_factory_class):
+    configuration = \
+    {
+        "LOCAL_PROXY_SERVER":
+        {
+            "TYPE": type
+        }
+    }
+    
+    local_proxy_server.set_default_configuration(configuration, ["PROXY_SERVERS", "POOL", "RESOLVER", "LOCAL_PROXY_SERVER", "REMOTE_PROXY_SERVERS", "BALANCER"])
+    
+    return input_protocol_factory_class(configuration, OutputProtocolConnectionManager())
+
+def create_tunnel_output_protocol_factory(type, tunnel_output_protocol_factory_class, address, port, pipeline=False):
+    configuration = \
+    {
+        "PROXY_SERVERS":
+        [
+            {
+                "TYPE": type,
+                "ADDRESS": "127.0.0.1",
+                "PORT": 1080,
+                "PIPELINE": pipeline
+            }
+        ]
+    }
+    
+    proxy_server.set_default_configuration(configuration, ["PROXY_SERVERS"])
+    
+    tunnel_output_protocol_configuration = {}
+    tunnel_output_protocol_configuration["PROXY_SERVER"] = configuration["PROXY_SERVERS"][0]
+    
+    tunnel_output_protocol_factory = tunnel_output_protocol_factory_class(tunnel_output_protocol_configuration, address, port)
+    tunnel_output_protocol_factory.tunnel_protocol = TunnelProtocol()
+    
+    return tunnel_output_protocol_factory
+
+def run_input_protocol(input_protocol_factory, chunks, number_of_iterations):
+    output_protocol_connection_manager = input_protocol_factory.output_protocol_connection_manager
+    output_protocol_connection_manager.number_of_connections = 0
+    
+    start_time = time.perf_counter()
+    
+    i = 0
+    while i < number_of_iterations:
+        input_protocol = input_protocol_factory()
+        input_protocol.connection_made(Transport())
+        
+        for chunk in chunks:
+            input_protocol.data_received(chunk)
+        
+        input_protocol.connection_lost(None)
+        
+        i = i + 1
+    
+    duration = time.perf_counter() - start_time
+    
+    return duration, output_protocol_connection_manager.number_of_connections
+
+def run_tunnel_output_protocol(tunnel_output_protocol_factory, chunks, number_of_iterations):
+    tunnel_protocol = tunnel_output_protocol_factory.tunnel_protocol
+    tunnel_protocol.number_of_connections = 0
+    
+    start_time = time.perf_counter()
+    
+    i = 0
+    while i < number_of_iterations:
+        tunnel_output_protocol = tunnel_output_protocol_factory()
+        tunnel_output_protocol.connection_made(Transport())
+        
+        for chunk in chunks:
+            tunnel_output_protocol.data_received(chunk)
+        
+        tunnel_output_protocol.connection_lost(None)
+        
+        i = i + 1
+    
+    duration = time.perf_counter() - start_time
+    
+    return duration, tunnel_protocol.number_of_connections
+
+def create_socks5_request(address, port):
+    request = struct.pack("!BBB", 0x05, 0x01, 0x00)
+    
+    if proxy_server.is_ipv4_address(address):
+        request = request + struct.pack("!BBBB", 0x05, 0x01, 0x00, 0x01) + socket.inet_pton(socket.AF_INET, address)
+    else:
+        request = request + struct.pack("!BBBBB", 0x05, 0x01, 0x00, 0x03, len(address)) + address.encode()
+    
+    return request + struct.pack("!H", port)
+
+def create_socks4_request(address, port):
+    if proxy_server.is_ipv4_address(address):
+        return struct.pack("!BBH", 0x04, 0x01, port) + socket.inet_pton(socket.AF_INET, address) + b"\x00"
+    
+    return struct.pack("!BBHI", 0x04, 0x01, port, 1) + b"\x00" + address.encode() + b"\x00"
+
+def create_https_request(address, port, headers=b""):
+    request = b"CONNECT " + address.encode() + b":" + str(port).encode() + b" HTTP/1.1\r\n"
+    request = request + b"Host: " + address.encode() + b":" + str(port).encode() + b"\r\n"
+    request = request + headers
+    request = request + b"\r\n"
+    
+    return request
+
+def create_socks5_responses(address, port, pipeline=False):
+    if proxy_server.is_ipv4_address(address):
+        response = struct.pack("!BBBB", 0x05, 0x00, 0x00, 0x01) + socket.inet_pton(socket.AF_INET, address)
+    else:
+        response = struct.pack("!BBBBB", 0x05, 0x00, 0x00, 0x03, len(address)) + address.encode()
+    
+    response = response + struct.pack("!H", port)
+    
+    if pipeline:
+        return [struct.pack("!BB", 0x05, 0x00) + response]
+    
+    return [struct.pack("!BB", 0x05, 0x00), response]
+
+def create_socks4_responses():
+    return [struct.pack("!BBHI", 0x00, 0x5a, 0, 0)]
+
+def create_https_responses(headers=b""):
+    response = b"HTTP/1.1 200 Connection established\r\n"
+    response = response + headers
+    response = response + b"\r\n"
+    
+    return [response]
+
+def create_benchmarks():
+    benchmarks = []
+    
+    socks5_input_protocol_factory = create_input_protocol_factory("SOCKS5", SOCKS5InputProtocolFactory)
+    socks4_input_protocol_factory = create_input_protocol_factory("SOCKS4", SOCKS4InputProtocolFactory)
+    https_input_protocol_factory = create_input_protocol_factory("HTTPS", HTTPSInputProtocolFactory)
+    
+    benchmarks.append(("SOCKS5InputProtocol", "ipv4 address", run_input_protocol, socks5_input_protocol_factory, [create_socks5_request("127.0.0.1", 443)]))
+    benchmarks.append(("SOCKS5InputProtocol", "long domain name", run_input_protocol, socks5_input_protocol_factory, [create_socks5_request(LONG_DOMAIN_NAME, 443)]))
+    benchmarks.append(("SOCKS4InputProtocol", "ipv4 address", run_input_protocol, socks4_input_protocol_factory, [create_socks4_request("127.0.0.1", 443)]))
+    benchmarks.append(("SOCKS4InputProtocol", "long domain name", run_input_protocol, socks4_input_protocol_factory, [create_socks4_request(LONG_DOMAIN_NAME, 443)]))
+    benchmarks.append(("HTTPSInputProtocol", "ipv4 address", run_input_protocol, https_input_protocol_factory, [create_https_request("127.0.0.1", 443)]))
+    benchmarks.append(("HTTPSInputProtocol", "long domain name", run_input_protocol, https_input_protocol_factory, [create_https_request(LONG_DOMAIN_NAME, 443)]))
+    benchmarks.append(("HTTPSInputProtocol", "4 KiB headers", run_input_protocol, https_input_protocol_factory, [create_https_request("127.0.0.1", 443, create_headers(4 * 1024))]))
+    benchmarks.append(("HTTPSInputProtocol", "32 KiB headers", run_input_protocol, https_input_protocol_factory, [create_https_request("127.0.0.1", 443, create_headers(32 * 1024))]))
+    
+    benchmarks.append(("SOCKS5TunnelOutputProtocol", "ipv4 address", run_tunnel_output_protocol, create_tunnel_output_protocol_factory("SOCKS5", SOCKS5TunnelOutputProtocolFactory, "127.0.0.1", 443), create_socks5_responses("127.0.0.1", 443)))
+    benchmarks.append(("SOCKS5TunnelOutputProtocol", "long domain name", run_tunnel_output_protocol, create_tunnel_output_protocol_factory("SOCKS5", SOCKS5TunnelOutputProtocolFactory, LONG_DOMAIN_NAME, 443), create_socks5_responses(LONG_DOMAIN_NAME, 443)))
+    benchmarks.append(("SOCKS5TunnelOutputProtocol", "pipelined", run_tunnel_output_protocol, create_tunnel_output_protocol_factory("SOCKS5", SOCKS5TunnelOutputProtocolFactory, "127.0.0.1", 443, True), create_socks5_responses("127.0.0.1", 443, True)))
+    benchmarks.append(("SOCKS4TunnelOutputProtocol", "ipv4 address", run_tunnel_output_protocol, create_tunnel_output_protocol_factory("SOCKS4", SOCKS4TunnelOutputProtocolFactory, "127.0.0.1", 443), create_socks4_responses()))
+    benchmarks.append(("SOCKS4TunnelOutputProtocol", "long domain name", run_tunnel_output_protocol, create_tunnel_output_protocol_factory("SOCKS4", SOCKS4TunnelOutputProtocolFactory, LONG_DOMAIN_NAME, 443), create_socks4_responses()))
+    benchmarks.append(("HTTPSTunnelOutputProtocol", "ipv4 address", run_tunnel_output_protocol, create_tunnel_output_protocol_factory("HTTPS", HTTPSTunnelOutputProtocolFactory, "127.0.0.1", 443), create_https_responses()))
+    benchmarks.append(("HTTPSTunnelOutputProtocol", "long domain name", run_tunnel_output_protocol, create_tunnel_output_protocol_factory("HTTPS", HTTPSTunnelOutputProtocolFactory, LONG_DOMAIN_NAME, 443), create_https_responses()))
+    benchmarks.append(("HTTPSTunnelOutputProtocol", "4 KiB headers", run_tunnel_output_protocol, create_tunnel_output_protocol_factory("HTTPS", HTTPSTunnelOutputProtocolFactory, "127.0.0.1", 443), create_https_responses(create_headers(4 * 1024))))
+    benchmarks.append(("HTTPSTunnelOutputProtocol", "32 KiB headers", run_tunnel_output_protocol, create_tunnel_output_protocol_factory("HTTPS", HTTPSTunnelOutputProtocolFactory, "127.0.0.1", 443), create_https_responses(create_headers(32 * 1024))))
+    
+    return benchmarks
+
+def main():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    
+    print("%-28s    %-18s    %-16s    %8s    %16s    %14s" % ("protocol", "input", "chunks", "bytes", "handshake (us)", "byte (ns)"))
+    
+    for protocol_name, input_name, run, factory, messages in create_benchmarks():
+        length = sum([len(message) for message in messages])
+        
+        for chunks_name, chunks in [("whole", messages), ("byte at a time", split(messages, 1))]:
+            number_of_iterations = max(min(NUMBER_OF_ITERATIONS, NUMBER_OF_CHUNKS // len(chunks)), 10)
+            
+            duration, number_of_connections = run(factory, chunks, number_of_iterations)
+            
+            if number_of_connections != number_of_iterations:
+                print("error: " + protocol_name + " (" + input_name + ", " + chunks_name + ") completed " + str(number_of_connections) + " of " + str(number_of_iterations) + " handshakes")
+            
+            print("%-28s    %-18s    %-16s    %8d    %16.2f    %14.2f" % (protocol_name, input_name, chunks_name, length, duration / number_of_iterations * 1000000, duration / number_of_iterations / length * 1000000000))
+    
+    loop.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
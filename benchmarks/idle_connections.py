@@ -0,0 +1,229 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import asyncio
+import gc
+import multiprocessing
+import platform
+import resource
+from twunnel3 import local_proxy_server, logger, proxy_server
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 1
+    }
+}
+
+logger.configure(configuration)
+
+NUMBER_OF_CONNECTIONS = 100000
+if len(sys.argv) > 1:
+    NUMBER_OF_CONNECTIONS = int(sys.argv[1])
+
+FILE_LIMIT = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+if FILE_LIMIT != resource.RLIM_INFINITY and FILE_LIMIT < NUMBER_OF_CONNECTIONS * 4 + 1000:
+    print("warning: the file limit (" + str(FILE_LIMIT) + ") only allows " + str((FILE_LIMIT - 1000) // 4) + " of " + str(NUMBER_OF_CONNECTIONS) + " connections")
+    
+    NUMBER_OF_CONNECTIONS = (FILE_LIMIT - 1000) // 4
+
+NUMBER_OF_CONNECTIONS_PER_PORT = 20000
+NUMBER_OF_PORTS = (NUMBER_OF_CONNECTIONS + NUMBER_OF_CONNECTIONS_PER_PORT - 1) // NUMBER_OF_CONNECTIONS_PER_PORT
+NUMBER_OF_CONNECTIONS_PER_BATCH = 1000
+
+SINK_PORT = 9100
+SOCKS5_PORT = 9200
+HTTPS_PORT = 9300
+
+def set_file_limit(number_of_files):
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    
+    if hard_limit != resource.RLIM_INFINITY and hard_limit < number_of_files:
+        print("warning: the file limit (" + str(hard_limit) + ") is lower than the " + str(number_of_files) + " files needed")
+        
+        number_of_files = hard_limit
+    
+    if soft_limit < number_of_files:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (number_of_files, hard_limit))
+
+def get_resident_set_size(process_id):
+    with open("/proc/" + str(process_id) + "/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    
+    return 0
+
+class SinkProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        pass
+
+class ClientProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        pass
+
+def run_proxy_servers(ready, stop):
+    set_file_limit(NUMBER_OF_CONNECTIONS * 4 + 1000)
+    
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    
+    servers = []
+    
+    i = 0
+    while i < NUMBER_OF_PORTS:
+        configuration = \
+        {
+            "PROXY_SERVERS": [],
+            "LOCAL_PROXY_SERVER":
+            {
+                "TYPE": "HTTPS",
+                "ADDRESS": "127.0.0.1",
+                "PORT": HTTPS_PORT + i
+            }
+        }
+        
+        servers.append(loop.run_until_complete(local_proxy_server.create_server(configuration)))
+        
+        configuration = \
+        {
+            "PROXY_SERVERS":
+            [
+                {
+                    "TYPE": "HTTPS",
+                    "ADDRESS": "127.0.0.1",
+                    "PORT": HTTPS_PORT + i,
+                    "ACCOUNT":
+                    {
+                        "NAME": "",
+                        "PASSWORD": ""
+                    }
+                }
+            ],
+            "LOCAL_PROXY_SERVER":
+            {
+                "TYPE": "SOCKS5",
+                "ADDRESS": "127.0.0.1",
+                "PORT": SOCKS5_PORT + i
+            }
+        }
+        
+        servers.append(loop.run_until_complete(local_proxy_server.create_server(configuration)))
+        
+        i = i + 1
+    
+    gc.collect()
+    
+    ready.set()
+    
+    loop.run_until_complete(loop.run_in_executor(None, stop.wait))
+    
+    for server in servers:
+        server.close()
+    
+    loop.close()
+
+def main():
+    set_file_limit(NUMBER_OF_CONNECTIONS * 2 + 1000)
+    
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    
+    process = multiprocessing.Process(target=run_proxy_servers, args=(ready, stop))
+    process.start()
+    
+    ready.wait()
+    
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    
+    sink_servers = []
+    tunnels = []
+    
+    i = 0
+    while i < NUMBER_OF_PORTS:
+        sink_servers.append(loop.run_until_complete(loop.create_server(SinkProtocol, "127.0.0.1", SINK_PORT + i)))
+        
+        configuration = \
+        {
+            "PROXY_SERVERS":
+            [
+                {
+                    "TYPE": "SOCKS5",
+                    "ADDRESS": "127.0.0.1",
+                    "PORT": SOCKS5_PORT + i,
+                    "ACCOUNT":
+                    {
+                        "NAME": "",
+                        "PASSWORD": ""
+                    }
+                }
+            ]
+        }
+        
+        tunnels.append(proxy_server.create_tunnel(configuration))
+        
+        i = i + 1
+    
+    resident_set_size = get_resident_set_size(process.pid)
+    
+    transports = []
+    
+    i = 0
+    while i < NUMBER_OF_CONNECTIONS:
+        futures = []
+        
+        j = 0
+        while j < NUMBER_OF_CONNECTIONS_PER_BATCH and i < NUMBER_OF_CONNECTIONS:
+            k = i // NUMBER_OF_CONNECTIONS_PER_PORT
+            
+            futures.append(tunnels[k].create_connection(ClientProtocol, address="127.0.0.1", port=SINK_PORT + k))
+            
+            i = i + 1
+            j = j + 1
+        
+        results = loop.run_until_complete(asyncio.gather(*futures, return_exceptions=True))
+        
+        for result in results:
+            if isinstance(result, Exception):
+                print("error: " + str(result))
+            else:
+                transports.append(result[0])
+    
+    loop.run_until_complete(asyncio.sleep(1))
+    
+    number_of_connections = len(transports)
+    
+    resident_set_size = get_resident_set_size(process.pid) - resident_set_size
+    
+    print("python: " + platform.python_version())
+    if sys.version_info < (3, 7):
+        print("warning: asyncio protocols have no __slots__ before Python 3.7, so protocol instances still have a __dict__")
+    print("connections: " + str(number_of_connections))
+    print("resident set size: " + str(resident_set_size // 1024) + " KiB")
+    if number_of_connections > 0:
+        print("bytes per idle connection: " + str(resident_set_size // number_of_connections))
+    
+    for transport in transports:
+        transport.close()
+    
+    for sink_server in sink_servers:
+        sink_server.close()
+    
+    loop.run_until_complete(asyncio.sleep(1))
+    loop.close()
+    
+    stop.set()
+    
+    process.join()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
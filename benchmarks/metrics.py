@@ -0,0 +1,70 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(".."))
+
+import time
+from twunnel3 import logger, metrics
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 1
+    }
+}
+
+logger.configure(configuration)
+
+def measure(function, number_of_iterations):
+    start_time = time.perf_counter()
+    
+    i = 0
+    while i < number_of_iterations:
+        function()
+        
+        i = i + 1
+    
+    return (time.perf_counter() - start_time) / number_of_iterations * 1000000000
+
+def main():
+    number_of_iterations = 1000000
+    
+    registry = metrics.Registry()
+    
+    counter = registry.create_counter("counter", "Counter.")
+    labeled_counter = registry.create_counter("labeled_counter", "Labeled counter.", "direction", ("upstream", "downstream"))
+    gauge = registry.create_gauge("gauge", "Gauge.")
+    histogram = registry.create_histogram("histogram", "Histogram.")
+    labeled_histogram = registry.create_histogram("labeled_histogram", "Labeled histogram.", "type", ("HTTPS", "SOCKS4", "SOCKS5"))
+    
+    baseline_time = measure(lambda: None, number_of_iterations)
+    
+    print("metric                        time (ns)")
+    print("%-24s    %9.1f" % ("counter", measure(lambda: counter.increase(), number_of_iterations) - baseline_time))
+    print("%-24s    %9.1f" % ("counter (labeled)", measure(lambda: labeled_counter.increase(65536, "downstream"), number_of_iterations) - baseline_time))
+    print("%-24s    %9.1f" % ("gauge", measure(lambda: gauge.decrease(), number_of_iterations) - baseline_time))
+    print("%-24s    %9.1f" % ("histogram", measure(lambda: histogram.observe(0.042), number_of_iterations) - baseline_time))
+    print("%-24s    %9.1f" % ("histogram (labeled)", measure(lambda: labeled_histogram.observe(0.042, "SOCKS5"), number_of_iterations) - baseline_time))
+    
+    data = b"\x00" * 65536
+    destination = bytearray()
+    
+    def relay(data):
+        destination[:] = data
+    
+    def relay_with_metrics(data):
+        labeled_counter.increase(len(data), "upstream")
+        
+        destination[:] = data
+    
+    relay_time = measure(lambda: relay(data), number_of_iterations // 10)
+    relay_with_metrics_time = measure(lambda: relay_with_metrics(data), number_of_iterations // 10)
+    
+    print("")
+    print("relay of 64 KiB (ns): %.1f" % relay_time)
+    print("relay of 64 KiB with metrics (ns): %.1f (%+.2f%%)" % (relay_with_metrics_time, (relay_with_metrics_time - relay_time) / relay_time * 100))
+    print("")
+    print("export (us): %.1f" % (measure(registry.export, 1000) / 1000))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
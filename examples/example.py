@@ -1,4 +1,5 @@
 import asyncio
+import twunnel3.compat
 import twunnel3.logger
 import twunnel3.proxy_server
 
@@ -70,4 +71,4 @@ def create_connection(configuration, ssl=False):
         factory.port = 443
     
     tunnel = twunnel3.proxy_server.create_tunnel(configuration)
-    asyncio.async(tunnel.create_connection(factory, address=factory.address, port=factory.port, ssl=ssl))
\ No newline at end of file
+    twunnel3.compat.ensure_future(tunnel.create_connection(factory, address=factory.address, port=factory.port, ssl=ssl))
\ No newline at end of file
@@ -0,0 +1,147 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import twunnel3.compat
+import unittest
+from twunnel3 import admission, logger
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+class InputProtocol(object):
+    def __init__(self, events, name):
+        self.events = events
+        self.name = name
+        self.admission_state = 0
+    
+    def admission__queued(self):
+        self.events.append((self.name, "queued"))
+    
+    def admission__admitted(self):
+        self.events.append((self.name, "admitted"))
+    
+    def admission__rejected(self):
+        self.events.append((self.name, "rejected"))
+
+class Server(object):
+    def __init__(self):
+        self.sockets = []
+        self.closed = False
+    
+    def is_serving(self):
+        return True
+    
+    def close(self):
+        self.closed = True
+
+def create_admission_controller(maximum_number_of_connections, maximum_number_of_queued_connections):
+    admission_configuration = \
+    {
+        "ADMISSION":
+        {
+            "MAXIMUM_NUMBER_OF_CONNECTIONS": maximum_number_of_connections,
+            "MAXIMUM_NUMBER_OF_QUEUED_CONNECTIONS": maximum_number_of_queued_connections
+        }
+    }
+    
+    admission.set_default_configuration(admission_configuration, ["ADMISSION"])
+    
+    return admission.AdmissionController(admission_configuration)
+
+class AdmissionControllerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+    
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def test_queue_then_admit(self):
+        events = []
+        admission_controller = create_admission_controller(1, 2)
+        
+        input_protocols = [InputProtocol(events, "first"), InputProtocol(events, "second"), InputProtocol(events, "third"), InputProtocol(events, "fourth")]
+        
+        for input_protocol in input_protocols:
+            admission_controller.admit(input_protocol)
+        
+        self.assertEqual([input_protocol.admission_state for input_protocol in input_protocols], [1, 2, 2, 3])
+        
+        admission_controller.release(input_protocols[0])
+        admission_controller.release(input_protocols[1])
+        
+        self.assertEqual(events, [("second", "queued"), ("third", "queued"), ("fourth", "rejected"), ("second", "admitted"), ("third", "admitted")])
+        self.assertEqual(admission_controller.get_statistics()["NUMBER_OF_CONNECTIONS"], 1)
+        self.assertEqual(admission_controller.get_statistics()["QUEUE_SIZE"], 0)
+    
+    def test_release_queued(self):
+        events = []
+        admission_controller = create_admission_controller(1, 1)
+        
+        input_protocols = [InputProtocol(events, "first"), InputProtocol(events, "second")]
+        
+        for input_protocol in input_protocols:
+            admission_controller.admit(input_protocol)
+        
+        admission_controller.release(input_protocols[1])
+        admission_controller.release(input_protocols[0])
+        
+        self.assertEqual(events, [("second", "queued")])
+        self.assertEqual(admission_controller.get_statistics()["NUMBER_OF_CONNECTIONS"], 0)
+    
+    def test_server_not_paused(self):
+        events = []
+        admission_controller = create_admission_controller(1, 0)
+        
+        server = Server()
+        
+        admission_server = admission_controller.add_server(server, None)
+        admission_controller.admit(InputProtocol(events, "first"))
+        
+        self.assertFalse(admission_controller.paused)
+        self.assertEqual(admission_controller.get_statistics()["NUMBER_OF_PAUSES"], 0)
+        
+        admission_server.close()
+        
+        self.assertTrue(server.closed)
+        self.assertEqual(admission_controller.servers, [])
+    
+    @unittest.skipUnless(twunnel3.compat.create_server_start_serving, "requires start_serving")
+    def test_server_paused(self):
+        events = []
+        admission_controller = create_admission_controller(1, 0)
+        
+        server = self.loop.run_until_complete(self.loop.create_server(asyncio.Protocol, "127.0.0.1", 0, start_serving=False))
+        
+        admission_server = admission_controller.add_server(server, asyncio.Protocol)
+        
+        input_protocol = InputProtocol(events, "first")
+        
+        admission_controller.admit(input_protocol)
+        
+        self.assertTrue(admission_controller.paused)
+        self.assertEqual(admission_server.accept_state, 2)
+        self.assertFalse(admission_controller.is_accepting())
+        
+        admission_controller.release(input_protocol)
+        
+        self.assertFalse(admission_controller.paused)
+        self.assertEqual(admission_server.accept_state, 1)
+        self.assertTrue(admission_controller.is_accepting())
+        
+        admission_server.close()
+        
+        self.loop.run_until_complete(admission_server.wait_closed())
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,121 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import unittest
+from twunnel3 import bandwidth, logger
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+def create_token_bucket(rate, burst=0, parent=None):
+    bandwidth_configuration = \
+    {
+        "BANDWIDTH":
+        {
+            "RATE": rate,
+            "BURST": burst
+        }
+    }
+    
+    bandwidth.set_default_configuration(bandwidth_configuration, ["BANDWIDTH"])
+    
+    return bandwidth.TokenBucket(bandwidth_configuration["BANDWIDTH"], parent)
+
+class TokenBucketTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+        self.time = 1000.0
+        self.loop.time = lambda: self.time
+    
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def test_unlimited(self):
+        token_bucket = create_token_bucket(0)
+        token_bucket.consume(65536)
+        
+        self.assertFalse(token_bucket.is_limited())
+        self.assertFalse(token_bucket.wait(lambda: None))
+        self.assertEqual(token_bucket.get_statistics()["NUMBER_OF_BYTES"], 65536)
+    
+    def test_burst(self):
+        token_bucket = create_token_bucket(1000, 4000)
+        token_bucket.consume(4000)
+        
+        self.assertFalse(token_bucket.wait(lambda: None))
+        
+        token_bucket.consume(1)
+        
+        self.assertTrue(token_bucket.wait(lambda: None))
+    
+    def test_refill_while_waiting(self):
+        callbacks = []
+        
+        token_bucket = create_token_bucket(1000)
+        token_bucket.consume(3000)
+        
+        self.assertAlmostEqual(token_bucket.get_delay(), 2.0)
+        self.assertTrue(token_bucket.wait(lambda: callbacks.append("first")))
+        self.assertTrue(token_bucket.wait(lambda: callbacks.append("second")))
+        self.assertEqual(token_bucket.get_statistics()["NUMBER_OF_WAITING_CONNECTIONS"], 2)
+        
+        self.time = self.time + 1.5
+        token_bucket.process_callbacks()
+        
+        self.assertEqual(callbacks, [])
+        self.assertIsNotNone(token_bucket.callback_handle)
+        self.assertAlmostEqual(token_bucket.get_delay(), 0.5)
+        
+        self.time = self.time + 0.5
+        token_bucket.process_callbacks()
+        
+        self.assertEqual(callbacks, ["first", "second"])
+        self.assertEqual(token_bucket.get_statistics()["NUMBER_OF_WAITING_CONNECTIONS"], 0)
+        self.assertEqual(token_bucket.get_statistics()["NUMBER_OF_PAUSES"], 2)
+    
+    def test_refill_up_to_burst(self):
+        token_bucket = create_token_bucket(1000, 2000)
+        token_bucket.consume(2000)
+        
+        self.time = self.time + 60
+        
+        self.assertEqual(token_bucket.get_statistics()["TOKENS"], 2000)
+    
+    def test_limited_parent(self):
+        callbacks = []
+        
+        parent_token_bucket = create_token_bucket(1000)
+        token_bucket = create_token_bucket(0, 0, parent_token_bucket)
+        token_bucket.consume(2000)
+        
+        self.assertTrue(token_bucket.is_limited())
+        self.assertEqual(parent_token_bucket.get_statistics()["NUMBER_OF_BYTES"], 2000)
+        self.assertTrue(token_bucket.wait(lambda: callbacks.append("callback")))
+        self.assertEqual(parent_token_bucket.get_statistics()["NUMBER_OF_WAITING_CONNECTIONS"], 1)
+        self.assertEqual(token_bucket.get_statistics()["NUMBER_OF_WAITING_CONNECTIONS"], 0)
+    
+    def test_wait_for_slowest(self):
+        parent_token_bucket = create_token_bucket(1000)
+        token_bucket = create_token_bucket(100, 0, parent_token_bucket)
+        token_bucket.consume(1100)
+        
+        self.assertTrue(token_bucket.wait(lambda: None))
+        self.assertEqual(token_bucket.get_statistics()["NUMBER_OF_WAITING_CONNECTIONS"], 1)
+        self.assertEqual(parent_token_bucket.get_statistics()["NUMBER_OF_WAITING_CONNECTIONS"], 0)
+        self.assertIsNotNone(token_bucket.callback_handle)
+        self.assertAlmostEqual(token_bucket.get_delay(), 10.0)
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
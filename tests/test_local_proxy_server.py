@@ -0,0 +1,347 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import gc
+import socket
+import struct
+import time
+import unittest
+from twunnel3 import admission, local_proxy_server, logger, proxy_server
+from twunnel3.local_proxy_server__https import HTTPSInputProtocolFactory
+from twunnel3.local_proxy_server__socks4 import SOCKS4InputProtocolFactory
+from twunnel3.local_proxy_server__socks5 import SOCKS5InputProtocolFactory, create_socks5_server
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+class Transport(object):
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+    
+    def write(self, data):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def pause_reading(self):
+        self.events.append(("input_transport.pause_reading",))
+    
+    def resume_reading(self):
+        self.events.append(("input_transport.resume_reading",))
+    
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+    
+    def get_write_buffer_size(self):
+        return 0
+    
+    def get_extra_info(self, name, default=None):
+        return default
+
+class OutputProtocol(object):
+    def __init__(self, events):
+        self.events = events
+        self.relay = None
+    
+    def input_protocol__connection_made(self, transport):
+        pass
+    
+    def input_protocol__connection_lost(self, exception):
+        pass
+    
+    def input_protocol__data_received(self, data):
+        self.events.append(("output_protocol.data", bytes(data)))
+
+class OutputProtocolConnectionManager(object):
+    def __init__(self, events):
+        self.events = events
+        self.admission_controller = self
+        self.maximum_early_data_length = 0
+    
+    def input_protocol__connection_made(self, input_protocol):
+        input_protocol.admission_state = 1
+    
+    def input_protocol__connection_lost(self, input_protocol):
+        pass
+    
+    def input_protocol__handshake_failed(self, input_protocol, reason):
+        self.events.append(("handshake_failed", reason))
+    
+    def input_protocol__early_data_received(self, input_protocol, data_length):
+        self.maximum_early_data_length = max(self.maximum_early_data_length, data_length)
+    
+    def connect(self, remote_address, remote_port, input_protocol):
+        self.events.append(("connect", remote_address, remote_port))
+        
+        input_protocol.output_protocol = OutputProtocol(self.events)
+    
+    def admit_account(self, name):
+        return True
+    
+    def release_account(self, name):
+        pass
+
+class ServerProtocol(asyncio.Protocol):
+    def __init__(self, server_protocols):
+        self.server_protocols = server_protocols
+        self.data_length = 0
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        
+        self.server_protocols.append(self)
+    
+    def data_received(self, data):
+        if self.data_length == 0:
+            self.transport.pause_reading()
+        
+        self.data_length = self.data_length + len(data)
+
+class ClientProtocol(asyncio.Protocol):
+    def __init__(self):
+        self.data = b""
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        self.data = self.data + data
+
+class OutputProtocolConnectionManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+    
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def test_release_after_close(self):
+        server_configuration = \
+        {
+            "PROXY_SERVERS": [],
+            "RESOLVER":
+            {
+                "TTL": 17
+            },
+            "LOCAL_PROXY_SERVER":
+            {
+                "TYPE": "SOCKS5",
+                "ADDRESS": "127.0.0.1",
+                "PORT": 0
+            }
+        }
+        
+        gc.collect()
+        
+        number_of_output_protocol_connection_managers = len(local_proxy_server.output_protocol_connection_managers)
+        number_of_admission_controllers = len(admission.get_admission_controller().admission_controllers)
+        number_of_resolvers = len(proxy_server.resolvers)
+        
+        server = self.loop.run_until_complete(local_proxy_server.create_server(server_configuration))
+        
+        self.assertEqual(len(local_proxy_server.output_protocol_connection_managers), number_of_output_protocol_connection_managers + 1)
+        self.assertEqual(len(admission.get_admission_controller().admission_controllers), number_of_admission_controllers + 1)
+        self.assertEqual(len(proxy_server.resolvers), number_of_resolvers + 1)
+        
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+        
+        server = None
+        gc.collect()
+        
+        self.assertEqual(len(local_proxy_server.output_protocol_connection_managers), number_of_output_protocol_connection_managers)
+        self.assertEqual(len(admission.get_admission_controller().admission_controllers), number_of_admission_controllers)
+        self.assertEqual(len(proxy_server.resolvers), number_of_resolvers)
+
+class InputProtocolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+    
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def create_input_protocol(self, type, input_protocol_factory_class, maximum_early_data_length, events):
+        server_configuration = \
+        {
+            "LOCAL_PROXY_SERVER":
+            {
+                "TYPE": type,
+                "EARLY_DATA":
+                {
+                    "MAXIMUM_LENGTH": maximum_early_data_length
+                }
+            }
+        }
+        
+        local_proxy_server.set_default_configuration(server_configuration, ["PROXY_SERVERS", "LOCAL_PROXY_SERVER"])
+        
+        output_protocol_connection_manager = OutputProtocolConnectionManager(events)
+        
+        input_protocol = input_protocol_factory_class(server_configuration, output_protocol_connection_manager)()
+        input_protocol.connection_made(Transport(events))
+        
+        return input_protocol
+    
+    def assert_early_data(self, type, input_protocol_factory_class, request):
+        events = []
+        
+        input_protocol = self.create_input_protocol(type, input_protocol_factory_class, 1000, events)
+        input_protocol.data_received(request)
+        input_protocol.data_received(b"a" * 600)
+        
+        self.assertEqual(events, [("connect", "example.com", 443)])
+        
+        input_protocol.data_received(b"b" * 600)
+        
+        self.assertEqual(events, [("connect", "example.com", 443), ("input_transport.pause_reading",)])
+        
+        # data that was already read when reading was paused is still buffered
+        input_protocol.data_received(b"c" * 100)
+        
+        self.assertEqual(events, [("connect", "example.com", 443), ("input_transport.pause_reading",)])
+        self.assertEqual(input_protocol.output_protocol_connection_manager.maximum_early_data_length, 1300)
+        
+        input_protocol.output_protocol__connection_made(input_protocol.transport)
+        input_protocol.data_received(b"d")
+        
+        self.assertEqual(events, [("connect", "example.com", 443), ("input_transport.pause_reading",), ("input_transport.resume_reading",), ("output_protocol.data", b"a" * 600 + b"b" * 600 + b"c" * 100), ("output_protocol.data", b"d")])
+        
+        input_protocol.transport.closed = True
+        input_protocol.connection_lost(None)
+    
+    def assert_unlimited_early_data(self, type, input_protocol_factory_class, request):
+        events = []
+        
+        input_protocol = self.create_input_protocol(type, input_protocol_factory_class, 0, events)
+        input_protocol.data_received(request + b"a" * 100000)
+        input_protocol.output_protocol__connection_made(input_protocol.transport)
+        
+        self.assertEqual(events, [("connect", "example.com", 443), ("output_protocol.data", b"a" * 100000)])
+        
+        input_protocol.transport.closed = True
+        input_protocol.connection_lost(None)
+    
+    def test_socks4_early_data(self):
+        request = struct.pack("!BBH", 0x04, 0x01, 443) + socket.inet_aton("0.0.0.1") + b"\x00" + b"example.com\x00"
+        
+        self.assert_early_data("SOCKS4", SOCKS4InputProtocolFactory, request)
+        self.assert_unlimited_early_data("SOCKS4", SOCKS4InputProtocolFactory, request)
+    
+    def test_socks5_early_data(self):
+        request = struct.pack("!BBB", 0x05, 0x01, 0x00) + struct.pack("!BBBBB", 0x05, 0x01, 0x00, 0x03, len(b"example.com")) + b"example.com" + struct.pack("!H", 443)
+        
+        self.assert_early_data("SOCKS5", SOCKS5InputProtocolFactory, request)
+        self.assert_unlimited_early_data("SOCKS5", SOCKS5InputProtocolFactory, request)
+    
+    def test_https_early_data(self):
+        request = b"CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n"
+        
+        self.assert_early_data("HTTPS", HTTPSInputProtocolFactory, request)
+        self.assert_unlimited_early_data("HTTPS", HTTPSInputProtocolFactory, request)
+
+class OutputProtocolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+    
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def wait(self, condition):
+        start_time = time.time()
+        
+        while not condition() and time.time() - start_time < 10:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+        
+        self.assertTrue(condition())
+    
+    def test_backpressure(self):
+        server_configuration = \
+        {
+            "PROXY_SERVERS": [],
+            "LOCAL_PROXY_SERVER":
+            {
+                "TYPE": "SOCKS5",
+                "ADDRESS": "127.0.0.1",
+                "PORT": 0,
+                "WRITE_BUFFER":
+                {
+                    "HIGH_WATER_MARK": 4096,
+                    "LOW_WATER_MARK": 1024
+                }
+            }
+        }
+        
+        local_proxy_server.set_default_configuration(server_configuration, ["PROXY_SERVERS", "POOL", "RESOLVER", "LOCAL_PROXY_SERVER", "REMOTE_PROXY_SERVERS", "BALANCER"])
+        
+        server_protocols = []
+        
+        server = self.loop.run_until_complete(self.loop.create_server(lambda: ServerProtocol(server_protocols), "127.0.0.1", 0))
+        server_port = server.sockets[0].getsockname()[1]
+        
+        output_protocol_connection_manager = local_proxy_server.OutputProtocolConnectionManager(server_configuration)
+        
+        proxy_server = self.loop.run_until_complete(create_socks5_server(server_configuration, output_protocol_connection_manager))
+        proxy_server_port = proxy_server.sockets[0].getsockname()[1]
+        
+        client_transport, client_protocol = self.loop.run_until_complete(self.loop.create_connection(ClientProtocol, "127.0.0.1", proxy_server_port))
+        client_transport.write(struct.pack("!BBB", 0x05, 0x01, 0x00) + struct.pack("!BBBB", 0x05, 0x01, 0x00, 0x01) + socket.inet_aton("127.0.0.1") + struct.pack("!H", server_port))
+        
+        self.wait(lambda: len(client_protocol.data) == 12)
+        
+        input_protocol = list(output_protocol_connection_manager.input_protocols)[0]
+        
+        self.assertEqual(input_protocol.transport.get_write_buffer_limits(), (1024, 4096))
+        self.assertEqual(input_protocol.output_protocol.transport.get_write_buffer_limits(), (1024, 4096))
+        
+        # the server reads the first chunk only, the rest must stay in the socket buffers of the client
+        data_length = 32 * 1024 * 1024
+        
+        client_transport.write(b"\x00" * data_length)
+        
+        self.wait(lambda: len(server_protocols) == 1 and server_protocols[0].data_length > 0)
+        
+        i = 0
+        while i < 50:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+            
+            i = i + 1
+        
+        self.assertLessEqual(output_protocol_connection_manager.get_statistics()["WRITE_BUFFER_SIZE"], 4096 + 256 * 1024)
+        self.assertGreater(client_transport.get_write_buffer_size(), 0)
+        
+        server_protocols[0].transport.resume_reading()
+        
+        self.wait(lambda: server_protocols[0].data_length == data_length)
+        
+        self.assertEqual(output_protocol_connection_manager.get_statistics()["WRITE_BUFFER_SIZE"], 0)
+        
+        client_transport.close()
+        
+        self.wait(lambda: output_protocol_connection_manager.number_of_connections == 0)
+        
+        proxy_server.close()
+        self.loop.run_until_complete(proxy_server.wait_closed())
+        
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
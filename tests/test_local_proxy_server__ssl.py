@@ -0,0 +1,167 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import ssl
+import time
+import unittest
+from twunnel3 import local_proxy_server__ssl, logger
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+class SSLSession(object):
+    def __init__(self, timeout=300, has_ticket=True):
+        self.time = int(time.time())
+        self.timeout = timeout
+        self.has_ticket = has_ticket
+
+class SSLObject(object):
+    def __init__(self, ssl_session, ssl_version="TLSv1.3", session_reused=False):
+        self.session = ssl_session
+        self.ssl_version = ssl_version
+        self.session_reused = session_reused
+    
+    def version(self):
+        return self.ssl_version
+
+def create_server_ssl_context(ssl_context_class=ssl.SSLContext):
+    ssl_context = ssl_context_class(ssl.PROTOCOL_SSLv23)
+    # the example certificate is signed with SHA-1
+    ssl_context.set_ciphers("DEFAULT:@SECLEVEL=0")
+    ssl_context.load_cert_chain(os.path.join(os.path.dirname(__file__), "..", "examples", "files", "SSL", "C.pem"), os.path.join(os.path.dirname(__file__), "..", "examples", "files", "SSL", "CK.pem"))
+    
+    return ssl_context
+
+def create_client_ssl_context():
+    ssl_context = local_proxy_server__ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    ssl_context.verify_mode = ssl.CERT_NONE
+    
+    return ssl_context
+
+def handshake(client_ssl_context, server_ssl_context):
+    client_input = ssl.MemoryBIO()
+    client_output = ssl.MemoryBIO()
+    client_ssl_object = client_ssl_context.wrap_bio(client_input, client_output, server_hostname="127.0.0.1")
+    
+    server_input = ssl.MemoryBIO()
+    server_output = ssl.MemoryBIO()
+    server_ssl_object = server_ssl_context.wrap_bio(server_input, server_output, server_side=True)
+    
+    i = 0
+    while i < 10:
+        for ssl_object in [client_ssl_object, server_ssl_object]:
+            try:
+                ssl_object.do_handshake()
+            except ssl.SSLWantReadError:
+                pass
+        
+        server_input.write(client_output.read())
+        client_input.write(server_output.read())
+        
+        i = i + 1
+    
+    # TLS 1.3 session tickets arrive after the handshake
+    try:
+        client_ssl_object.read(1)
+    except ssl.SSLWantReadError:
+        pass
+    
+    return client_ssl_object
+
+class SSLSessionCacheTestCase(unittest.TestCase):
+    def test_handshake_pending(self):
+        ssl_session_cache = local_proxy_server__ssl.SSLSessionCache()
+        
+        ssl_object = SSLObject(SSLSession(), None)
+        ssl_session_cache.add_ssl_object(ssl_object)
+        
+        self.assertIsNone(ssl_session_cache.get_ssl_session())
+        self.assertEqual(ssl_session_cache.get_statistics(), {"NUMBER_OF_HITS": 0, "NUMBER_OF_MISSES": 0})
+        
+        ssl_object.ssl_version = "TLSv1.3"
+        
+        self.assertIs(ssl_session_cache.get_ssl_session(), ssl_object.session)
+        self.assertEqual(ssl_session_cache.get_statistics(), {"NUMBER_OF_HITS": 0, "NUMBER_OF_MISSES": 1})
+        self.assertEqual(ssl_session_cache.ssl_objects, [])
+    
+    def test_ticket_pending(self):
+        ssl_session_cache = local_proxy_server__ssl.SSLSessionCache()
+        
+        ssl_object = SSLObject(SSLSession(has_ticket=False))
+        ssl_session_cache.add_ssl_object(ssl_object)
+        
+        self.assertIsNone(ssl_session_cache.get_ssl_session())
+        self.assertEqual(len(ssl_session_cache.ssl_objects), 1)
+        
+        ssl_object.session = SSLSession()
+        
+        self.assertIs(ssl_session_cache.get_ssl_session(), ssl_object.session)
+        self.assertEqual(ssl_session_cache.get_statistics(), {"NUMBER_OF_HITS": 0, "NUMBER_OF_MISSES": 1})
+    
+    def test_ticket_not_required(self):
+        ssl_session_cache = local_proxy_server__ssl.SSLSessionCache()
+        
+        ssl_object = SSLObject(SSLSession(has_ticket=False), "TLSv1.2", True)
+        ssl_session_cache.add_ssl_object(ssl_object)
+        
+        self.assertIs(ssl_session_cache.get_ssl_session(), ssl_object.session)
+        self.assertEqual(ssl_session_cache.get_statistics(), {"NUMBER_OF_HITS": 1, "NUMBER_OF_MISSES": 0})
+    
+    def test_expired(self):
+        ssl_session_cache = local_proxy_server__ssl.SSLSessionCache()
+        
+        ssl_session = SSLSession(0)
+        ssl_session_cache.add_ssl_object(SSLObject(ssl_session))
+        
+        self.assertIsNone(ssl_session_cache.get_ssl_session())
+        self.assertIsNone(ssl_session_cache.ssl_session)
+    
+    def test_maximum_number_of_ssl_objects(self):
+        ssl_session_cache = local_proxy_server__ssl.SSLSessionCache(2)
+        
+        ssl_objects = [SSLObject(None, None), SSLObject(None, None), SSLObject(None, None)]
+        
+        for ssl_object in ssl_objects:
+            ssl_session_cache.add_ssl_object(ssl_object)
+        
+        self.assertEqual([ssl_object[0] for ssl_object in ssl_session_cache.ssl_objects], ssl_objects[1:])
+
+@unittest.skipUnless(hasattr(ssl, "SSLSession") and hasattr(ssl, "MemoryBIO"), "requires ssl.SSLSession")
+class SSLContextTestCase(unittest.TestCase):
+    def test_resume(self):
+        server_ssl_context = create_server_ssl_context()
+        client_ssl_context = create_client_ssl_context()
+        
+        ssl_object = handshake(client_ssl_context, server_ssl_context)
+        
+        self.assertFalse(ssl_object.session_reused)
+        self.assertEqual(client_ssl_context.ssl_session_cache.get_statistics(), {"NUMBER_OF_HITS": 0, "NUMBER_OF_MISSES": 1})
+        
+        ssl_object = handshake(client_ssl_context, server_ssl_context)
+        
+        self.assertTrue(ssl_object.session_reused)
+        
+        ssl_object = handshake(client_ssl_context, server_ssl_context)
+        
+        self.assertTrue(ssl_object.session_reused)
+        self.assertEqual(client_ssl_context.ssl_session_cache.get_statistics(), {"NUMBER_OF_HITS": 2, "NUMBER_OF_MISSES": 1})
+    
+    def test_server_side(self):
+        server_ssl_context = create_server_ssl_context(local_proxy_server__ssl.SSLContext)
+        client_ssl_context = create_client_ssl_context()
+        
+        handshake(client_ssl_context, server_ssl_context)
+        
+        self.assertEqual(server_ssl_context.ssl_session_cache.ssl_objects, [])
+        self.assertIsNone(server_ssl_context.ssl_session_cache.ssl_session)
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
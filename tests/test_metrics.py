@@ -0,0 +1,70 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+from twunnel3 import logger
+from twunnel3.metrics import MetricsProtocol
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+class Transport(object):
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+    
+    def write(self, data):
+        self.data = self.data + data
+    
+    def close(self):
+        self.closed = True
+
+def get_response_status(chunks):
+    transport = Transport()
+    
+    protocol = MetricsProtocol()
+    protocol.connection_made(transport)
+    
+    i = 0
+    while i < len(chunks):
+        protocol.data_received(chunks[i])
+        
+        i = i + 1
+    
+    if not transport.closed:
+        return None
+    
+    return transport.data[:transport.data.find(b"\r\n")]
+
+class MetricsProtocolTestCase(unittest.TestCase):
+    def test_metrics(self):
+        self.assertEqual(get_response_status([b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n"]), b"HTTP/1.1 200 OK")
+    
+    def test_query_string(self):
+        self.assertEqual(get_response_status([b"GET /metrics?name=value HTTP/1.1\r\n\r\n"]), b"HTTP/1.1 200 OK")
+    
+    def test_extra_spaces(self):
+        self.assertEqual(get_response_status([b"GET  /metrics  HTTP/1.0\r\n\r\n"]), b"HTTP/1.1 200 OK")
+    
+    def test_split_request(self):
+        self.assertEqual(get_response_status([b"GET /metrics HTTP/1.1\r", b"\n\r", b"\n"]), b"HTTP/1.1 200 OK")
+    
+    def test_incomplete_request(self):
+        self.assertEqual(get_response_status([b"GET /metrics HTTP/1.1\r\n"]), None)
+    
+    def test_not_found(self):
+        self.assertEqual(get_response_status([b"GET /other HTTP/1.1\r\n\r\n"]), b"HTTP/1.1 404 Not Found")
+    
+    def test_method_not_allowed(self):
+        self.assertEqual(get_response_status([b"POST /metrics HTTP/1.1\r\n\r\n"]), b"HTTP/1.1 405 Method Not Allowed")
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,252 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import struct
+import unittest
+from twunnel3 import logger, multiplexer
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+class Transport(object):
+    def __init__(self):
+        self.data = []
+        self.closed = False
+    
+    def write(self, data):
+        self.data.append(bytes(data))
+    
+    def close(self):
+        self.closed = True
+    
+    def get_extra_info(self, name, default=None):
+        return default
+
+class Protocol(object):
+    def __init__(self, events, name, reading=True):
+        self.events = events
+        self.name = name
+        self.reading = reading
+        self.data = b""
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        
+        self.events.append((self.name, "connection_made"))
+        
+        if not self.reading:
+            self.transport.pause_reading()
+    
+    def data_received(self, data):
+        self.data = self.data + data
+    
+    def pause_writing(self):
+        self.events.append((self.name, "pause_writing"))
+    
+    def resume_writing(self):
+        self.events.append((self.name, "resume_writing"))
+    
+    def connection_lost(self, exception):
+        self.events.append((self.name, "connection_lost"))
+
+def create_multiplexer_configuration(window_size, frame_size):
+    multiplexer_configuration = \
+    {
+        "MULTIPLEXER":
+        {
+            "WINDOW_SIZE": window_size,
+            "FRAME_SIZE": frame_size
+        }
+    }
+    
+    multiplexer.set_default_configuration(multiplexer_configuration, ["MULTIPLEXER"])
+    
+    return multiplexer_configuration
+
+class MultiplexerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+        self.events = []
+        self.server_protocols = []
+    
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def create_multiplexers(self, window_size=65536, frame_size=16384, reading=True):
+        multiplexer_configuration = create_multiplexer_configuration(window_size, frame_size)
+        
+        def create_server_protocol():
+            server_protocol = Protocol(self.events, "server", reading)
+            
+            self.server_protocols.append(server_protocol)
+            
+            return server_protocol
+        
+        self.client_transport = Transport()
+        self.client_multiplexer = multiplexer.MultiplexerProtocol(multiplexer_configuration, None)
+        self.client_multiplexer.connection_made(self.client_transport)
+        
+        self.server_transport = Transport()
+        self.server_multiplexer = multiplexer.MultiplexerProtocol(multiplexer_configuration, create_server_protocol)
+        self.server_multiplexer.connection_made(self.server_transport)
+    
+    def pump(self):
+        while True:
+            self.loop.run_until_complete(asyncio.sleep(0))
+            
+            client_data = b"".join(self.client_transport.data)
+            self.client_transport.data = []
+            
+            server_data = b"".join(self.server_transport.data)
+            self.server_transport.data = []
+            
+            if len(client_data) == 0 and len(server_data) == 0:
+                break
+            
+            if len(client_data) > 0:
+                self.server_multiplexer.data_received(client_data)
+            
+            if len(server_data) > 0:
+                self.client_multiplexer.data_received(server_data)
+    
+    def test_data(self):
+        self.create_multiplexers()
+        
+        client_protocol = Protocol(self.events, "client")
+        client_stream = self.client_multiplexer.create_stream(lambda: client_protocol)
+        client_stream.write(b"request")
+        
+        self.pump()
+        
+        self.server_protocols[0].transport.write(b"response")
+        
+        self.pump()
+        
+        self.assertEqual(self.server_protocols[0].data, b"request")
+        self.assertEqual(client_protocol.data, b"response")
+    
+    def test_window_exhaustion(self):
+        self.create_multiplexers(reading=False)
+        
+        data = bytes(bytearray(i % 251 for i in range(150000)))
+        
+        client_protocol = Protocol(self.events, "client")
+        client_stream = self.client_multiplexer.create_stream(lambda: client_protocol)
+        client_stream.write(data)
+        
+        self.pump()
+        
+        server_stream = self.server_protocols[0].transport
+        
+        self.assertEqual(client_stream.output_window, 0)
+        self.assertEqual(len(client_stream.output_data), len(data) - multiplexer.INITIAL_WINDOW_SIZE)
+        self.assertEqual(len(server_stream.input_data), multiplexer.INITIAL_WINDOW_SIZE)
+        self.assertEqual(self.server_protocols[0].data, b"")
+        
+        server_stream.resume_reading()
+        
+        self.pump()
+        
+        self.assertEqual(self.server_protocols[0].data, data)
+        self.assertEqual(len(client_stream.output_data), 0)
+        self.assertEqual(self.events, [("client", "connection_made"), ("client", "pause_writing"), ("server", "connection_made"), ("client", "resume_writing")])
+    
+    def test_window_size(self):
+        self.create_multiplexers(window_size=262144, reading=False)
+        
+        client_protocol = Protocol(self.events, "client")
+        client_stream = self.client_multiplexer.create_stream(lambda: client_protocol)
+        client_stream.write(b"\x00" * 300000)
+        
+        self.pump()
+        
+        self.assertEqual(len(self.server_protocols[0].transport.input_data), 262144)
+        self.assertEqual(len(client_stream.output_data), 300000 - 262144)
+    
+    def test_window_violation(self):
+        self.create_multiplexers(reading=False)
+        
+        client_protocol = Protocol(self.events, "client")
+        self.client_multiplexer.create_stream(lambda: client_protocol)
+        
+        self.pump()
+        
+        frame_data = b"\x00" * 60000
+        
+        self.server_multiplexer.data_received(struct.pack(multiplexer.FRAME_HEADER_FORMAT, multiplexer.FRAME_TYPE_DATA, 1, len(frame_data)) + frame_data)
+        
+        self.assertFalse(self.server_transport.closed)
+        
+        self.server_multiplexer.data_received(struct.pack(multiplexer.FRAME_HEADER_FORMAT, multiplexer.FRAME_TYPE_DATA, 1, len(frame_data)) + frame_data)
+        
+        self.assertTrue(self.server_transport.closed)
+    
+    def test_frame_size(self):
+        self.create_multiplexers(frame_size=1000)
+        
+        client_protocol = Protocol(self.events, "client")
+        client_stream = self.client_multiplexer.create_stream(lambda: client_protocol)
+        client_stream.write(b"\x00" * 2500)
+        
+        self.loop.run_until_complete(asyncio.sleep(0))
+        
+        frames = b"".join(self.client_transport.data)
+        
+        frame_lengths = []
+        
+        i = 0
+        while i < len(frames):
+            frame_type, stream_id, frame_length = struct.unpack_from(multiplexer.FRAME_HEADER_FORMAT, frames, i)
+            
+            if frame_type == multiplexer.FRAME_TYPE_DATA:
+                frame_lengths.append(frame_length)
+            
+            i = i + multiplexer.FRAME_HEADER_LENGTH + frame_length
+        
+        self.assertEqual(frame_lengths, [1000, 1000, 500])
+    
+    def test_close(self):
+        self.create_multiplexers()
+        
+        client_protocol = Protocol(self.events, "client")
+        client_stream = self.client_multiplexer.create_stream(lambda: client_protocol)
+        client_stream.write(b"request")
+        client_stream.close()
+        
+        self.pump()
+        
+        self.assertEqual(self.server_protocols[0].data, b"request")
+        self.assertEqual(sorted(self.events), [("client", "connection_lost"), ("client", "connection_made"), ("server", "connection_lost"), ("server", "connection_made")])
+        self.assertEqual(self.client_multiplexer.streams, {})
+        self.assertEqual(self.server_multiplexer.streams, {})
+    
+    def test_connection_lost(self):
+        self.create_multiplexers()
+        
+        client_protocol = Protocol(self.events, "client")
+        self.client_multiplexer.create_stream(lambda: client_protocol)
+        
+        self.pump()
+        
+        self.client_multiplexer.connection_lost(None)
+        self.server_multiplexer.connection_lost(None)
+        
+        self.pump()
+        
+        self.assertEqual(sorted(self.events), [("client", "connection_lost"), ("client", "connection_made"), ("server", "connection_lost"), ("server", "connection_made")])
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,463 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import socket
+import time
+import twunnel3.proxy_server__socks5
+import unittest
+from twunnel3 import local_proxy_server, logger, proxy_server
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+class SOCKS5ServerProtocol(asyncio.Protocol):
+    def __init__(self, events):
+        self.events = events
+        self.data = b""
+        self.data_state = 0
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        
+        self.events.append(("server.connection_made",))
+    
+    def data_received(self, data):
+        self.data = self.data + data
+        
+        if self.data_state == 0:
+            if len(self.data) < 2 or len(self.data) < 2 + self.data[1]:
+                return
+            
+            methods = self.data[2:2 + self.data[1]]
+            
+            self.data = self.data[2 + self.data[1]:]
+            
+            if 0x00 not in methods:
+                self.events.append(("server.method_rejected",))
+                
+                self.transport.write(b"\x05\xff")
+                self.transport.close()
+                
+                return
+            
+            self.transport.write(b"\x05\x00")
+            
+            self.data_state = 1
+        
+        if self.data_state == 1:
+            if len(self.data) < 5 or len(self.data) < 7 + self.data[4]:
+                return
+            
+            self.events.append(("server.request", self.data[5:5 + self.data[4]]))
+            
+            self.data = self.data[7 + self.data[4]:]
+            
+            self.transport.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+            
+            self.data_state = 2
+        
+        if self.data_state == 2:
+            if len(self.data) > 0:
+                self.transport.write(self.data)
+                
+                self.data = b""
+
+class OutputProtocol(asyncio.Protocol):
+    def __init__(self, events, future):
+        self.events = events
+        self.future = future
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        
+        self.events.append(("output_protocol.connection_made",))
+        
+        self.transport.write(b"data")
+    
+    def data_received(self, data):
+        self.events.append(("output_protocol.data", data))
+        
+        if not self.future.done():
+            self.future.set_result(self)
+
+class OutputProtocolFactory(object):
+    def __init__(self, events, future):
+        self.events = events
+        self.future = future
+    
+    def __call__(self):
+        return OutputProtocol(self.events, self.future)
+    
+    def connection_failed(self, exception):
+        self.events.append(("output_protocol_factory.connection_failed",))
+        
+        if not self.future.done():
+            self.future.set_result(None)
+
+class EchoServerProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        self.transport.write(data)
+
+class RejectingServerProtocol(asyncio.Protocol):
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def data_received(self, data):
+        self.transport.write(b"\x05\xff")
+        self.transport.close()
+
+class Protocol(asyncio.Protocol):
+    def __init__(self, protocols):
+        self.protocols = protocols
+        self.transport = None
+        
+        self.protocols.append(self)
+    
+    def connection_made(self, transport):
+        self.transport = transport
+
+def create_resolver_configuration(connection_attempt_delay):
+    resolver_configuration = \
+    {
+        "RESOLVER":
+        {
+            "CONNECTION_ATTEMPT_DELAY": connection_attempt_delay,
+            "ADDRESS_FAMILY": "IPV4"
+        }
+    }
+    
+    proxy_server.set_default_configuration(resolver_configuration, ["RESOLVER"])
+    
+    return resolver_configuration
+
+def get_free_port():
+    free_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    free_socket.bind(("127.0.0.1", 0))
+    port = free_socket.getsockname()[1]
+    free_socket.close()
+    
+    return port
+
+class TunnelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+        twunnel3.proxy_server__socks5.pipeline_failures.clear()
+    
+    def tearDown(self):
+        twunnel3.proxy_server__socks5.pipeline_failures.clear()
+        
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def test_rejected_pipeline(self):
+        events = []
+        
+        server = self.loop.run_until_complete(self.loop.create_server(lambda: SOCKS5ServerProtocol(events), "127.0.0.1", 0))
+        server_port = server.sockets[0].getsockname()[1]
+        
+        tunnel_configuration = \
+        {
+            "PROXY_SERVERS":
+            [
+                {
+                    "TYPE": "SOCKS5",
+                    "ADDRESS": "127.0.0.1",
+                    "PORT": server_port,
+                    "ACCOUNT":
+                    {
+                        "NAME": "name",
+                        "PASSWORD": "password"
+                    },
+                    "PIPELINE": True
+                }
+            ]
+        }
+        
+        tunnel = proxy_server.create_tunnel(tunnel_configuration)
+        
+        future = asyncio.Future()
+        
+        self.loop.run_until_complete(tunnel.create_connection(OutputProtocolFactory(events, future), "example.com", 443))
+        
+        output_protocol = self.loop.run_until_complete(asyncio.wait_for(future, 5))
+        
+        self.assertIsNotNone(output_protocol)
+        self.assertEqual(events, [("server.connection_made",), ("server.method_rejected",), ("server.connection_made",), ("server.request", b"example.com"), ("output_protocol.connection_made",), ("output_protocol.data", b"data")])
+        self.assertTrue(twunnel3.proxy_server__socks5.is_pipeline_failed(("127.0.0.1", server_port)))
+        
+        output_protocol.transport.close()
+        
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+
+class ResolverConnectionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+        self.sockets = []
+    
+    def tearDown(self):
+        for test_socket in self.sockets:
+            test_socket.close()
+        
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def create_server_socket(self):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind(("127.0.0.1", 0))
+        server_socket.listen(0)
+        
+        self.sockets.append(server_socket)
+        
+        return server_socket
+    
+    def create_blocked_server_socket(self):
+        server_socket = self.create_server_socket()
+        
+        # fill the accept queue so that the SYN of the next connection is dropped
+        i = 0
+        while i < 3:
+            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client_socket.setblocking(False)
+            client_socket.connect_ex(server_socket.getsockname())
+            
+            self.sockets.append(client_socket)
+            
+            i = i + 1
+        
+        time.sleep(0.1)
+        
+        return server_socket
+    
+    def set_addresses(self, resolver, address, port, ports):
+        addresses = []
+        for address_port in ports:
+            addresses.append((socket.AF_INET, socket.SOCK_STREAM, 0, "", ("127.0.0.1", address_port)))
+        
+        resolver.entries[(address, port, 0, socket.SOCK_STREAM, 0, 0)] = (self.loop.time() + 60, addresses, None)
+    
+    def test_race(self):
+        resolver_configuration = create_resolver_configuration(0.1)
+        resolver = proxy_server.get_resolver(resolver_configuration)
+        
+        blocked_server_socket = self.create_blocked_server_socket()
+        server_socket = self.create_server_socket()
+        
+        self.set_addresses(resolver, "example.com", 443, [blocked_server_socket.getsockname()[1], server_socket.getsockname()[1]])
+        
+        number_of_connection_attempts = resolver.number_of_connection_attempts
+        
+        protocols = []
+        
+        start_time = time.time()
+        
+        transport, protocol = self.loop.run_until_complete(asyncio.wait_for(proxy_server.create_connection(resolver_configuration, lambda: Protocol(protocols), "example.com", 443), 5))
+        
+        self.assertGreaterEqual(time.time() - start_time, 0.1)
+        self.assertLess(time.time() - start_time, 2)
+        self.assertEqual(transport.get_extra_info("peername"), server_socket.getsockname())
+        self.assertEqual(protocols, [protocol])
+        self.assertEqual(resolver.number_of_connection_attempts - number_of_connection_attempts, 2)
+        self.assertEqual(resolver.address_families["example.com"], socket.AF_INET)
+        
+        transport.close()
+        
+        self.loop.run_until_complete(asyncio.sleep(0))
+    
+    def test_refused(self):
+        resolver_configuration = create_resolver_configuration(10)
+        resolver = proxy_server.get_resolver(resolver_configuration)
+        
+        server_socket = self.create_server_socket()
+        
+        self.set_addresses(resolver, "example.com", 443, [get_free_port(), server_socket.getsockname()[1]])
+        
+        protocols = []
+        
+        start_time = time.time()
+        
+        transport, protocol = self.loop.run_until_complete(asyncio.wait_for(proxy_server.create_connection(resolver_configuration, lambda: Protocol(protocols), "example.com", 443), 5))
+        
+        self.assertLess(time.time() - start_time, 2)
+        self.assertEqual(transport.get_extra_info("peername"), server_socket.getsockname())
+        self.assertEqual(len(protocols), 1)
+        
+        transport.close()
+        
+        self.loop.run_until_complete(asyncio.sleep(0))
+    
+    def test_all_refused(self):
+        resolver_configuration = create_resolver_configuration(10)
+        resolver = proxy_server.get_resolver(resolver_configuration)
+        
+        self.set_addresses(resolver, "example.com", 443, [get_free_port(), get_free_port()])
+        
+        protocols = []
+        
+        future = proxy_server.create_connection(resolver_configuration, lambda: Protocol(protocols), "example.com", 443)
+        
+        self.assertRaises(ConnectionRefusedError, self.loop.run_until_complete, asyncio.wait_for(future, 5))
+        self.assertEqual(protocols, [])
+
+class TunnelTimingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+        self.tunnel_timings = []
+        
+        proxy_server.set_tunnel_timing_callback(self.tunnel_timings.append)
+    
+    def tearDown(self):
+        proxy_server.set_tunnel_timing_callback(None)
+        
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def create_local_proxy_server(self):
+        server_configuration = \
+        {
+            "PROXY_SERVERS": [],
+            "LOCAL_PROXY_SERVER":
+            {
+                "TYPE": "SOCKS5",
+                "ADDRESS": "127.0.0.1",
+                "PORT": 0
+            }
+        }
+        
+        return self.loop.run_until_complete(local_proxy_server.create_server(server_configuration))
+    
+    def test_hops(self):
+        events = []
+        
+        server = self.loop.run_until_complete(self.loop.create_server(EchoServerProtocol, "127.0.0.1", 0))
+        server_port = server.sockets[0].getsockname()[1]
+        
+        local_proxy_servers = [self.create_local_proxy_server(), self.create_local_proxy_server()]
+        
+        tunnel_configuration = \
+        {
+            "PROXY_SERVERS":
+            [
+                {
+                    "TYPE": "SOCKS5",
+                    "ADDRESS": "127.0.0.1",
+                    "PORT": local_proxy_servers[0].sockets[0].getsockname()[1]
+                },
+                {
+                    "TYPE": "SOCKS5",
+                    "ADDRESS": "127.0.0.1",
+                    "PORT": local_proxy_servers[1].sockets[0].getsockname()[1]
+                }
+            ]
+        }
+        
+        tunnel = proxy_server.create_tunnel(tunnel_configuration)
+        
+        future = asyncio.Future()
+        
+        start_time = time.time()
+        
+        self.loop.run_until_complete(tunnel.create_connection(OutputProtocolFactory(events, future), "127.0.0.1", server_port))
+        
+        output_protocol = self.loop.run_until_complete(asyncio.wait_for(future, 5))
+        
+        duration = time.time() - start_time
+        
+        self.assertEqual(events, [("output_protocol.connection_made",), ("output_protocol.data", b"data")])
+        self.assertEqual(len(self.tunnel_timings), 1)
+        
+        statistics = self.tunnel_timings[0]
+        
+        self.assertEqual([(hop["TYPE"], hop["ADDRESS"], hop["PORT"]) for hop in statistics["HOPS"]], [("SOCKS5", "127.0.0.1", tunnel_configuration["PROXY_SERVERS"][0]["PORT"]), ("SOCKS5", "127.0.0.1", tunnel_configuration["PROXY_SERVERS"][1]["PORT"])])
+        self.assertIsNone(statistics["TLS_HANDSHAKE_DURATION"])
+        
+        for key in ["CONNECTION_DURATION", "FIRST_BYTE_DURATION", "DURATION"]:
+            self.assertGreaterEqual(statistics[key], 0)
+            self.assertLessEqual(statistics[key], duration)
+        
+        hop_duration = 0
+        
+        for hop in statistics["HOPS"]:
+            self.assertAlmostEqual(hop["DURATION"], hop["NEGOTIATION_DURATION"] + hop["RESPONSE_DURATION"])
+            
+            hop_duration = hop_duration + hop["DURATION"]
+        
+        self.assertLessEqual(statistics["CONNECTION_DURATION"] + hop_duration, statistics["DURATION"] + 0.001)
+        
+        output_protocol.transport.close()
+        
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        
+        self.assertEqual(len(self.tunnel_timings), 1)
+        
+        i = 0
+        while i < len(local_proxy_servers):
+            local_proxy_servers[i].close()
+            self.loop.run_until_complete(local_proxy_servers[i].wait_closed())
+            
+            i = i + 1
+        
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+    
+    def test_failed_hop(self):
+        events = []
+        
+        server = self.loop.run_until_complete(self.loop.create_server(RejectingServerProtocol, "127.0.0.1", 0))
+        server_port = server.sockets[0].getsockname()[1]
+        
+        tunnel_configuration = \
+        {
+            "PROXY_SERVERS":
+            [
+                {
+                    "TYPE": "SOCKS5",
+                    "ADDRESS": "127.0.0.1",
+                    "PORT": server_port
+                }
+            ]
+        }
+        
+        tunnel = proxy_server.create_tunnel(tunnel_configuration)
+        
+        future = asyncio.Future()
+        
+        self.loop.run_until_complete(tunnel.create_connection(OutputProtocolFactory(events, future), "example.com", 443))
+        
+        self.assertIsNone(self.loop.run_until_complete(asyncio.wait_for(future, 5)))
+        self.assertEqual(len(self.tunnel_timings), 1)
+        
+        statistics = self.tunnel_timings[0]
+        
+        self.assertEqual(len(statistics["HOPS"]), 1)
+        self.assertIsNotNone(statistics["CONNECTION_DURATION"])
+        self.assertIsNone(statistics["HOPS"][0]["DURATION"])
+        self.assertIsNone(statistics["FIRST_BYTE_DURATION"])
+        self.assertIsNone(statistics["DURATION"])
+        self.assertEqual(events, [("output_protocol_factory.connection_failed",)])
+        
+        server.close()
+        self.loop.run_until_complete(server.wait_closed())
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
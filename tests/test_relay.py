@@ -0,0 +1,143 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import unittest
+from twunnel3 import logger
+from twunnel3.relay import BufferedRelay, BufferedRelayProtocol, BufferPool
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+class Protocol(object):
+    def __init__(self):
+        self.exception = None
+    
+    def connection_lost(self, exception):
+        self.exception = exception
+
+class Transport(object):
+    def __init__(self, sslcontext=None):
+        self.protocol = Protocol()
+        self.sslcontext = sslcontext
+        self.data = []
+        self.write_buffer_size = 0
+        self.reading = True
+    
+    def get_protocol(self):
+        return self.protocol
+    
+    def write(self, data):
+        self.data.append(data)
+    
+    def get_write_buffer_size(self):
+        return self.write_buffer_size
+    
+    def get_extra_info(self, name, default=None):
+        if name == "sslcontext":
+            return self.sslcontext
+        
+        return default
+    
+    def pause_reading(self):
+        self.reading = False
+    
+    def resume_reading(self):
+        self.reading = True
+
+def create_relay(input_transport, output_transport):
+    relay_configuration = \
+    {
+        "BUFFER":
+        {
+            "SIZES": [16, 64],
+            "MAXIMUM_NUMBER_OF_BUFFERS": 4
+        }
+    }
+    
+    relay = BufferedRelay(relay_configuration, input_transport, output_transport)
+    relay.buffer_pool = BufferPool(relay_configuration)
+    relay.input_protocol = BufferedRelayProtocol(relay, input_transport, output_transport, "upstream")
+    relay.output_protocol = BufferedRelayProtocol(relay, output_transport, input_transport, "downstream")
+    
+    return relay
+
+def receive_data(protocol, data):
+    buffer = protocol.get_buffer(-1)
+    buffer[:len(data)] = data
+    protocol.buffer_updated(len(data))
+
+class BufferedRelayProtocolTestCase(unittest.TestCase):
+    def test_write_buffer_when_sent(self):
+        input_transport = Transport()
+        output_transport = Transport()
+        relay = create_relay(input_transport, output_transport)
+        
+        receive_data(relay.input_protocol, b"data")
+        
+        self.assertEqual(len(output_transport.data), 1)
+        self.assertIsInstance(output_transport.data[0], memoryview)
+        self.assertEqual(output_transport.data[0], b"data")
+        self.assertEqual(relay.buffer_pool.get_statistics()["NUMBER_OF_USED_BUFFERS"], 0)
+    
+    def test_keep_buffer_until_sent(self):
+        input_transport = Transport()
+        output_transport = Transport()
+        relay = create_relay(input_transport, output_transport)
+        
+        output_transport.write = lambda data: (output_transport.data.append(data), setattr(output_transport, "write_buffer_size", len(data)))
+        
+        receive_data(relay.input_protocol, b"first")
+        receive_data(relay.input_protocol, b"second")
+        
+        self.assertIsInstance(output_transport.data[0], memoryview)
+        self.assertIsInstance(output_transport.data[1], bytes)
+        self.assertEqual(output_transport.data[0], b"first")
+        self.assertEqual(relay.buffer_pool.get_statistics()["NUMBER_OF_USED_BUFFERS"], 1)
+        
+        relay.output_protocol.resume_writing()
+        
+        self.assertEqual(relay.buffer_pool.get_statistics()["NUMBER_OF_USED_BUFFERS"], 1)
+        
+        output_transport.write_buffer_size = 0
+        relay.output_protocol.resume_writing()
+        
+        self.assertEqual(relay.buffer_pool.get_statistics()["NUMBER_OF_USED_BUFFERS"], 0)
+        self.assertEqual(relay.buffer_pool.get_statistics()["NUMBER_OF_DISCARDS"], 0)
+    
+    def test_discard_buffer_not_sent(self):
+        input_transport = Transport()
+        output_transport = Transport()
+        relay = create_relay(input_transport, output_transport)
+        
+        output_transport.write = lambda data: (output_transport.data.append(data), setattr(output_transport, "write_buffer_size", len(data)))
+        
+        receive_data(relay.input_protocol, b"data")
+        relay.input_protocol.connection_lost(None)
+        
+        self.assertEqual(output_transport.data[0], b"data")
+        self.assertEqual(relay.buffer_pool.get_statistics()["NUMBER_OF_USED_BUFFERS"], 0)
+        self.assertEqual(relay.buffer_pool.get_statistics()["NUMBER_OF_BUFFERS"], 0)
+        self.assertEqual(relay.buffer_pool.get_statistics()["NUMBER_OF_DISCARDS"], 1)
+    
+    def test_copy_data_for_ssl_transport(self):
+        input_transport = Transport()
+        output_transport = Transport(object())
+        relay = create_relay(input_transport, output_transport)
+        
+        receive_data(relay.input_protocol, b"data")
+        receive_data(relay.output_protocol, b"data")
+        
+        self.assertIsInstance(output_transport.data[0], bytes)
+        self.assertIsInstance(input_transport.data[0], memoryview)
+        self.assertEqual(relay.buffer_pool.get_statistics()["NUMBER_OF_USED_BUFFERS"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,185 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import gc
+import socket
+import time
+import unittest
+from twunnel3 import local_proxy_server, logger
+from twunnel3.supervisor import create_supervisor
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+def create_configuration(drain_time):
+    server_configuration = \
+    {
+        "PROXY_SERVERS": [],
+        "LOCAL_PROXY_SERVER":
+        {
+            "TYPE": "SOCKS5",
+            "ADDRESS": "127.0.0.1",
+            "PORT": 0
+        },
+        "SUPERVISOR":
+        {
+            "DRAIN_TIME": drain_time,
+            "RESTART_TIME": 1,
+            "MAXIMUM_RESTART_TIME": 4
+        }
+    }
+    
+    return server_configuration
+
+class SupervisorWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+        gc.collect()
+        
+        self.sockets = []
+    
+    def tearDown(self):
+        for client_socket in self.sockets:
+            client_socket.close()
+        
+        self.loop.run_until_complete(asyncio.sleep(0))
+        
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def create_worker(self, drain_time):
+        server_configuration = create_configuration(drain_time)
+        
+        worker = create_supervisor(server_configuration, local_proxy_server.create_server).workers[0]
+        worker.server = self.loop.run_until_complete(local_proxy_server.create_server(server_configuration))
+        
+        return worker
+    
+    def connect(self, worker):
+        client_socket = socket.create_connection(worker.server.sockets[0].getsockname()[:2])
+        
+        self.sockets.append(client_socket)
+        
+        start_time = time.time()
+        
+        while local_proxy_server.get_statistics()["NUMBER_OF_CONNECTIONS"] < len(self.sockets) and time.time() - start_time < 5:
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+        
+        return client_socket
+    
+    def test_drain_idle(self):
+        worker = self.create_worker(10)
+        
+        start_time = time.time()
+        
+        self.loop.call_soon(worker.drain)
+        self.loop.run_forever()
+        
+        self.assertLess(time.time() - start_time, 1)
+        self.assertNotEqual(worker.drain_time, 0)
+        
+        self.loop.run_until_complete(worker.server.wait_closed())
+    
+    def test_drain_after_close(self):
+        worker = self.create_worker(10)
+        
+        client_socket = self.connect(worker)
+        
+        self.assertEqual(local_proxy_server.get_statistics()["NUMBER_OF_CONNECTIONS"], 1)
+        
+        start_time = time.time()
+        
+        self.loop.call_soon(worker.drain)
+        self.loop.call_later(0.3, client_socket.close)
+        self.loop.run_forever()
+        
+        self.assertGreaterEqual(time.time() - start_time, 0.3)
+        self.assertLess(time.time() - start_time, 5)
+        self.assertEqual(local_proxy_server.get_statistics()["NUMBER_OF_CONNECTIONS"], 0)
+    
+    def test_drain_timeout(self):
+        worker = self.create_worker(0.5)
+        
+        self.connect(worker)
+        
+        start_time = time.time()
+        
+        self.loop.call_soon(worker.drain)
+        self.loop.run_forever()
+        
+        self.assertGreaterEqual(time.time() - start_time, 0.5)
+        self.assertLess(time.time() - start_time, 5)
+        self.assertEqual(local_proxy_server.get_statistics()["NUMBER_OF_CONNECTIONS"], 1)
+    
+    def test_drain_twice(self):
+        worker = self.create_worker(0.5)
+        
+        self.connect(worker)
+        
+        self.loop.call_soon(worker.drain)
+        self.loop.call_later(0.3, worker.drain)
+        
+        start_time = time.time()
+        
+        self.loop.run_forever()
+        
+        self.assertLess(time.time() - start_time, 0.8)
+
+class SupervisorTestCase(unittest.TestCase):
+    def test_restart_time(self):
+        server_configuration = create_configuration(10)
+        
+        supervisor = create_supervisor(server_configuration, None)
+        
+        worker = supervisor.workers[0]
+        
+        restart_times = []
+        
+        i = 0
+        while i < 5:
+            worker.process_id = 1
+            worker.start_time = time.time()
+            
+            supervisor.worker__process_exited(worker, 0)
+            
+            restart_times.append(round(worker.restart_time - time.time()))
+            
+            i = i + 1
+        
+        self.assertEqual(restart_times, [1, 2, 4, 4, 4])
+        
+        worker.process_id = 1
+        worker.start_time = time.time() - 10
+        
+        supervisor.worker__process_exited(worker, 0)
+        
+        self.assertEqual(round(worker.restart_time - time.time()), 1)
+    
+    def test_stopping(self):
+        server_configuration = create_configuration(10)
+        
+        supervisor = create_supervisor(server_configuration, None)
+        supervisor.supervisor_state = 1
+        
+        worker = supervisor.workers[0]
+        worker.process_id = 1
+        
+        supervisor.worker__process_exited(worker, 0)
+        
+        self.assertEqual(worker.process_id, 0)
+        self.assertEqual(worker.number_of_restarts, 0)
+        self.assertEqual(supervisor.get_number_of_running_workers(), 0)
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
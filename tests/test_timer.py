@@ -0,0 +1,170 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import unittest
+from twunnel3 import logger
+from twunnel3.timer import Timer, TimerWheel
+
+configuration = \
+{
+    "LOGGER":
+    {
+        "LEVEL": 0
+    }
+}
+
+logger.configure(configuration)
+
+def create_timer(timer_wheel, expirations, name):
+    return Timer(lambda: expirations.append((name, timer_wheel.tick)), timer_wheel)
+
+def process_ticks(timer_wheel, number_of_ticks):
+    i = 0
+    while i < number_of_ticks:
+        timer_wheel.process_tick()
+        
+        i = i + 1
+
+class TimerWheelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+        self.timer_wheel = TimerWheel(1.0, 4)
+    
+    def tearDown(self):
+        if self.timer_wheel.tick_handle is not None:
+            self.timer_wheel.tick_handle.cancel()
+        
+        asyncio.set_event_loop(None)
+        self.loop.close()
+    
+    def test_expire(self):
+        expirations = []
+        
+        timer = create_timer(self.timer_wheel, expirations, "timer")
+        timer.start(2)
+        
+        process_ticks(self.timer_wheel, 3)
+        
+        self.assertEqual(expirations, [("timer", 2)])
+        self.assertEqual(self.timer_wheel.get_statistics(), {"NUMBER_OF_TIMERS": 0, "NUMBER_OF_EXPIRATIONS": 1})
+        self.assertIsNone(self.timer_wheel.tick_handle)
+    
+    def test_round_up(self):
+        expirations = []
+        
+        create_timer(self.timer_wheel, expirations, "short").start(0.1)
+        create_timer(self.timer_wheel, expirations, "fraction").start(1.5)
+        
+        process_ticks(self.timer_wheel, 2)
+        
+        self.assertEqual(expirations, [("short", 1), ("fraction", 2)])
+    
+    def test_restart_later(self):
+        expirations = []
+        
+        timer = create_timer(self.timer_wheel, expirations, "timer")
+        timer.start(2)
+        
+        process_ticks(self.timer_wheel, 1)
+        
+        timer.start(3)
+        
+        process_ticks(self.timer_wheel, 2)
+        
+        self.assertEqual(expirations, [])
+        
+        process_ticks(self.timer_wheel, 2)
+        
+        self.assertEqual(expirations, [("timer", 4)])
+    
+    def test_restart_earlier(self):
+        expirations = []
+        
+        timer = create_timer(self.timer_wheel, expirations, "timer")
+        timer.start(3)
+        timer.start(1)
+        
+        process_ticks(self.timer_wheel, 3)
+        
+        self.assertEqual(expirations, [("timer", 1)])
+        self.assertEqual(self.timer_wheel.get_statistics()["NUMBER_OF_TIMERS"], 0)
+    
+    def test_restart_after_cancel(self):
+        expirations = []
+        
+        timer = create_timer(self.timer_wheel, expirations, "timer")
+        timer.start(2)
+        timer.cancel()
+        
+        self.assertEqual(timer.slot, -1)
+        
+        process_ticks(self.timer_wheel, 1)
+        
+        timer.start(2)
+        
+        self.assertEqual(timer.slot, 3)
+        
+        process_ticks(self.timer_wheel, 4)
+        
+        self.assertEqual(expirations, [("timer", 3)])
+        self.assertEqual(self.timer_wheel.get_statistics(), {"NUMBER_OF_TIMERS": 0, "NUMBER_OF_EXPIRATIONS": 1})
+    
+    def test_cancel_twice(self):
+        expirations = []
+        
+        timer = create_timer(self.timer_wheel, expirations, "timer")
+        timer.start(2)
+        timer.cancel()
+        timer.cancel()
+        
+        process_ticks(self.timer_wheel, 3)
+        
+        self.assertEqual(expirations, [])
+        self.assertEqual(self.timer_wheel.get_statistics()["NUMBER_OF_TIMERS"], 0)
+    
+    def test_start_without_timeout(self):
+        expirations = []
+        
+        timer = create_timer(self.timer_wheel, expirations, "timer")
+        timer.start(2)
+        timer.start(0)
+        
+        process_ticks(self.timer_wheel, 3)
+        
+        self.assertEqual(expirations, [])
+    
+    def test_wrap_around(self):
+        expirations = []
+        
+        create_timer(self.timer_wheel, expirations, "first").start(6)
+        create_timer(self.timer_wheel, expirations, "second").start(2)
+        create_timer(self.timer_wheel, expirations, "third").start(10)
+        
+        process_ticks(self.timer_wheel, 10)
+        
+        self.assertEqual(expirations, [("second", 2), ("first", 6), ("third", 10)])
+    
+    def test_restart_from_callback(self):
+        expirations = []
+        
+        timer = None
+        
+        def timer__expired():
+            expirations.append(("timer", self.timer_wheel.tick))
+            
+            if len(expirations) < 3:
+                timer.start(2)
+        
+        timer = Timer(timer__expired, self.timer_wheel)
+        timer.start(2)
+        
+        process_ticks(self.timer_wheel, 8)
+        
+        self.assertEqual(expirations, [("timer", 2), ("timer", 4), ("timer", 6)])
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
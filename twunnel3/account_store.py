@@ -0,0 +1,195 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import csv
+import hashlib
+import hmac
+import json
+import os
+import twunnel3.logger
+
+def set_default_configuration(configuration, keys):
+    if "ACCOUNTS_FILE" in keys:
+        configuration.setdefault("ACCOUNTS_FILE", {})
+        configuration["ACCOUNTS_FILE"].setdefault("TYPE", "JSON")
+        configuration["ACCOUNTS_FILE"].setdefault("FILE", "")
+        configuration["ACCOUNTS_FILE"].setdefault("RELOAD_INTERVAL", 5)
+
+class AccountStore(object):
+    def __init__(self, configuration):
+        twunnel3.logger.trace("AccountStore.__init__")
+        
+        self.configuration = configuration
+        self.key = os.urandom(32)
+        self.accounts = {}
+        self.file_accounts = {}
+        self.file_time = 0
+        self.file_modification_time = None
+        self.reloading = False
+        self.number_of_reloads = 0
+        self.number_of_successes = 0
+        self.number_of_failures = 0
+        
+        self.accounts = self.create_accounts(self.configuration["ACCOUNTS"])
+        
+        if self.configuration["ACCOUNTS_FILE"]["FILE"] != "":
+            self.file_time = asyncio.get_event_loop().time()
+            
+            try:
+                self.update_accounts(self.load_accounts(None))
+            except (OSError, ValueError, KeyError, TypeError) as exception:
+                twunnel3.logger.warning("account_store: " + str(exception))
+    
+    def create_accounts(self, accounts):
+        twunnel3.logger.trace("AccountStore.create_accounts")
+        
+        indexed_accounts = {}
+        
+        i = 0
+        while i < len(accounts):
+            name = accounts[i]["NAME"]
+            if not isinstance(name, bytes):
+                name = name.encode()
+            
+            password = accounts[i]["PASSWORD"]
+            if not isinstance(password, bytes):
+                password = password.encode()
+            
+            indexed_accounts[name] = self.get_password_hash(password)
+            
+            i = i + 1
+        
+        return indexed_accounts
+    
+    def get_password_hash(self, password):
+        twunnel3.logger.trace("AccountStore.get_password_hash")
+        
+        return hmac.new(self.key, password, hashlib.sha256).digest()
+    
+    def is_empty(self):
+        twunnel3.logger.trace("AccountStore.is_empty")
+        
+        return len(self.accounts) == 0 and self.configuration["ACCOUNTS_FILE"]["FILE"] == ""
+    
+    def authenticate(self, name, password):
+        twunnel3.logger.trace("AccountStore.authenticate")
+        
+        if self.configuration["ACCOUNTS_FILE"]["FILE"] != "":
+            if asyncio.get_event_loop().time() - self.file_time >= self.configuration["ACCOUNTS_FILE"]["RELOAD_INTERVAL"]:
+                self.reload()
+        
+        password_hash = self.get_password_hash(password)
+        
+        account_password_hash = self.accounts.get(name)
+        if account_password_hash is None:
+            account_password_hash = self.file_accounts.get(name)
+        
+        if account_password_hash is None:
+            hmac.compare_digest(password_hash, password_hash)
+            
+            self.number_of_failures = self.number_of_failures + 1
+            
+            return False
+        
+        if not hmac.compare_digest(password_hash, account_password_hash):
+            self.number_of_failures = self.number_of_failures + 1
+            
+            return False
+        
+        self.number_of_successes = self.number_of_successes + 1
+        
+        return True
+    
+    def reload(self):
+        twunnel3.logger.trace("AccountStore.reload")
+        
+        if self.reloading:
+            return
+        
+        self.reloading = True
+        
+        loop = asyncio.get_event_loop()
+        
+        self.file_time = loop.time()
+        
+        future = loop.run_in_executor(None, self.load_accounts, self.file_modification_time)
+        future.add_done_callback(self.reload__done)
+    
+    def reload__done(self, future):
+        twunnel3.logger.trace("AccountStore.reload__done")
+        
+        self.reloading = False
+        
+        exception = future.exception()
+        if exception is not None:
+            twunnel3.logger.warning("account_store: " + str(exception))
+            
+            return
+        
+        self.update_accounts(future.result())
+    
+    def load_accounts(self, file_modification_time):
+        twunnel3.logger.trace("AccountStore.load_accounts")
+        
+        new_file_modification_time = os.stat(self.configuration["ACCOUNTS_FILE"]["FILE"]).st_mtime
+        
+        if new_file_modification_time == file_modification_time:
+            return None
+        
+        return (new_file_modification_time, self.create_accounts(self.read_accounts()))
+    
+    def update_accounts(self, file_accounts):
+        twunnel3.logger.trace("AccountStore.update_accounts")
+        
+        if file_accounts is None:
+            return
+        
+        self.file_modification_time, self.file_accounts = file_accounts
+        self.number_of_reloads = self.number_of_reloads + 1
+        
+        twunnel3.logger.info("account_store: " + str(len(self.file_accounts)) + " accounts loaded")
+    
+    def read_accounts(self):
+        twunnel3.logger.trace("AccountStore.read_accounts")
+        
+        accounts = []
+        
+        with open(self.configuration["ACCOUNTS_FILE"]["FILE"], newline="") as file:
+            if self.configuration["ACCOUNTS_FILE"]["TYPE"] == "CSV":
+                for row in csv.reader(file):
+                    if len(row) == 0:
+                        continue
+                    
+                    account = {}
+                    account["NAME"] = row[0]
+                    account["PASSWORD"] = ""
+                    if len(row) > 1:
+                        account["PASSWORD"] = row[1]
+                    
+                    accounts.append(account)
+            else:
+                data = json.load(file)
+                
+                if isinstance(data, dict):
+                    data = data["ACCOUNTS"]
+                
+                for row in data:
+                    account = {}
+                    account["NAME"] = row["NAME"]
+                    account["PASSWORD"] = row.get("PASSWORD", "")
+                    
+                    accounts.append(account)
+        
+        return accounts
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("AccountStore.get_statistics")
+        
+        statistics = {}
+        statistics["NUMBER_OF_ACCOUNTS"] = len(self.accounts) + len(self.file_accounts)
+        statistics["NUMBER_OF_RELOADS"] = self.number_of_reloads
+        statistics["NUMBER_OF_SUCCESSES"] = self.number_of_successes
+        statistics["NUMBER_OF_FAILURES"] = self.number_of_failures
+        
+        return statistics
\ No newline at end of file
@@ -0,0 +1,421 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import collections
+import twunnel3.compat
+import twunnel3.logger
+import weakref
+
+BACKLOG = 100
+
+def set_default_configuration(configuration, keys):
+    if "ADMISSION" in keys:
+        configuration.setdefault("ADMISSION", {})
+        configuration["ADMISSION"].setdefault("MAXIMUM_NUMBER_OF_CONNECTIONS", 0)
+        configuration["ADMISSION"].setdefault("MAXIMUM_NUMBER_OF_QUEUED_CONNECTIONS", 0)
+        configuration["ADMISSION"].setdefault("ACCOUNT", {})
+        configuration["ADMISSION"]["ACCOUNT"].setdefault("MAXIMUM_NUMBER_OF_CONNECTIONS", 0)
+
+class AdmissionController(object):
+    def __init__(self, configuration, parent=None):
+        twunnel3.logger.trace("AdmissionController.__init__")
+        
+        self.configuration = configuration
+        self.parent = parent
+        self.admission_controllers = weakref.WeakSet()
+        self.input_protocols = collections.deque()
+        self.accounts = {}
+        self.servers = []
+        self.paused = False
+        self.number_of_connections = 0
+        self.number_of_accepting_connections = 0
+        self.number_of_admitted_connections = 0
+        self.number_of_queued_connections = 0
+        self.number_of_rejected_connections = 0
+        self.number_of_pauses = 0
+        
+        if self.parent is not None:
+            self.parent.admission_controllers.add(self)
+    
+    def is_full(self):
+        twunnel3.logger.trace("AdmissionController.is_full")
+        
+        if self.configuration["ADMISSION"]["MAXIMUM_NUMBER_OF_CONNECTIONS"] > 0:
+            if self.number_of_connections >= self.configuration["ADMISSION"]["MAXIMUM_NUMBER_OF_CONNECTIONS"]:
+                return True
+        
+        if self.parent is not None:
+            return self.parent.is_full()
+        
+        return False
+    
+    def is_accepting(self):
+        twunnel3.logger.trace("AdmissionController.is_accepting")
+        
+        if self.paused:
+            return False
+        
+        if self.configuration["ADMISSION"]["MAXIMUM_NUMBER_OF_CONNECTIONS"] > 0:
+            if self.number_of_connections + len(self.input_protocols) + self.number_of_accepting_connections >= self.configuration["ADMISSION"]["MAXIMUM_NUMBER_OF_CONNECTIONS"] + self.configuration["ADMISSION"]["MAXIMUM_NUMBER_OF_QUEUED_CONNECTIONS"]:
+                return False
+        
+        return True
+    
+    def admit(self, input_protocol):
+        twunnel3.logger.trace("AdmissionController.admit")
+        
+        if not self.is_full():
+            self.add_connection(input_protocol)
+        else:
+            if len(self.input_protocols) < self.configuration["ADMISSION"]["MAXIMUM_NUMBER_OF_QUEUED_CONNECTIONS"]:
+                input_protocol.admission_state = 2
+                
+                self.input_protocols.append(input_protocol)
+                self.number_of_queued_connections = self.number_of_queued_connections + 1
+                
+                input_protocol.admission__queued()
+            else:
+                input_protocol.admission_state = 3
+                
+                self.number_of_rejected_connections = self.number_of_rejected_connections + 1
+                
+                input_protocol.admission__rejected()
+        
+        self.update_all()
+    
+    def release(self, input_protocol):
+        twunnel3.logger.trace("AdmissionController.release")
+        
+        if input_protocol.admission_state == 1:
+            self.remove_connection()
+        else:
+            if input_protocol.admission_state == 2:
+                self.input_protocols.remove(input_protocol)
+        
+        input_protocol.admission_state = 0
+        
+        self.update_all()
+    
+    def admit_account(self, name):
+        twunnel3.logger.trace("AdmissionController.admit_account")
+        
+        number_of_connections = self.accounts.get(name, 0)
+        
+        if self.configuration["ADMISSION"]["ACCOUNT"]["MAXIMUM_NUMBER_OF_CONNECTIONS"] > 0:
+            if number_of_connections >= self.configuration["ADMISSION"]["ACCOUNT"]["MAXIMUM_NUMBER_OF_CONNECTIONS"]:
+                self.number_of_rejected_connections = self.number_of_rejected_connections + 1
+                
+                return False
+        
+        self.accounts[name] = number_of_connections + 1
+        
+        return True
+    
+    def release_account(self, name):
+        twunnel3.logger.trace("AdmissionController.release_account")
+        
+        number_of_connections = self.accounts[name] - 1
+        
+        if number_of_connections == 0:
+            del self.accounts[name]
+        else:
+            self.accounts[name] = number_of_connections
+    
+    def add_connection(self, input_protocol):
+        twunnel3.logger.trace("AdmissionController.add_connection")
+        
+        input_protocol.admission_state = 1
+        
+        self.number_of_connections = self.number_of_connections + 1
+        self.number_of_admitted_connections = self.number_of_admitted_connections + 1
+        
+        if self.parent is not None:
+            self.parent.number_of_connections = self.parent.number_of_connections + 1
+    
+    def remove_connection(self):
+        twunnel3.logger.trace("AdmissionController.remove_connection")
+        
+        self.number_of_connections = self.number_of_connections - 1
+        
+        if self.parent is not None:
+            self.parent.number_of_connections = self.parent.number_of_connections - 1
+    
+    def update_all(self):
+        twunnel3.logger.trace("AdmissionController.update_all")
+        
+        if self.parent is not None:
+            self.parent.update()
+        else:
+            self.update()
+    
+    def update(self):
+        twunnel3.logger.trace("AdmissionController.update")
+        
+        for admission_controller in self.admission_controllers:
+            admission_controller.update()
+        
+        while len(self.input_protocols) > 0 and not self.is_full():
+            input_protocol = self.input_protocols.popleft()
+            
+            self.add_connection(input_protocol)
+            
+            input_protocol.admission__admitted()
+        
+        if len(self.servers) == 0:
+            return
+        
+        if self.is_full() and len(self.input_protocols) >= self.configuration["ADMISSION"]["MAXIMUM_NUMBER_OF_QUEUED_CONNECTIONS"]:
+            if not self.paused:
+                self.pause_servers()
+        else:
+            if self.paused:
+                self.resume_servers()
+    
+    def add_server(self, server, protocol_factory, ssl=None):
+        twunnel3.logger.trace("AdmissionController.add_server")
+        
+        if self.paused:
+            self.resume_servers()
+        
+        admission_server = AdmissionServer(self, server, protocol_factory, ssl)
+        admission_server.start()
+        
+        self.servers.append(admission_server)
+        
+        self.update_all()
+        
+        return admission_server
+    
+    def remove_server(self, admission_server):
+        twunnel3.logger.trace("AdmissionController.remove_server")
+        
+        self.servers.remove(admission_server)
+        
+        self.update_all()
+    
+    def pause_servers(self):
+        twunnel3.logger.trace("AdmissionController.pause_servers")
+        
+        number_of_paused_servers = 0
+        
+        for admission_server in self.servers:
+            if admission_server.pause():
+                number_of_paused_servers = number_of_paused_servers + 1
+        
+        if number_of_paused_servers == 0:
+            return
+        
+        twunnel3.logger.debug("admission: paused")
+        
+        self.paused = True
+        self.number_of_pauses = self.number_of_pauses + 1
+    
+    def resume_servers(self):
+        twunnel3.logger.trace("AdmissionController.resume_servers")
+        
+        twunnel3.logger.debug("admission: resumed")
+        
+        self.paused = False
+        
+        for admission_server in self.servers:
+            admission_server.resume()
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("AdmissionController.get_statistics")
+        
+        statistics = {}
+        statistics["NUMBER_OF_CONNECTIONS"] = self.number_of_connections
+        statistics["NUMBER_OF_ADMITTED_CONNECTIONS"] = self.number_of_admitted_connections
+        statistics["NUMBER_OF_QUEUED_CONNECTIONS"] = self.number_of_queued_connections
+        statistics["NUMBER_OF_REJECTED_CONNECTIONS"] = self.number_of_rejected_connections
+        statistics["NUMBER_OF_PAUSES"] = self.number_of_pauses
+        statistics["QUEUE_SIZE"] = len(self.input_protocols)
+        statistics["PAUSED"] = self.paused
+        
+        for admission_controller in self.admission_controllers:
+            admission_controller_statistics = admission_controller.get_statistics()
+            
+            statistics["NUMBER_OF_ADMITTED_CONNECTIONS"] = statistics["NUMBER_OF_ADMITTED_CONNECTIONS"] + admission_controller_statistics["NUMBER_OF_ADMITTED_CONNECTIONS"]
+            statistics["NUMBER_OF_QUEUED_CONNECTIONS"] = statistics["NUMBER_OF_QUEUED_CONNECTIONS"] + admission_controller_statistics["NUMBER_OF_QUEUED_CONNECTIONS"]
+            statistics["NUMBER_OF_REJECTED_CONNECTIONS"] = statistics["NUMBER_OF_REJECTED_CONNECTIONS"] + admission_controller_statistics["NUMBER_OF_REJECTED_CONNECTIONS"]
+            statistics["NUMBER_OF_PAUSES"] = statistics["NUMBER_OF_PAUSES"] + admission_controller_statistics["NUMBER_OF_PAUSES"]
+            statistics["QUEUE_SIZE"] = statistics["QUEUE_SIZE"] + admission_controller_statistics["QUEUE_SIZE"]
+        
+        return statistics
+
+class AdmissionServer(object):
+    def __init__(self, admission_controller, server, protocol_factory, ssl):
+        twunnel3.logger.trace("AdmissionServer.__init__")
+        
+        self.admission_controller = admission_controller
+        self.server = server
+        self.protocol_factory = protocol_factory
+        self.ssl = ssl
+        self.sockets = server.sockets
+        self.server_sockets = []
+        self.accept_state = 0
+    
+    def start(self):
+        twunnel3.logger.trace("AdmissionServer.start")
+        
+        if not hasattr(self.server, "is_serving") or self.server.is_serving():
+            twunnel3.logger.warning("admission: the server cannot be paused, connections over the limit are accepted and closed")
+            
+            return
+        
+        for server_socket in self.server.sockets:
+            server_socket = server_socket.dup()
+            server_socket.setblocking(False)
+            server_socket.listen(BACKLOG)
+            
+            self.server_sockets.append(server_socket)
+        
+        try:
+            self.add_readers()
+        except NotImplementedError:
+            twunnel3.logger.warning("admission: the event loop cannot pause the server, connections over the limit are accepted and closed")
+            
+            self.close_server_sockets()
+            
+            twunnel3.compat.ensure_future(self.server.start_serving())
+            
+            return
+        
+        self.accept_state = 1
+    
+    def close(self):
+        twunnel3.logger.trace("AdmissionServer.close")
+        
+        if self.accept_state == 3:
+            return
+        
+        if self.accept_state == 1:
+            self.remove_readers()
+        
+        self.accept_state = 3
+        
+        self.close_server_sockets()
+        
+        self.server.close()
+        self.sockets = []
+        
+        self.admission_controller.remove_server(self)
+    
+    def wait_closed(self):
+        twunnel3.logger.trace("AdmissionServer.wait_closed")
+        
+        return self.server.wait_closed()
+    
+    def pause(self):
+        twunnel3.logger.trace("AdmissionServer.pause")
+        
+        if self.accept_state != 1:
+            return False
+        
+        self.remove_readers()
+        
+        self.accept_state = 2
+        
+        return True
+    
+    def resume(self):
+        twunnel3.logger.trace("AdmissionServer.resume")
+        
+        if self.accept_state != 2:
+            return
+        
+        self.add_readers()
+        
+        self.accept_state = 1
+    
+    def add_readers(self):
+        twunnel3.logger.trace("AdmissionServer.add_readers")
+        
+        loop = asyncio.get_event_loop()
+        
+        for server_socket in self.server_sockets:
+            loop.add_reader(server_socket.fileno(), self.server_socket__readable, server_socket)
+    
+    def remove_readers(self):
+        twunnel3.logger.trace("AdmissionServer.remove_readers")
+        
+        loop = asyncio.get_event_loop()
+        
+        for server_socket in self.server_sockets:
+            loop.remove_reader(server_socket.fileno())
+    
+    def close_server_sockets(self):
+        twunnel3.logger.trace("AdmissionServer.close_server_sockets")
+        
+        for server_socket in self.server_sockets:
+            server_socket.close()
+        
+        self.server_sockets = []
+    
+    def server_socket__readable(self, server_socket):
+        twunnel3.logger.trace("AdmissionServer.server_socket__readable")
+        
+        loop = asyncio.get_event_loop()
+        
+        i = 0
+        while i < BACKLOG and self.admission_controller.is_accepting():
+            try:
+                connection_socket, connection_address = server_socket.accept()
+            except (BlockingIOError, InterruptedError, ConnectionAbortedError):
+                return
+            except OSError as exception:
+                twunnel3.logger.error("admission: " + str(exception))
+                
+                self.pause()
+                
+                loop.call_later(1, self.timer__expired)
+                
+                return
+            
+            connection_socket.setblocking(False)
+            
+            self.admission_controller.number_of_accepting_connections = self.admission_controller.number_of_accepting_connections + 1
+            
+            future = twunnel3.compat.ensure_future(loop.connect_accepted_socket(self.protocol_factory, connection_socket, ssl=self.ssl))
+            future.add_done_callback(self.connection__made)
+            
+            i = i + 1
+    
+    def timer__expired(self):
+        twunnel3.logger.trace("AdmissionServer.timer__expired")
+        
+        if not self.admission_controller.paused:
+            self.resume()
+    
+    def connection__made(self, future):
+        twunnel3.logger.trace("AdmissionServer.connection__made")
+        
+        self.admission_controller.number_of_accepting_connections = self.admission_controller.number_of_accepting_connections - 1
+        
+        if not future.cancelled() and future.exception() is not None:
+            twunnel3.logger.debug("admission: " + str(future.exception()))
+        
+        self.admission_controller.update_all()
+
+admission_controller = None
+
+def get_admission_controller():
+    global admission_controller
+    
+    if admission_controller is None:
+        configuration = {}
+        configure(configuration)
+    
+    return admission_controller
+
+def configure(configuration):
+    global admission_controller
+    
+    set_default_configuration(configuration, ["ADMISSION"])
+    
+    if admission_controller is None:
+        admission_controller = AdmissionController(configuration)
+    else:
+        admission_controller.configuration = configuration
+        admission_controller.update()
\ No newline at end of file
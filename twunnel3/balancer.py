@@ -0,0 +1,213 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import random
+import time
+import twunnel3.logger
+
+class BalancerBackend(object):
+    def __init__(self, configuration, output_protocol_connection):
+        twunnel3.logger.trace("BalancerBackend.__init__")
+        
+        self.configuration = configuration
+        self.output_protocol_connection = output_protocol_connection
+        self.number_of_connections = 0
+        self.number_of_successes = 0
+        self.number_of_failures = 0
+        self.number_of_consecutive_failures = 0
+        self.number_of_ejections = 0
+        self.latency = 0.0
+        self.ejection_time = 0.0
+    
+    def is_available(self):
+        twunnel3.logger.trace("BalancerBackend.is_available")
+        
+        return self.ejection_time <= time.time()
+    
+    def connect(self, remote_address, remote_port, input_protocol):
+        twunnel3.logger.trace("BalancerBackend.connect")
+        
+        self.number_of_connections = self.number_of_connections + 1
+        
+        self.output_protocol_connection.connect(remote_address, remote_port, input_protocol, self)
+    
+    def output_protocol__connection_made(self, latency):
+        twunnel3.logger.trace("BalancerBackend.output_protocol__connection_made")
+        
+        self.update_latency(latency)
+        
+        self.number_of_successes = self.number_of_successes + 1
+        self.number_of_consecutive_failures = 0
+        self.number_of_ejections = 0
+    
+    def output_protocol__connection_lost(self):
+        twunnel3.logger.trace("BalancerBackend.output_protocol__connection_lost")
+        
+        self.number_of_connections = self.number_of_connections - 1
+    
+    def output_protocol__connection_failed(self):
+        twunnel3.logger.trace("BalancerBackend.output_protocol__connection_failed")
+        
+        self.update_latency(self.configuration["BALANCER"]["LATENCY"]["PENALTY"])
+        
+        self.number_of_connections = self.number_of_connections - 1
+        self.number_of_failures = self.number_of_failures + 1
+        self.number_of_consecutive_failures = self.number_of_consecutive_failures + 1
+        
+        if self.number_of_consecutive_failures >= self.configuration["BALANCER"]["EJECTION"]["MAXIMUM_NUMBER_OF_FAILURES"]:
+            if self.is_available():
+                ejection_time = self.configuration["BALANCER"]["EJECTION"]["TIME"] * (2 ** self.number_of_ejections)
+                if ejection_time > self.configuration["BALANCER"]["EJECTION"]["MAXIMUM_TIME"]:
+                    ejection_time = self.configuration["BALANCER"]["EJECTION"]["MAXIMUM_TIME"]
+                
+                self.number_of_ejections = self.number_of_ejections + 1
+                self.ejection_time = time.time() + ejection_time
+                
+                twunnel3.logger.warning("balancer: backend ejected for " + str(ejection_time) + "s")
+    
+    def update_latency(self, latency):
+        twunnel3.logger.trace("BalancerBackend.update_latency")
+        
+        if self.number_of_successes == 0 and self.number_of_failures == 0:
+            self.latency = latency
+        else:
+            self.latency = self.latency + self.configuration["BALANCER"]["LATENCY"]["WEIGHT"] * (latency - self.latency)
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("BalancerBackend.get_statistics")
+        
+        statistics = {}
+        statistics["NUMBER_OF_CONNECTIONS"] = self.number_of_connections
+        statistics["NUMBER_OF_SUCCESSES"] = self.number_of_successes
+        statistics["NUMBER_OF_FAILURES"] = self.number_of_failures
+        statistics["NUMBER_OF_CONSECUTIVE_FAILURES"] = self.number_of_consecutive_failures
+        statistics["LATENCY"] = self.latency
+        statistics["AVAILABLE"] = self.is_available()
+        statistics["EJECTION_TIME"] = max(self.ejection_time - time.time(), 0.0)
+        
+        return statistics
+
+class Balancer(object):
+    def __init__(self, configuration, output_protocol_connections):
+        twunnel3.logger.trace("Balancer.__init__")
+        
+        self.configuration = configuration
+        self.backends = []
+        self.i = -1
+        
+        i = 0
+        while i < len(output_protocol_connections):
+            backend = BalancerBackend(self.configuration, output_protocol_connections[i])
+            self.backends.append(backend)
+            
+            i = i + 1
+    
+    def get_available_backends(self):
+        twunnel3.logger.trace("Balancer.get_available_backends")
+        
+        backends = []
+        
+        i = 0
+        while i < len(self.backends):
+            if self.backends[i].is_available():
+                backends.append(self.backends[i])
+            
+            i = i + 1
+        
+        if len(backends) == 0:
+            backends = self.backends
+        
+        return backends
+    
+    def get_backend(self):
+        twunnel3.logger.trace("Balancer.get_backend")
+        
+        return None
+
+class RoundRobinBalancer(Balancer):
+    def get_backend(self):
+        twunnel3.logger.trace("RoundRobinBalancer.get_backend")
+        
+        i = 0
+        while i < len(self.backends):
+            self.i = self.i + 1
+            if self.i >= len(self.backends):
+                self.i = 0
+            
+            if self.backends[self.i].is_available():
+                return self.backends[self.i]
+            
+            i = i + 1
+        
+        return self.backends[self.i]
+
+class LeastConnectionsBalancer(Balancer):
+    def get_backend(self):
+        twunnel3.logger.trace("LeastConnectionsBalancer.get_backend")
+        
+        backends = self.get_available_backends()
+        
+        self.i = self.i + 1
+        if self.i >= len(backends):
+            self.i = 0
+        
+        backend = backends[self.i]
+        
+        i = 1
+        while i < len(backends):
+            j = (self.i + i) % len(backends)
+            
+            if backends[j].number_of_connections < backend.number_of_connections:
+                backend = backends[j]
+            
+            i = i + 1
+        
+        return backend
+
+class LatencyBalancer(Balancer):
+    def get_backend(self):
+        twunnel3.logger.trace("LatencyBalancer.get_backend")
+        
+        backends = self.get_available_backends()
+        
+        self.i = self.i + 1
+        if self.i >= len(backends):
+            self.i = 0
+        
+        backend = backends[self.i]
+        
+        i = 1
+        while i < len(backends):
+            j = (self.i + i) % len(backends)
+            
+            if self.get_cost(backends[j]) < self.get_cost(backend):
+                backend = backends[j]
+            
+            i = i + 1
+        
+        return backend
+    
+    def get_cost(self, backend):
+        twunnel3.logger.trace("LatencyBalancer.get_cost")
+        
+        return backend.latency * (backend.number_of_connections + 1)
+
+class PowerOfTwoChoicesBalancer(LatencyBalancer):
+    def get_backend(self):
+        twunnel3.logger.trace("PowerOfTwoChoicesBalancer.get_backend")
+        
+        backends = self.get_available_backends()
+        
+        if len(backends) == 1:
+            return backends[0]
+        
+        backend1, backend2 = random.sample(backends, 2)
+        
+        if backend2.number_of_connections < backend1.number_of_connections:
+            return backend2
+        else:
+            if backend2.number_of_connections == backend1.number_of_connections:
+                if self.get_cost(backend2) < self.get_cost(backend1):
+                    return backend2
+        
+        return backend1
\ No newline at end of file
@@ -0,0 +1,171 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import collections
+import twunnel3.logger
+
+def set_default_configuration(configuration, keys):
+    if "BANDWIDTH" in keys:
+        configuration.setdefault("BANDWIDTH", {})
+        configuration["BANDWIDTH"].setdefault("RATE", 0)
+        configuration["BANDWIDTH"].setdefault("BURST", 0)
+        configuration["BANDWIDTH"].setdefault("ACCOUNT", {})
+        configuration["BANDWIDTH"]["ACCOUNT"].setdefault("RATE", 0)
+        configuration["BANDWIDTH"]["ACCOUNT"].setdefault("BURST", 0)
+
+class TokenBucket(object):
+    def __init__(self, configuration, parent=None):
+        twunnel3.logger.trace("TokenBucket.__init__")
+        
+        self.configuration = configuration
+        self.parent = parent
+        self.tokens = self.get_burst()
+        self.time = asyncio.get_event_loop().time()
+        self.callbacks = collections.deque()
+        self.callback_handle = None
+        self.number_of_bytes = 0
+        self.number_of_pauses = 0
+    
+    def get_rate(self):
+        twunnel3.logger.trace("TokenBucket.get_rate")
+        
+        return self.configuration["RATE"]
+    
+    def get_burst(self):
+        twunnel3.logger.trace("TokenBucket.get_burst")
+        
+        if self.configuration["BURST"] > 0:
+            return self.configuration["BURST"]
+        
+        return self.configuration["RATE"]
+    
+    def is_limited(self):
+        twunnel3.logger.trace("TokenBucket.is_limited")
+        
+        token_bucket = self
+        while token_bucket is not None:
+            if token_bucket.get_rate() > 0:
+                return True
+            
+            token_bucket = token_bucket.parent
+        
+        return False
+    
+    def update(self):
+        twunnel3.logger.trace("TokenBucket.update")
+        
+        time = asyncio.get_event_loop().time()
+        
+        if self.get_rate() > 0:
+            self.tokens = min(self.tokens + (time - self.time) * self.get_rate(), self.get_burst())
+        
+        self.time = time
+    
+    def consume(self, size):
+        twunnel3.logger.trace("TokenBucket.consume")
+        
+        token_bucket = self
+        while token_bucket is not None:
+            token_bucket.number_of_bytes = token_bucket.number_of_bytes + size
+            
+            if token_bucket.get_rate() > 0:
+                token_bucket.update()
+                token_bucket.tokens = token_bucket.tokens - size
+            
+            token_bucket = token_bucket.parent
+    
+    def get_delay(self):
+        twunnel3.logger.trace("TokenBucket.get_delay")
+        
+        if self.get_rate() <= 0:
+            return 0
+        
+        self.update()
+        
+        if self.tokens >= 0:
+            return 0
+        
+        return -self.tokens / self.get_rate()
+    
+    def wait(self, callback):
+        twunnel3.logger.trace("TokenBucket.wait")
+        
+        delay = 0
+        delay_token_bucket = None
+        
+        token_bucket = self
+        while token_bucket is not None:
+            token_bucket_delay = token_bucket.get_delay()
+            
+            if token_bucket_delay > delay:
+                delay = token_bucket_delay
+                delay_token_bucket = token_bucket
+            
+            token_bucket = token_bucket.parent
+        
+        if delay_token_bucket is None:
+            return False
+        
+        delay_token_bucket.callbacks.append(callback)
+        delay_token_bucket.number_of_pauses = delay_token_bucket.number_of_pauses + 1
+        
+        if delay_token_bucket.callback_handle is None:
+            delay_token_bucket.callback_handle = asyncio.get_event_loop().call_later(delay, delay_token_bucket.process_callbacks)
+        
+        return True
+    
+    def process_callbacks(self):
+        twunnel3.logger.trace("TokenBucket.process_callbacks")
+        
+        self.callback_handle = None
+        
+        delay = self.get_delay()
+        
+        if delay > 0:
+            self.callback_handle = asyncio.get_event_loop().call_later(delay, self.process_callbacks)
+            
+            return
+        
+        callbacks = self.callbacks
+        self.callbacks = collections.deque()
+        
+        for callback in callbacks:
+            callback()
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("TokenBucket.get_statistics")
+        
+        if self.get_rate() > 0:
+            self.update()
+        
+        statistics = {}
+        statistics["RATE"] = self.get_rate()
+        statistics["BURST"] = self.get_burst()
+        statistics["TOKENS"] = self.tokens
+        statistics["NUMBER_OF_BYTES"] = self.number_of_bytes
+        statistics["NUMBER_OF_PAUSES"] = self.number_of_pauses
+        statistics["NUMBER_OF_WAITING_CONNECTIONS"] = len(self.callbacks)
+        
+        return statistics
+
+token_bucket = None
+
+def get_token_bucket():
+    global token_bucket
+    
+    if token_bucket is None:
+        configuration = {}
+        configure(configuration)
+    
+    return token_bucket
+
+def configure(configuration):
+    global token_bucket
+    
+    set_default_configuration(configuration, ["BANDWIDTH"])
+    
+    if token_bucket is None:
+        token_bucket = TokenBucket(configuration["BANDWIDTH"])
+    else:
+        token_bucket.configuration = configuration["BANDWIDTH"]
\ No newline at end of file
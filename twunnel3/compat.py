@@ -0,0 +1,10 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+
+# asyncio.async was renamed to asyncio.ensure_future in Python 3.4.4 and is a syntax error from Python 3.7 on.
+ensure_future = getattr(asyncio, "ensure_future", None) or getattr(asyncio, "async")
+
+# loop.create_server takes start_serving from Python 3.7 on, before that a server accepts connections as soon as it is created.
+create_server_start_serving = hasattr(asyncio.AbstractServer, "start_serving")
\ No newline at end of file
@@ -2,8 +2,23 @@
 # See LICENSE
 
 import asyncio
+import time
+import twunnel3.account_store
+import twunnel3.admission
+import twunnel3.bandwidth
+import twunnel3.compat
 import twunnel3.logger
+import twunnel3.metrics
+import twunnel3.multiplexer
 import twunnel3.proxy_server
+import twunnel3.timer
+import weakref
+
+connections_metric = twunnel3.metrics.get_registry().create_gauge("twunnel3_connections", "Number of open client connections.")
+accepted_connections_metric = twunnel3.metrics.get_registry().create_counter("twunnel3_accepted_connections_total", "Number of accepted client connections.")
+handshake_failures_metric = twunnel3.metrics.get_registry().create_counter("twunnel3_handshake_failures_total", "Number of failed client handshakes.", "reason", ("request", "authentication", "admission", "timeout", "connect"))
+tunnels_metric = twunnel3.metrics.get_registry().create_gauge("twunnel3_tunnels", "Number of open tunnels.")
+connect_duration_metric = twunnel3.metrics.get_registry().create_histogram("twunnel3_connect_duration_seconds", "Time to open a tunnel to the remote address.")
 
 def set_default_configuration(configuration, keys):
     twunnel3.proxy_server.set_default_configuration(configuration, keys)
@@ -28,6 +43,40 @@ def set_default_configuration(configuration, keys):
                         configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i].setdefault("NAME", "")
                         configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i].setdefault("PASSWORD", "")
                         i = i + 1
+                    twunnel3.account_store.set_default_configuration(configuration["LOCAL_PROXY_SERVER"], ["ACCOUNTS_FILE"])
+        
+        configuration["LOCAL_PROXY_SERVER"].setdefault("REUSE_PORT", False)
+        configuration["LOCAL_PROXY_SERVER"].setdefault("WRITE_BUFFER", {})
+        configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"].setdefault("HIGH_WATER_MARK", 65536)
+        configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"].setdefault("LOW_WATER_MARK", 16384)
+        configuration["LOCAL_PROXY_SERVER"].setdefault("EARLY_DATA", {})
+        configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"].setdefault("MAXIMUM_LENGTH", 65536)
+        
+        twunnel3.admission.set_default_configuration(configuration["LOCAL_PROXY_SERVER"], ["ADMISSION"])
+        twunnel3.bandwidth.set_default_configuration(configuration["LOCAL_PROXY_SERVER"], ["BANDWIDTH"])
+        
+        configuration["LOCAL_PROXY_SERVER"].setdefault("TIMEOUT", {})
+        configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"].setdefault("HANDSHAKE", 10)
+        configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"].setdefault("CONNECT", 30)
+        configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"].setdefault("IDLE", 0)
+        
+        configuration["LOCAL_PROXY_SERVER"].setdefault("RELAY", {})
+        configuration["LOCAL_PROXY_SERVER"]["RELAY"].setdefault("TYPE", "")
+        configuration["LOCAL_PROXY_SERVER"]["RELAY"].setdefault("SIZE", 65536)
+        configuration["LOCAL_PROXY_SERVER"]["RELAY"].setdefault("BUFFER", {})
+        configuration["LOCAL_PROXY_SERVER"]["RELAY"]["BUFFER"].setdefault("SIZES", [4096, 16384, 65536])
+        configuration["LOCAL_PROXY_SERVER"]["RELAY"]["BUFFER"].setdefault("MAXIMUM_NUMBER_OF_BUFFERS", 1024)
+    
+    if "BALANCER" in keys:
+        configuration.setdefault("BALANCER", {})
+        configuration["BALANCER"].setdefault("TYPE", "ROUND_ROBIN")
+        configuration["BALANCER"].setdefault("LATENCY", {})
+        configuration["BALANCER"]["LATENCY"].setdefault("WEIGHT", 0.3)
+        configuration["BALANCER"]["LATENCY"].setdefault("PENALTY", 1.0)
+        configuration["BALANCER"].setdefault("EJECTION", {})
+        configuration["BALANCER"]["EJECTION"].setdefault("MAXIMUM_NUMBER_OF_FAILURES", 5)
+        configuration["BALANCER"]["EJECTION"].setdefault("TIME", 10)
+        configuration["BALANCER"]["EJECTION"].setdefault("MAXIMUM_TIME", 300)
     
     if "REMOTE_PROXY_SERVERS" in keys:
         configuration.setdefault("REMOTE_PROXY_SERVERS", [])
@@ -44,10 +93,14 @@ def set_default_configuration(configuration, keys):
                 configuration["REMOTE_PROXY_SERVERS"][i].setdefault("ACCOUNT", {})
                 configuration["REMOTE_PROXY_SERVERS"][i]["ACCOUNT"].setdefault("NAME", "")
                 configuration["REMOTE_PROXY_SERVERS"][i]["ACCOUNT"].setdefault("PASSWORD", "")
+                configuration["REMOTE_PROXY_SERVERS"][i].setdefault("PIPELINE", False)
+                configuration["REMOTE_PROXY_SERVERS"][i].setdefault("TIMEOUT", {})
+                configuration["REMOTE_PROXY_SERVERS"][i]["TIMEOUT"].setdefault("HANDSHAKE", 10)
+                twunnel3.multiplexer.set_default_configuration(configuration["REMOTE_PROXY_SERVERS"][i], ["MULTIPLEXER"])
             i = i + 1
 
 def create_server(configuration):
-    set_default_configuration(configuration, ["PROXY_SERVERS", "LOCAL_PROXY_SERVER", "REMOTE_PROXY_SERVERS"])
+    set_default_configuration(configuration, ["PROXY_SERVERS", "POOL", "RESOLVER", "LOCAL_PROXY_SERVER", "REMOTE_PROXY_SERVERS", "BALANCER"])
     
     output_protocol_connection_manager = OutputProtocolConnectionManager(configuration)
     
@@ -68,21 +121,70 @@ def create_server(configuration):
             else:
                 return None
 
+output_protocol_connection_managers = weakref.WeakSet()
+
+def get_statistics():
+    statistics = {}
+    statistics["NUMBER_OF_CONNECTIONS"] = 0
+    statistics["NUMBER_OF_ACCEPTED_CONNECTIONS"] = 0
+    statistics["MAXIMUM_EARLY_DATA_LENGTH"] = 0
+    statistics["WRITE_BUFFER_SIZE"] = 0
+    
+    for output_protocol_connection_manager in output_protocol_connection_managers:
+        statistics["NUMBER_OF_CONNECTIONS"] = statistics["NUMBER_OF_CONNECTIONS"] + output_protocol_connection_manager.number_of_connections
+        statistics["NUMBER_OF_ACCEPTED_CONNECTIONS"] = statistics["NUMBER_OF_ACCEPTED_CONNECTIONS"] + output_protocol_connection_manager.number_of_accepted_connections
+        statistics["MAXIMUM_EARLY_DATA_LENGTH"] = max(statistics["MAXIMUM_EARLY_DATA_LENGTH"], output_protocol_connection_manager.maximum_early_data_length)
+        
+        for input_protocol in output_protocol_connection_manager.input_protocols:
+            connection_statistics = output_protocol_connection_manager.get_connection_statistics(input_protocol)
+            
+            statistics["WRITE_BUFFER_SIZE"] = statistics["WRITE_BUFFER_SIZE"] + connection_statistics["INPUT_WRITE_BUFFER_SIZE"] + connection_statistics["OUTPUT_WRITE_BUFFER_SIZE"]
+        
+        if output_protocol_connection_manager.configuration["LOCAL_PROXY_SERVER"]["RELAY"]["TYPE"] == "BUFFERED":
+            from twunnel3.relay import get_buffer_pool
+            
+            statistics["BUFFER_POOL"] = get_buffer_pool(output_protocol_connection_manager.configuration["LOCAL_PROXY_SERVER"]["RELAY"]).get_statistics()
+    
+    statistics["ADMISSION"] = twunnel3.admission.get_admission_controller().get_statistics()
+    
+    resolver_statistics = twunnel3.proxy_server.get_resolver_statistics()
+    
+    if resolver_statistics is not None:
+        statistics["RESOLVER"] = resolver_statistics
+    
+    statistics["BANDWIDTH"] = twunnel3.bandwidth.get_token_bucket().get_statistics()
+    statistics["TIMER_WHEEL"] = twunnel3.timer.get_timer_wheel().get_statistics()
+    statistics["LOGGER"] = twunnel3.logger.get_default_logger().get_statistics()
+    
+    return statistics
+
 class OutputProtocol(asyncio.Protocol):
+    __slots__ = ("factory", "input_protocol", "relay", "token_bucket", "connection_state", "input_reading_state", "output_reading_state", "transport")
+    
     def __init__(self):
         twunnel3.logger.trace("OutputProtocol.__init__")
         
+        self.factory = None
         self.input_protocol = None
+        self.relay = None
+        self.token_bucket = None
         self.connection_state = 0
+        self.input_reading_state = 0
+        self.output_reading_state = 0
         self.transport = None
         
     def connection_made(self, transport):
         twunnel3.logger.trace("OutputProtocol.connection_made")
         
         self.transport = transport
+        self.transport.set_write_buffer_limits(high=self.input_protocol.configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"]["HIGH_WATER_MARK"], low=self.input_protocol.configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"]["LOW_WATER_MARK"])
+        
+        self.token_bucket = self.input_protocol.output_protocol_connection_manager.get_token_bucket(self.input_protocol)
         
         self.connection_state = 1
         
+        tunnels_metric.increase()
+        
         self.input_protocol.output_protocol__connection_made(self.transport)
         
     def connection_lost(self, exception):
@@ -90,6 +192,11 @@ class OutputProtocol(asyncio.Protocol):
         
         self.connection_state = 2
         
+        tunnels_metric.decrease()
+        
+        if self.factory.balancer_backend is not None:
+            self.factory.balancer_backend.output_protocol__connection_lost()
+        
         self.input_protocol.output_protocol__connection_lost(exception)
         
         self.transport = None
@@ -97,11 +204,28 @@ class OutputProtocol(asyncio.Protocol):
     def data_received(self, data):
         twunnel3.logger.trace("OutputProtocol.data_received")
         
+        twunnel3.metrics.relayed_bytes_metric.increase(len(data), "downstream")
+        
         self.input_protocol.output_protocol__data_received(data)
         
+        if self.token_bucket is not None and self.connection_state == 1:
+            self.token_bucket.consume(len(data))
+            
+            if self.output_reading_state & 2 == 0:
+                if self.token_bucket.wait(self.token_bucket__output_ready):
+                    self.pause_output_reading(2)
+        
     def input_protocol__connection_made(self, transport):
         twunnel3.logger.trace("OutputProtocol.input_protocol__connection_made")
         
+        if self.connection_state == 1 and self.token_bucket is None:
+            relay_class = self.get_relay_class(self.input_protocol.configuration["LOCAL_PROXY_SERVER"]["RELAY"]["TYPE"])
+            
+            if relay_class is not None:
+                relay = relay_class(self.input_protocol.configuration["LOCAL_PROXY_SERVER"]["RELAY"], transport, self.transport)
+                if relay.start():
+                    self.relay = relay
+        
     def input_protocol__connection_lost(self, exception):
         twunnel3.logger.trace("OutputProtocol.input_protocol__connection_lost")
         
@@ -112,60 +236,211 @@ class OutputProtocol(asyncio.Protocol):
         twunnel3.logger.trace("OutputProtocol.input_protocol__data_received")
         
         if self.connection_state == 1:
+            twunnel3.metrics.relayed_bytes_metric.increase(len(data), "upstream")
+            
             self.transport.write(data)
+            
+            if self.token_bucket is not None:
+                self.token_bucket.consume(len(data))
+                
+                if self.input_reading_state & 2 == 0:
+                    if self.token_bucket.wait(self.token_bucket__input_ready):
+                        self.pause_input_reading(2)
+    
+    def input_protocol__pause_writing(self):
+        twunnel3.logger.trace("OutputProtocol.input_protocol__pause_writing")
+        
+        if self.connection_state == 1 and self.relay is None:
+            self.pause_output_reading(1)
+    
+    def input_protocol__resume_writing(self):
+        twunnel3.logger.trace("OutputProtocol.input_protocol__resume_writing")
+        
+        if self.connection_state == 1 and self.relay is None:
+            self.resume_output_reading(1)
     
     def pause_writing(self):
-        twunnel3.logger.trace("OutputProtocol.pause_reading")
+        twunnel3.logger.trace("OutputProtocol.pause_writing")
         
-        if self.connection_state == 1:
-            self.transport.pause_reading()
+        if self.connection_state == 1 and self.relay is None:
+            self.pause_input_reading(1)
     
     def resume_writing(self):
         twunnel3.logger.trace("OutputProtocol.resume_writing")
         
+        if self.connection_state == 1 and self.relay is None:
+            self.resume_input_reading(1)
+    
+    def token_bucket__input_ready(self):
+        twunnel3.logger.trace("OutputProtocol.token_bucket__input_ready")
+        
+        if self.connection_state == 1:
+            self.resume_input_reading(2)
+    
+    def token_bucket__output_ready(self):
+        twunnel3.logger.trace("OutputProtocol.token_bucket__output_ready")
+        
         if self.connection_state == 1:
+            self.resume_output_reading(2)
+    
+    def pause_input_reading(self, reading_state):
+        twunnel3.logger.trace("OutputProtocol.pause_input_reading")
+        
+        if self.input_reading_state == 0:
+            self.input_protocol.output_protocol__pause_writing()
+        
+        self.input_reading_state = self.input_reading_state | reading_state
+    
+    def resume_input_reading(self, reading_state):
+        twunnel3.logger.trace("OutputProtocol.resume_input_reading")
+        
+        if self.input_reading_state == 0:
+            return
+        
+        self.input_reading_state = self.input_reading_state & ~reading_state
+        
+        if self.input_reading_state == 0:
+            self.input_protocol.output_protocol__resume_writing()
+    
+    def pause_output_reading(self, reading_state):
+        twunnel3.logger.trace("OutputProtocol.pause_output_reading")
+        
+        if self.output_reading_state == 0:
+            self.transport.pause_reading()
+        
+        self.output_reading_state = self.output_reading_state | reading_state
+    
+    def resume_output_reading(self, reading_state):
+        twunnel3.logger.trace("OutputProtocol.resume_output_reading")
+        
+        if self.output_reading_state == 0:
+            return
+        
+        self.output_reading_state = self.output_reading_state & ~reading_state
+        
+        if self.output_reading_state == 0:
             self.transport.resume_reading()
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("OutputProtocol.get_statistics")
+        
+        statistics = {}
+        statistics["WRITE_BUFFER_SIZE"] = 0
+        if self.connection_state == 1:
+            statistics["WRITE_BUFFER_SIZE"] = self.transport.get_write_buffer_size()
+        statistics["RELAY"] = self.relay is not None
+        
+        return statistics
+    
+    def get_relay_class(self, type):
+        twunnel3.logger.trace("OutputProtocol.get_relay_class")
+        
+        if type == "SPLICE":
+            from twunnel3.relay import SpliceRelay
+            
+            return SpliceRelay
+        else:
+            if type == "BUFFERED":
+                from twunnel3.relay import BufferedRelay
+                
+                return BufferedRelay
+            else:
+                return None
 
 class OutputProtocolFactory(object):
-    def __init__(self, input_protocol):
+    __slots__ = ("input_protocol", "balancer_backend", "connection_state", "connection_time")
+    
+    def __init__(self, input_protocol, balancer_backend=None):
         twunnel3.logger.trace("OutputProtocolFactory.__init__")
         
         self.input_protocol = input_protocol
+        self.balancer_backend = balancer_backend
+        self.connection_state = 0
+        self.connection_time = time.time()
         
     def __call__(self):
         twunnel3.logger.trace("OutputProtocolFactory.__call__")
         
+        if self.connection_state == 0:
+            self.connection_state = 1
+            
+            connect_duration_metric.observe(time.time() - self.connection_time)
+            
+            if self.balancer_backend is not None:
+                self.balancer_backend.output_protocol__connection_made(time.time() - self.connection_time)
+        
         output_protocol = OutputProtocol()
+        output_protocol.factory = self
         output_protocol.input_protocol = self.input_protocol
         output_protocol.input_protocol.output_protocol = output_protocol
         return output_protocol
+    
+    def connection_done(self, future):
+        twunnel3.logger.trace("OutputProtocolFactory.connection_done")
+        
+        if future.cancelled():
+            self.connection_failed(None)
+        else:
+            if future.exception() is not None:
+                self.connection_failed(future.exception())
+    
+    def connection_failed(self, exception):
+        twunnel3.logger.trace("OutputProtocolFactory.connection_failed")
+        
+        if self.connection_state == 0:
+            self.connection_state = 2
+            
+            if exception is not None:
+                twunnel3.logger.debug("output_protocol: " + str(exception))
+            
+            if self.balancer_backend is not None:
+                self.balancer_backend.output_protocol__connection_failed()
+            
+            if self.input_protocol.connection_state == 1:
+                self.input_protocol.output_protocol__connection_lost(exception)
 
 class OutputProtocolConnection(object):
     def __init__(self, configuration):
         twunnel3.logger.trace("OutputProtocolConnection.__init__")
         
         self.configuration = configuration
+        self.tunnel = twunnel3.proxy_server.create_tunnel(self.configuration)
     
-    def connect(self, remote_address, remote_port, input_protocol):
+    def connect(self, remote_address, remote_port, input_protocol, balancer_backend=None):
         twunnel3.logger.trace("OutputProtocolConnection.connect")
         
-        output_protocol_factory = OutputProtocolFactory(input_protocol)
+        output_protocol_factory = OutputProtocolFactory(input_protocol, balancer_backend)
         
-        tunnel = twunnel3.proxy_server.create_tunnel(self.configuration)
-        asyncio.async(tunnel.create_connection(output_protocol_factory, address=remote_address, port=remote_port))
+        future = twunnel3.compat.ensure_future(self.tunnel.create_connection(output_protocol_factory, address=remote_address, port=remote_port))
+        future.add_done_callback(output_protocol_factory.connection_done)
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("OutputProtocolConnection.get_statistics")
+        
+        statistics = {}
+        
+        return statistics
 
 class OutputProtocolConnectionManager(object):
     def __init__(self, configuration):
         twunnel3.logger.trace("OutputProtocolConnectionManager.__init__")
         
         self.configuration = configuration
-        self.i = -1
+        self.number_of_connections = 0
+        self.number_of_accepted_connections = 0
+        self.maximum_early_data_length = 0
+        self.input_protocols = set()
+        self.admission_controller = twunnel3.admission.AdmissionController(self.configuration["LOCAL_PROXY_SERVER"], twunnel3.admission.get_admission_controller())
+        self.token_bucket = twunnel3.bandwidth.TokenBucket(self.configuration["LOCAL_PROXY_SERVER"]["BANDWIDTH"], twunnel3.bandwidth.get_token_bucket())
+        self.token_buckets = {}
         
         self.output_protocol_connections = []
         
         if len(self.configuration["REMOTE_PROXY_SERVERS"]) == 0:
             configuration = {}
             configuration["PROXY_SERVERS"] = self.configuration["PROXY_SERVERS"]
+            configuration["POOL"] = self.configuration["POOL"]
+            configuration["RESOLVER"] = self.configuration["RESOLVER"]
             configuration["LOCAL_PROXY_SERVER"] = self.configuration["LOCAL_PROXY_SERVER"]
             
             output_protocol_connection = OutputProtocolConnection(configuration)
@@ -175,6 +450,8 @@ class OutputProtocolConnectionManager(object):
             while i < len(self.configuration["REMOTE_PROXY_SERVERS"]):
                 configuration = {}
                 configuration["PROXY_SERVERS"] = self.configuration["PROXY_SERVERS"]
+                configuration["POOL"] = self.configuration["POOL"]
+                configuration["RESOLVER"] = self.configuration["RESOLVER"]
                 configuration["LOCAL_PROXY_SERVER"] = self.configuration["LOCAL_PROXY_SERVER"]
                 configuration["REMOTE_PROXY_SERVER"] = self.configuration["REMOTE_PROXY_SERVERS"][i]
                 
@@ -185,16 +462,170 @@ class OutputProtocolConnectionManager(object):
                     self.output_protocol_connections.append(output_protocol_connection)
                 
                 i = i + 1
+        
+        balancer_class = self.get_balancer_class(self.configuration["BALANCER"]["TYPE"])
+        self.balancer = balancer_class(self.configuration, self.output_protocol_connections)
+        
+        output_protocol_connection_managers.add(self)
+    
+    def input_protocol__connection_made(self, input_protocol):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.input_protocol__connection_made")
+        
+        self.number_of_connections = self.number_of_connections + 1
+        self.number_of_accepted_connections = self.number_of_accepted_connections + 1
+        
+        connections_metric.increase()
+        accepted_connections_metric.increase()
+        
+        self.input_protocols.add(input_protocol)
+        
+        self.admission_controller.admit(input_protocol)
+    
+    def input_protocol__connection_lost(self, input_protocol):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.input_protocol__connection_lost")
+        
+        self.number_of_connections = self.number_of_connections - 1
+        
+        connections_metric.decrease()
+        
+        self.input_protocols.discard(input_protocol)
+        
+        self.admission_controller.release(input_protocol)
+    
+    def input_protocol__handshake_failed(self, input_protocol, reason):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.input_protocol__handshake_failed")
+        
+        handshake_failures_metric.increase(1, reason)
+    
+    def input_protocol__early_data_received(self, input_protocol, data_length):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.input_protocol__early_data_received")
+        
+        if data_length > self.maximum_early_data_length:
+            self.maximum_early_data_length = data_length
+    
+    def create_server(self, protocol_factory, address, port, ssl=None, reuse_port=False):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.create_server")
+        
+        server_arguments = {}
+        server_arguments["host"] = address
+        server_arguments["port"] = port
+        server_arguments["ssl"] = ssl
+        
+        if reuse_port:
+            server_arguments["reuse_port"] = True
+        
+        if twunnel3.compat.create_server_start_serving:
+            server_arguments["start_serving"] = False
+        
+        future = asyncio.Future()
+        
+        server_future = twunnel3.compat.ensure_future(asyncio.get_event_loop().create_server(protocol_factory, **server_arguments))
+        server_future.add_done_callback(lambda server_future: self.server__created(server_future, future, protocol_factory, ssl))
+        
+        return future
+    
+    def server__created(self, server_future, future, protocol_factory, ssl):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.server__created")
+        
+        if server_future.cancelled():
+            future.cancel()
+            
+            return
+        
+        if server_future.exception() is not None:
+            future.set_exception(server_future.exception())
+            
+            return
+        
+        future.set_result(self.admission_controller.add_server(server_future.result(), protocol_factory, ssl))
+        
+        for output_protocol_connection in self.output_protocol_connections:
+            output_protocol_connection.tunnel.fill_tunnel_connection_pool()
+    
+    def get_token_bucket(self, input_protocol):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.get_token_bucket")
+        
+        token_bucket = self.token_bucket
+        
+        if input_protocol.account_name is not None:
+            if self.configuration["LOCAL_PROXY_SERVER"]["BANDWIDTH"]["ACCOUNT"]["RATE"] > 0:
+                token_bucket = self.token_buckets.get(input_protocol.account_name)
+                
+                if token_bucket is None:
+                    token_bucket = twunnel3.bandwidth.TokenBucket(self.configuration["LOCAL_PROXY_SERVER"]["BANDWIDTH"]["ACCOUNT"], self.token_bucket)
+                    
+                    self.token_buckets[input_protocol.account_name] = token_bucket
+        
+        if not token_bucket.is_limited():
+            return None
+        
+        return token_bucket
     
     def connect(self, remote_address, remote_port, input_protocol):
         twunnel3.logger.trace("OutputProtocolConnectionManager.connect")
         
-        self.i = self.i + 1
-        if self.i >= len(self.output_protocol_connections):
-            self.i = 0
+        balancer_backend = self.balancer.get_backend()
+        balancer_backend.connect(remote_address, remote_port, input_protocol)
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.get_statistics")
+        
+        statistics = {}
+        statistics["NUMBER_OF_CONNECTIONS"] = self.number_of_connections
+        statistics["NUMBER_OF_ACCEPTED_CONNECTIONS"] = self.number_of_accepted_connections
+        statistics["MAXIMUM_EARLY_DATA_LENGTH"] = self.maximum_early_data_length
+        statistics["WRITE_BUFFER_SIZE"] = 0
+        statistics["CONNECTIONS"] = []
+        
+        for input_protocol in self.input_protocols:
+            connection_statistics = self.get_connection_statistics(input_protocol)
+            
+            statistics["WRITE_BUFFER_SIZE"] = statistics["WRITE_BUFFER_SIZE"] + connection_statistics["INPUT_WRITE_BUFFER_SIZE"] + connection_statistics["OUTPUT_WRITE_BUFFER_SIZE"]
+            statistics["CONNECTIONS"].append(connection_statistics)
+        
+        if self.configuration["LOCAL_PROXY_SERVER"]["RELAY"]["TYPE"] == "BUFFERED":
+            from twunnel3.relay import get_buffer_pool
+            
+            statistics["BUFFER_POOL"] = get_buffer_pool(self.configuration["LOCAL_PROXY_SERVER"]["RELAY"]).get_statistics()
+        
+        statistics["ADMISSION"] = self.admission_controller.get_statistics()
+        statistics["BANDWIDTH"] = self.token_bucket.get_statistics()
+        statistics["BANDWIDTH"]["ACCOUNTS"] = {}
+        
+        for account_name in self.token_buckets:
+            statistics["BANDWIDTH"]["ACCOUNTS"][account_name.decode()] = self.token_buckets[account_name].get_statistics()
+        
+        statistics["BACKENDS"] = []
+        
+        i = 0
+        while i < len(self.balancer.backends):
+            backend_statistics = self.balancer.backends[i].get_statistics()
+            backend_statistics.update(self.balancer.backends[i].output_protocol_connection.get_statistics())
+            
+            statistics["BACKENDS"].append(backend_statistics)
+            
+            i = i + 1
+        
+        return statistics
+    
+    def get_connection_statistics(self, input_protocol):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.get_connection_statistics")
+        
+        connection_statistics = {}
+        connection_statistics["REMOTE_ADDRESS"] = input_protocol.remote_address
+        connection_statistics["REMOTE_PORT"] = input_protocol.remote_port
+        connection_statistics["INPUT_WRITE_BUFFER_SIZE"] = 0
+        if input_protocol.transport is not None:
+            connection_statistics["INPUT_WRITE_BUFFER_SIZE"] = input_protocol.transport.get_write_buffer_size()
+        connection_statistics["OUTPUT_WRITE_BUFFER_SIZE"] = 0
+        connection_statistics["RELAY"] = False
+        if input_protocol.output_protocol is not None:
+            output_protocol_statistics = input_protocol.output_protocol.get_statistics()
+            
+            connection_statistics["OUTPUT_WRITE_BUFFER_SIZE"] = output_protocol_statistics["WRITE_BUFFER_SIZE"]
+            connection_statistics["RELAY"] = output_protocol_statistics["RELAY"]
         
-        output_protocol_connection = self.output_protocol_connections[self.i]
-        output_protocol_connection.connect(remote_address, remote_port, input_protocol)
+        return connection_statistics
     
     def get_output_protocol_connection_class(self, type):
         twunnel3.logger.trace("OutputProtocolConnectionManager.get_output_protocol_connection_class")
@@ -204,4 +635,26 @@ class OutputProtocolConnectionManager(object):
             
             return SSLOutputProtocolConnection
         else:
-            return None
\ No newline at end of file
+            return None
+    
+    def get_balancer_class(self, type):
+        twunnel3.logger.trace("OutputProtocolConnectionManager.get_balancer_class")
+        
+        if type == "LEAST_CONNECTIONS":
+            from twunnel3.balancer import LeastConnectionsBalancer
+            
+            return LeastConnectionsBalancer
+        else:
+            if type == "LATENCY":
+                from twunnel3.balancer import LatencyBalancer
+                
+                return LatencyBalancer
+            else:
+                if type == "POWER_OF_TWO_CHOICES":
+                    from twunnel3.balancer import PowerOfTwoChoicesBalancer
+                    
+                    return PowerOfTwoChoicesBalancer
+                else:
+                    from twunnel3.balancer import RoundRobinBalancer
+                    
+                    return RoundRobinBalancer
\ No newline at end of file
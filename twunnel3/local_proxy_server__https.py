@@ -3,33 +3,50 @@
 
 import asyncio
 import twunnel3.logger
+import twunnel3.parser
+import twunnel3.timer
 
 class HTTPSInputProtocol(asyncio.Protocol):
+    __slots__ = ("configuration", "output_protocol_connection_manager", "account_name", "output_protocol", "remote_address", "remote_port", "connection_state", "admission_state", "data", "data_state", "timer", "transport")
+    
     def __init__(self):
         twunnel3.logger.trace("HTTPSInputProtocol.__init__")
         
         self.configuration = None
         self.output_protocol_connection_manager = None
+        self.account_name = None
         self.output_protocol = None
         self.remote_address = ""
         self.remote_port = 0
         self.connection_state = 0
-        self.data = b""
+        self.admission_state = 0
+        self.data = twunnel3.parser.Parser()
         self.data_state = 0
+        self.timer = None
         self.transport = None
     
     def connection_made(self, transport):
         twunnel3.logger.trace("HTTPSInputProtocol.connection_made")
         
         self.transport = transport
+        self.transport.set_write_buffer_limits(high=self.configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"]["HIGH_WATER_MARK"], low=self.configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"]["LOW_WATER_MARK"])
         
         self.connection_state = 1
+        
+        self.timer = twunnel3.timer.Timer(self.timer__expired)
+        self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
+        
+        self.output_protocol_connection_manager.input_protocol__connection_made(self)
     
     def connection_lost(self, exception):
         twunnel3.logger.trace("HTTPSInputProtocol.connection_lost")
         
         self.connection_state = 2
         
+        self.timer.cancel()
+        
+        self.output_protocol_connection_manager.input_protocol__connection_lost(self)
+        
         if self.output_protocol is not None:
             self.output_protocol.input_protocol__connection_lost(exception)
         
@@ -38,13 +55,51 @@ class HTTPSInputProtocol(asyncio.Protocol):
     def data_received(self, data):
         twunnel3.logger.trace("HTTPSInputProtocol.data_received")
         
-        self.data = self.data + data
+        if self.data_state == 1:
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["IDLE"])
+            
+            self.output_protocol.input_protocol__data_received(data)
+            
+            return
+        
+        if self.data_state == 2:
+            self.data.write(data)
+            
+            self.process_early_data(len(data))
+            
+            return
+        
+        early_data = b""
+        
+        if len(data) > self.data.get_available_length():
+            if self.data.get_available_length() <= 0:
+                self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "request")
+                
+                response = b"HTTP/1.1 400 Bad Request\r\n"
+                response = response + b"\r\n"
+                
+                self.transport.write(response)
+                self.transport.close()
+                
+                return
+            
+            early_data = data[self.data.get_available_length():]
+            data = data[:self.data.get_available_length()]
+        
+        self.data.write(data)
+        
+        if self.admission_state == 1:
+            self.process_data()
+        
+        if len(early_data) > 0:
+            self.data_received(early_data)
+    
+    def process_data(self):
+        twunnel3.logger.trace("HTTPSInputProtocol.process_data")
+        
         if self.data_state == 0:
             if self.process_data_state0():
                 return
-        if self.data_state == 1:
-            if self.process_data_state1():
-                return
     
     def process_data_state0(self):
         twunnel3.logger.trace("HTTPSInputProtocol.process_data_state0")
@@ -58,16 +113,16 @@ class HTTPSInputProtocol(asyncio.Protocol):
         
         i = i + 4
         
-        request = data[:i]
+        request = data.read(i)
         
-        data = data[i:]
-        
-        self.data = data
+        data.commit()
         
         request_lines = request.split(b"\r\n")
         request_line = request_lines[0].split(b" ", 2)
         
         if len(request_line) != 3:
+            self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "request")
+            
             response = b"HTTP/1.1 400 Bad Request\r\n"
             response = response + b"\r\n"
             
@@ -104,10 +159,19 @@ class HTTPSInputProtocol(asyncio.Protocol):
             twunnel3.logger.debug("remote_address: " + self.remote_address)
             twunnel3.logger.debug("remote_port: " + str(self.remote_port))
             
+            self.data_state = 2
+            self.data.maximum_length = 0
+            
+            self.process_early_data(len(self.data))
+            
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["CONNECT"])
+            
             self.output_protocol_connection_manager.connect(self.remote_address, self.remote_port, self)
             
             return True
         else:
+            self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "request")
+            
             response = b"HTTP/1.1 405 Method Not Allowed\r\n"
             response = response + b"Allow: CONNECT\r\n"
             response = response + b"\r\n"
@@ -117,15 +181,48 @@ class HTTPSInputProtocol(asyncio.Protocol):
             
             return True
         
-    def process_data_state1(self):
-        twunnel3.logger.trace("HTTPSInputProtocol.process_data_state1")
+    def process_early_data(self, data_length):
+        twunnel3.logger.trace("HTTPSInputProtocol.process_early_data")
+        
+        if len(self.data) == 0:
+            return
         
-        self.output_protocol.input_protocol__data_received(self.data)
+        self.output_protocol_connection_manager.input_protocol__early_data_received(self, len(self.data))
         
-        self.data = b""
+        if self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"] > 0:
+            if len(self.data) - data_length < self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"] and len(self.data) >= self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"]:
+                self.transport.pause_reading()
+    
+    def admission__queued(self):
+        twunnel3.logger.trace("HTTPSInputProtocol.admission__queued")
+        
+        if self.connection_state == 1:
+            self.timer.cancel()
+            
+            self.transport.pause_reading()
+    
+    def admission__admitted(self):
+        twunnel3.logger.trace("HTTPSInputProtocol.admission__admitted")
         
-        return True
+        if self.connection_state == 1:
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
+            
+            self.transport.resume_reading()
+            
+            self.process_data()
+    
+    def admission__rejected(self):
+        twunnel3.logger.trace("HTTPSInputProtocol.admission__rejected")
         
+        if self.connection_state == 1:
+            self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "admission")
+            
+            response = b"HTTP/1.1 503 Service Unavailable\r\n"
+            response = response + b"\r\n"
+            
+            self.transport.write(response)
+            self.transport.close()
+    
     def output_protocol__connection_made(self, transport):
         twunnel3.logger.trace("HTTPSInputProtocol.output_protocol__connection_made")
         
@@ -135,12 +232,24 @@ class HTTPSInputProtocol(asyncio.Protocol):
             
             self.transport.write(response)
             
-            self.output_protocol.input_protocol__connection_made(self.transport)
-            if len(self.data) > 0:
-                self.output_protocol.input_protocol__data_received(self.data)
+            data_length = len(self.data)
+            
+            if self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"] > 0:
+                if data_length >= self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"]:
+                    self.transport.resume_reading()
             
-            self.data = b""
+            if data_length > 0:
+                self.output_protocol.input_protocol__data_received(self.data.read(data_length))
+            
+            self.data = None
             self.data_state = 1
+            
+            self.output_protocol.input_protocol__connection_made(self.transport)
+            
+            if self.output_protocol.relay is None:
+                self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["IDLE"])
+            else:
+                self.timer.cancel()
         else:
             if self.connection_state == 2:
                 self.output_protocol.input_protocol__connection_lost(None)
@@ -152,6 +261,8 @@ class HTTPSInputProtocol(asyncio.Protocol):
             if self.data_state == 1:
                 self.transport.close()
             else:
+                self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "connect")
+                
                 response = b"HTTP/1.1 404 Not Found\r\n"
                 response = response + b"\r\n"
                 
@@ -165,24 +276,53 @@ class HTTPSInputProtocol(asyncio.Protocol):
         twunnel3.logger.trace("HTTPSInputProtocol.output_protocol__data_received")
         
         if self.connection_state == 1:
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["IDLE"])
+            
             self.transport.write(data)
         else:
             if self.connection_state == 2:
                 self.output_protocol.input_protocol__connection_lost(None)
     
-    def pause_writing(self):
-        twunnel3.logger.trace("HTTPSInputProtocol.pause_reading")
+    def timer__expired(self):
+        twunnel3.logger.trace("HTTPSInputProtocol.timer__expired")
+        
+        if self.connection_state == 1:
+            twunnel3.logger.debug("input_protocol: timeout")
+            
+            if self.data_state != 1:
+                self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "timeout")
+            
+            self.transport.close()
+    
+    def output_protocol__pause_writing(self):
+        twunnel3.logger.trace("HTTPSInputProtocol.output_protocol__pause_writing")
         
         if self.connection_state == 1:
             self.transport.pause_reading()
     
+    def output_protocol__resume_writing(self):
+        twunnel3.logger.trace("HTTPSInputProtocol.output_protocol__resume_writing")
+        
+        if self.connection_state == 1:
+            self.transport.resume_reading()
+    
+    def pause_writing(self):
+        twunnel3.logger.trace("HTTPSInputProtocol.pause_writing")
+        
+        if self.connection_state == 1:
+            if self.output_protocol is not None:
+                self.output_protocol.input_protocol__pause_writing()
+    
     def resume_writing(self):
         twunnel3.logger.trace("HTTPSInputProtocol.resume_writing")
         
         if self.connection_state == 1:
-            self.transport.resume_reading()
+            if self.output_protocol is not None:
+                self.output_protocol.input_protocol__resume_writing()
 
 class HTTPSInputProtocolFactory(object):
+    __slots__ = ("configuration", "output_protocol_connection_manager")
+    
     protocol = HTTPSInputProtocol
     
     def __init__(self, configuration, output_protocol_connection_manager):
@@ -201,4 +341,5 @@ class HTTPSInputProtocolFactory(object):
 
 def create_https_server(configuration, output_protocol_connection_manager):
     input_protocol_factory = HTTPSInputProtocolFactory(configuration, output_protocol_connection_manager)
-    return asyncio.get_event_loop().create_server(input_protocol_factory, host=configuration["LOCAL_PROXY_SERVER"]["ADDRESS"], port=configuration["LOCAL_PROXY_SERVER"]["PORT"])
\ No newline at end of file
+    
+    return output_protocol_connection_manager.create_server(input_protocol_factory, configuration["LOCAL_PROXY_SERVER"]["ADDRESS"], configuration["LOCAL_PROXY_SERVER"]["PORT"], reuse_port=configuration["LOCAL_PROXY_SERVER"]["REUSE_PORT"])
\ No newline at end of file
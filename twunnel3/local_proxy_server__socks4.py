@@ -5,33 +5,50 @@ import asyncio
 import socket
 import struct
 import twunnel3.logger
+import twunnel3.parser
+import twunnel3.timer
 
 class SOCKS4InputProtocol(asyncio.Protocol):
+    __slots__ = ("configuration", "output_protocol_connection_manager", "account_name", "output_protocol", "remote_address", "remote_port", "connection_state", "admission_state", "data", "data_state", "timer", "transport")
+    
     def __init__(self):
         twunnel3.logger.trace("SOCKS4InputProtocol.__init__")
         
         self.configuration = None
         self.output_protocol_connection_manager = None
+        self.account_name = None
         self.output_protocol = None
         self.remote_address = ""
         self.remote_port = 0
         self.connection_state = 0
-        self.data = b""
+        self.admission_state = 0
+        self.data = twunnel3.parser.Parser()
         self.data_state = 0
+        self.timer = None
         self.transport = None
     
     def connection_made(self, transport):
         twunnel3.logger.trace("SOCKS4InputProtocol.connection_made")
         
         self.transport = transport
+        self.transport.set_write_buffer_limits(high=self.configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"]["HIGH_WATER_MARK"], low=self.configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"]["LOW_WATER_MARK"])
         
         self.connection_state = 1
+        
+        self.timer = twunnel3.timer.Timer(self.timer__expired)
+        self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
+        
+        self.output_protocol_connection_manager.input_protocol__connection_made(self)
     
     def connection_lost(self, exception):
         twunnel3.logger.trace("SOCKS4InputProtocol.connection_lost")
         
         self.connection_state = 2
         
+        self.timer.cancel()
+        
+        self.output_protocol_connection_manager.input_protocol__connection_lost(self)
+        
         if self.output_protocol is not None:
             self.output_protocol.input_protocol__connection_lost(exception)
         
@@ -40,13 +57,50 @@ class SOCKS4InputProtocol(asyncio.Protocol):
     def data_received(self, data):
         twunnel3.logger.trace("SOCKS4InputProtocol.data_received")
         
-        self.data = self.data + data
+        if self.data_state == 1:
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["IDLE"])
+            
+            self.output_protocol.input_protocol__data_received(data)
+            
+            return
+        
+        if self.data_state == 2:
+            self.data.write(data)
+            
+            self.process_early_data(len(data))
+            
+            return
+        
+        early_data = b""
+        
+        if len(data) > self.data.get_available_length():
+            if self.data.get_available_length() <= 0:
+                self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "request")
+                
+                response = struct.pack("!BBHI", 0x00, 0x5b, 0, 0)
+                
+                self.transport.write(response)
+                self.transport.close()
+                
+                return
+            
+            early_data = data[self.data.get_available_length():]
+            data = data[:self.data.get_available_length()]
+        
+        self.data.write(data)
+        
+        if self.admission_state == 1:
+            self.process_data()
+        
+        if len(early_data) > 0:
+            self.data_received(early_data)
+    
+    def process_data(self):
+        twunnel3.logger.trace("SOCKS4InputProtocol.process_data")
+        
         if self.data_state == 0:
             if self.process_data_state0():
                 return
-        if self.data_state == 1:
-            if self.process_data_state1():
-                return
         
     def process_data_state0(self):
         twunnel3.logger.trace("SOCKS4InputProtocol.process_data_state0")
@@ -56,9 +110,7 @@ class SOCKS4InputProtocol(asyncio.Protocol):
         if len(data) < 8:
             return True
         
-        version, method, port, address = struct.unpack("!BBHI", data[:8])
-        
-        data = data[8:]
+        version, method, port, address = data.unpack("!BBHI")
         
         address_type = 0x01
         if address >= 1 and address <= 255:
@@ -72,29 +124,50 @@ class SOCKS4InputProtocol(asyncio.Protocol):
             
             self.remote_address = address
         
-        if b"\x00" not in data:
+        i = data.find(b"\x00")
+        
+        if i == -1:
+            data.rollback()
+            
             return True
         
-        name, data = data.split(b"\x00", 1)
+        name = data.read(i)
+        
+        data.skip(1)
         
         if address_type == 0x03:
-            if b"\x00" not in data:
+            i = data.find(b"\x00")
+            
+            if i == -1:
+                data.rollback()
+                
                 return True
             
-            address, data = data.split(b"\x00", 1)
+            address = data.read(i)
+            
+            data.skip(1)
             
             self.remote_address = address.decode()
         
-        self.data = data
+        data.commit()
         
         twunnel3.logger.debug("remote_address: " + self.remote_address)
         twunnel3.logger.debug("remote_port: " + str(self.remote_port))
         
         if method == 0x01:
+            self.data_state = 2
+            self.data.maximum_length = 0
+            
+            self.process_early_data(len(self.data))
+            
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["CONNECT"])
+            
             self.output_protocol_connection_manager.connect(self.remote_address, self.remote_port, self)
             
             return True
         else:
+            self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "request")
+            
             response = struct.pack("!BBHI", 0x00, 0x5b, 0, 0)
             
             self.transport.write(response)
@@ -102,15 +175,47 @@ class SOCKS4InputProtocol(asyncio.Protocol):
             
             return True
         
-    def process_data_state1(self):
-        twunnel3.logger.trace("SOCKS4InputProtocol.process_data_state1")
+    def process_early_data(self, data_length):
+        twunnel3.logger.trace("SOCKS4InputProtocol.process_early_data")
+        
+        if len(self.data) == 0:
+            return
         
-        self.output_protocol.input_protocol__data_received(self.data)
+        self.output_protocol_connection_manager.input_protocol__early_data_received(self, len(self.data))
         
-        self.data = b""
+        if self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"] > 0:
+            if len(self.data) - data_length < self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"] and len(self.data) >= self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"]:
+                self.transport.pause_reading()
+    
+    def admission__queued(self):
+        twunnel3.logger.trace("SOCKS4InputProtocol.admission__queued")
+        
+        if self.connection_state == 1:
+            self.timer.cancel()
+            
+            self.transport.pause_reading()
+    
+    def admission__admitted(self):
+        twunnel3.logger.trace("SOCKS4InputProtocol.admission__admitted")
         
-        return True
+        if self.connection_state == 1:
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
+            
+            self.transport.resume_reading()
+            
+            self.process_data()
+    
+    def admission__rejected(self):
+        twunnel3.logger.trace("SOCKS4InputProtocol.admission__rejected")
         
+        if self.connection_state == 1:
+            self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "admission")
+            
+            response = struct.pack("!BBHI", 0x00, 0x5b, 0, 0)
+            
+            self.transport.write(response)
+            self.transport.close()
+    
     def output_protocol__connection_made(self, transport):
         twunnel3.logger.trace("SOCKS4InputProtocol.output_protocol__connection_made")
         
@@ -119,12 +224,24 @@ class SOCKS4InputProtocol(asyncio.Protocol):
             
             self.transport.write(response)
             
-            self.output_protocol.input_protocol__connection_made(self.transport)
-            if len(self.data) > 0:
-                self.output_protocol.input_protocol__data_received(self.data)
+            data_length = len(self.data)
+            
+            if self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"] > 0:
+                if data_length >= self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"]:
+                    self.transport.resume_reading()
             
-            self.data = b""
+            if data_length > 0:
+                self.output_protocol.input_protocol__data_received(self.data.read(data_length))
+            
+            self.data = None
             self.data_state = 1
+            
+            self.output_protocol.input_protocol__connection_made(self.transport)
+            
+            if self.output_protocol.relay is None:
+                self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["IDLE"])
+            else:
+                self.timer.cancel()
         else:
             if self.connection_state == 2:
                 self.output_protocol.input_protocol__connection_lost(None)
@@ -134,6 +251,8 @@ class SOCKS4InputProtocol(asyncio.Protocol):
         
         if self.connection_state == 1:
             if self.data_state != 1:
+                self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "connect")
+                
                 response = struct.pack("!BBHI", 0x00, 0x5b, 0, 0)
                 
                 self.transport.write(response)
@@ -148,24 +267,53 @@ class SOCKS4InputProtocol(asyncio.Protocol):
         twunnel3.logger.trace("SOCKS4InputProtocol.output_protocol__data_received")
         
         if self.connection_state == 1:
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["IDLE"])
+            
             self.transport.write(data)
         else:
             if self.connection_state == 2:
                 self.output_protocol.input_protocol__connection_lost(None)
     
-    def pause_writing(self):
-        twunnel3.logger.trace("SOCKS4InputProtocol.pause_reading")
+    def timer__expired(self):
+        twunnel3.logger.trace("SOCKS4InputProtocol.timer__expired")
+        
+        if self.connection_state == 1:
+            twunnel3.logger.debug("input_protocol: timeout")
+            
+            if self.data_state != 1:
+                self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "timeout")
+            
+            self.transport.close()
+    
+    def output_protocol__pause_writing(self):
+        twunnel3.logger.trace("SOCKS4InputProtocol.output_protocol__pause_writing")
         
         if self.connection_state == 1:
             self.transport.pause_reading()
     
+    def output_protocol__resume_writing(self):
+        twunnel3.logger.trace("SOCKS4InputProtocol.output_protocol__resume_writing")
+        
+        if self.connection_state == 1:
+            self.transport.resume_reading()
+    
+    def pause_writing(self):
+        twunnel3.logger.trace("SOCKS4InputProtocol.pause_writing")
+        
+        if self.connection_state == 1:
+            if self.output_protocol is not None:
+                self.output_protocol.input_protocol__pause_writing()
+    
     def resume_writing(self):
         twunnel3.logger.trace("SOCKS4InputProtocol.resume_writing")
         
         if self.connection_state == 1:
-            self.transport.resume_reading()
+            if self.output_protocol is not None:
+                self.output_protocol.input_protocol__resume_writing()
 
 class SOCKS4InputProtocolFactory(object):
+    __slots__ = ("configuration", "output_protocol_connection_manager")
+    
     def __init__(self, configuration, output_protocol_connection_manager):
         twunnel3.logger.trace("SOCKS4InputProtocolFactory.__init__")
         
@@ -182,4 +330,5 @@ class SOCKS4InputProtocolFactory(object):
 
 def create_socks4_server(configuration, output_protocol_connection_manager):
     input_protocol_factory = SOCKS4InputProtocolFactory(configuration, output_protocol_connection_manager)
-    return asyncio.get_event_loop().create_server(input_protocol_factory, host=configuration["LOCAL_PROXY_SERVER"]["ADDRESS"], port=configuration["LOCAL_PROXY_SERVER"]["PORT"])
\ No newline at end of file
+    
+    return output_protocol_connection_manager.create_server(input_protocol_factory, configuration["LOCAL_PROXY_SERVER"]["ADDRESS"], configuration["LOCAL_PROXY_SERVER"]["PORT"], reuse_port=configuration["LOCAL_PROXY_SERVER"]["REUSE_PORT"])
\ No newline at end of file
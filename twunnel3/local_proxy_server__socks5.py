@@ -4,34 +4,56 @@
 import asyncio
 import socket
 import struct
+import twunnel3.account_store
 import twunnel3.logger
+import twunnel3.parser
+import twunnel3.timer
 
 class SOCKS5InputProtocol(asyncio.Protocol):
+    __slots__ = ("configuration", "output_protocol_connection_manager", "account_store", "account_name", "output_protocol", "remote_address", "remote_port", "connection_state", "admission_state", "data", "data_state", "timer", "transport")
+    
     def __init__(self):
         twunnel3.logger.trace("SOCKS5InputProtocol.__init__")
         
         self.configuration = None
         self.output_protocol_connection_manager = None
+        self.account_store = None
+        self.account_name = None
         self.output_protocol = None
         self.remote_address = ""
         self.remote_port = 0
         self.connection_state = 0
-        self.data = b""
+        self.admission_state = 0
+        self.data = twunnel3.parser.Parser()
         self.data_state = 0
+        self.timer = None
         self.transport = None
     
     def connection_made(self, transport):
         twunnel3.logger.trace("SOCKS5InputProtocol.connection_made")
         
         self.transport = transport
+        self.transport.set_write_buffer_limits(high=self.configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"]["HIGH_WATER_MARK"], low=self.configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"]["LOW_WATER_MARK"])
         
         self.connection_state = 1
+        
+        self.timer = twunnel3.timer.Timer(self.timer__expired)
+        self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
+        
+        self.output_protocol_connection_manager.input_protocol__connection_made(self)
     
     def connection_lost(self, exception):
         twunnel3.logger.trace("SOCKS5InputProtocol.connection_lost")
         
         self.connection_state = 2
         
+        self.timer.cancel()
+        
+        self.output_protocol_connection_manager.input_protocol__connection_lost(self)
+        
+        if self.account_name is not None:
+            self.output_protocol_connection_manager.admission_controller.release_account(self.account_name)
+        
         if self.output_protocol is not None:
             self.output_protocol.input_protocol__connection_lost(exception)
         
@@ -40,7 +62,44 @@ class SOCKS5InputProtocol(asyncio.Protocol):
     def data_received(self, data):
         twunnel3.logger.trace("SOCKS5InputProtocol.data_received")
         
-        self.data = self.data + data
+        if self.data_state == 3:
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["IDLE"])
+            
+            self.output_protocol.input_protocol__data_received(data)
+            
+            return
+        
+        if self.data_state == 4:
+            self.data.write(data)
+            
+            self.process_early_data(len(data))
+            
+            return
+        
+        early_data = b""
+        
+        if len(data) > self.data.get_available_length():
+            if self.data.get_available_length() <= 0:
+                self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "request")
+                
+                self.transport.close()
+                
+                return
+            
+            early_data = data[self.data.get_available_length():]
+            data = data[:self.data.get_available_length()]
+        
+        self.data.write(data)
+        
+        if self.admission_state == 1:
+            self.process_data()
+        
+        if len(early_data) > 0:
+            self.data_received(early_data)
+    
+    def process_data(self):
+        twunnel3.logger.trace("SOCKS5InputProtocol.process_data")
+        
         if self.data_state == 0:
             if self.process_data_state0():
                 return
@@ -50,9 +109,6 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         if self.data_state == 2:
             if self.process_data_state2():
                 return
-        if self.data_state == 3:
-            if self.process_data_state3():
-                return
     
     def process_data_state0(self):
         twunnel3.logger.trace("SOCKS5InputProtocol.process_data_state0")
@@ -62,21 +118,19 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         if len(data) < 2:
             return True
         
-        version, number_of_methods = struct.unpack("!BB", data[:2])
-        
-        data = data[2:]
+        version, number_of_methods = data.unpack("!BB")
         
         if len(data) < number_of_methods:
+            data.rollback()
+            
             return True
         
-        methods = struct.unpack("!%dB" % number_of_methods, data[:number_of_methods])
+        methods = data.unpack("!%dB" % number_of_methods)
         
-        data = data[number_of_methods:]
-        
-        self.data = data
+        data.commit()
         
         supported_methods = []
-        if len(self.configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"]) == 0:
+        if self.account_store.is_empty():
             supported_methods.append(0x00)
         else:
             supported_methods.append(0x02)
@@ -99,7 +153,9 @@ class SOCKS5InputProtocol(asyncio.Protocol):
                         
                         self.data_state = 1
                         
-                        return True
+                        return False
+        
+        self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "authentication")
         
         response = struct.pack("!BB", 0x05, 0xFF)
         
@@ -116,53 +172,44 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         if len(data) < 2:
             return True
         
-        version, name_length = struct.unpack("!BB", data[:2])
-        
-        data = data[2:]
+        version, name_length = data.unpack("!BB")
         
         if len(data) < name_length:
+            data.rollback()
+            
             return True
         
-        name, = struct.unpack("!%ds" % name_length, data[:name_length])
-        
-        data = data[name_length:]
+        name = data.read(name_length)
         
         if len(data) < 1:
+            data.rollback()
+            
             return True
         
-        password_length, = struct.unpack("!B", data[:1])
-        
-        data = data[1:]
+        password_length, = data.unpack("!B")
         
         if len(data) < password_length:
+            data.rollback()
+            
             return True
         
-        password, = struct.unpack("!%ds" % password_length, data[:password_length])
+        password = data.read(password_length)
         
-        data = data[password_length:]
+        data.commit()
         
-        self.data = data
-        
-        i = 0
-        while i < len(self.configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"]):
-            if self.configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i]["NAME"].encode() == name:
-                if self.configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i]["PASSWORD"].encode() == password:
-                    response = struct.pack("!BB", 0x05, 0x00)
-                    
-                    self.transport.write(response)
-                    
-                    self.data_state = 2
-                    
-                    return True
+        if self.account_store.authenticate(name, password):
+            if self.output_protocol_connection_manager.admission_controller.admit_account(name):
+                self.account_name = name
                 
-                response = struct.pack("!BB", 0x05, 0x01)
+                response = struct.pack("!BB", 0x05, 0x00)
                 
                 self.transport.write(response)
-                self.transport.close()
                 
-                return True
-            
-            i = i + 1
+                self.data_state = 2
+                
+                return False
+        
+        self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "authentication")
         
         response = struct.pack("!BB", 0x05, 0x01)
         
@@ -179,70 +226,75 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         if len(data) < 4:
             return True
         
-        version, method, reserved, address_type = struct.unpack("!BBBB", data[:4])
-        
-        data = data[4:]
+        version, method, reserved, address_type = data.unpack("!BBBB")
         
         if address_type == 0x01:
             if len(data) < 4:
+                data.rollback()
+                
                 return True
             
-            address, = struct.unpack("!I", data[:4])
-            address = struct.pack("!I", address)
+            address = data.read(4)
             address = socket.inet_ntop(socket.AF_INET, address)
             
             self.remote_address = address
-            
-            data = data[4:]
         else:
             if address_type == 0x03:
                 if len(data) < 1:
+                    data.rollback()
+                    
                     return True
                 
-                address_length, = struct.unpack("!B", data[:1])
-                
-                data = data[1:]
+                address_length, = data.unpack("!B")
                 
                 if len(data) < address_length:
+                    data.rollback()
+                    
                     return True
                 
-                address, = struct.unpack("!%ds" % address_length, data[:address_length])
+                address = data.read(address_length)
                 
                 self.remote_address = address.decode()
-                
-                data = data[address_length:]
             else:
                 if address_type == 0x04:
                     if len(data) < 16:
+                        data.rollback()
+                        
                         return True
                     
-                    address1, address2, address3, address4 = struct.unpack("!IIII", data[:16])
-                    address = struct.pack("!IIII", address1, address2, address3, address4)
+                    address = data.read(16)
                     address = socket.inet_ntop(socket.AF_INET6, address)
                     
                     self.remote_address = address
-                    
-                    data = data[16:]
         
         if len(data) < 2:
+            data.rollback()
+            
             return True
         
-        port, = struct.unpack("!H", data[:2])
+        port, = data.unpack("!H")
         
         self.remote_port = port
         
-        data = data[2:]
-        
-        self.data = data
+        data.commit()
         
         twunnel3.logger.debug("remote_address: " + self.remote_address)
         twunnel3.logger.debug("remote_port: " + str(self.remote_port))
         
         if method == 0x01:
+            self.data_state = 4
+            self.data.maximum_length = 0
+            
+            self.process_early_data(len(self.data))
+            
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["CONNECT"])
+            
             self.output_protocol_connection_manager.connect(self.remote_address, self.remote_port, self)
             
             return True
         else:
+            self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "request")
+            
             response = struct.pack("!BBBBIH", 0x05, 0x07, 0x00, 0x01, 0, 0)
             
             self.transport.write(response)
@@ -250,15 +302,47 @@ class SOCKS5InputProtocol(asyncio.Protocol):
             
             return True
         
-    def process_data_state3(self):
-        twunnel3.logger.trace("SOCKS5InputProtocol.process_data_state3")
+    def process_early_data(self, data_length):
+        twunnel3.logger.trace("SOCKS5InputProtocol.process_early_data")
         
-        self.output_protocol.input_protocol__data_received(self.data)
+        if len(self.data) == 0:
+            return
         
-        self.data = b""
+        self.output_protocol_connection_manager.input_protocol__early_data_received(self, len(self.data))
         
-        return True
+        if self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"] > 0:
+            if len(self.data) - data_length < self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"] and len(self.data) >= self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"]:
+                self.transport.pause_reading()
+    
+    def admission__queued(self):
+        twunnel3.logger.trace("SOCKS5InputProtocol.admission__queued")
+        
+        if self.connection_state == 1:
+            self.timer.cancel()
+            
+            self.transport.pause_reading()
+    
+    def admission__admitted(self):
+        twunnel3.logger.trace("SOCKS5InputProtocol.admission__admitted")
+        
+        if self.connection_state == 1:
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
+            
+            self.transport.resume_reading()
+            
+            self.process_data()
+    
+    def admission__rejected(self):
+        twunnel3.logger.trace("SOCKS5InputProtocol.admission__rejected")
         
+        if self.connection_state == 1:
+            self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "admission")
+            
+            response = struct.pack("!BB", 0x05, 0xFF)
+            
+            self.transport.write(response)
+            self.transport.close()
+    
     def output_protocol__connection_made(self, transport):
         twunnel3.logger.trace("SOCKS5InputProtocol.output_protocol__connection_made")
         
@@ -267,12 +351,24 @@ class SOCKS5InputProtocol(asyncio.Protocol):
             
             self.transport.write(response)
             
-            self.output_protocol.input_protocol__connection_made(self.transport)
-            if len(self.data) > 0:
-                self.output_protocol.input_protocol__data_received(self.data)
+            data_length = len(self.data)
+            
+            if self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"] > 0:
+                if data_length >= self.configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"]["MAXIMUM_LENGTH"]:
+                    self.transport.resume_reading()
             
-            self.data = b""
+            if data_length > 0:
+                self.output_protocol.input_protocol__data_received(self.data.read(data_length))
+            
+            self.data = None
             self.data_state = 3
+            
+            self.output_protocol.input_protocol__connection_made(self.transport)
+            
+            if self.output_protocol.relay is None:
+                self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["IDLE"])
+            else:
+                self.timer.cancel()
         else:
             if self.connection_state == 2:
                 self.output_protocol.input_protocol__connection_lost(None)
@@ -282,6 +378,8 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         
         if self.connection_state == 1:
             if self.data_state != 3:
+                self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "connect")
+                
                 response = struct.pack("!BBBBIH", 0x05, 0x05, 0x00, 0x01, 0, 0)
                 
                 self.transport.write(response)
@@ -296,29 +394,59 @@ class SOCKS5InputProtocol(asyncio.Protocol):
         twunnel3.logger.trace("SOCKS5InputProtocol.output_protocol__data_received")
         
         if self.connection_state == 1:
+            self.timer.start(self.configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"]["IDLE"])
+            
             self.transport.write(data)
         else:
             if self.connection_state == 2:
                 self.output_protocol.input_protocol__connection_lost(None)
     
-    def pause_writing(self):
-        twunnel3.logger.trace("SOCKS5InputProtocol.pause_reading")
+    def timer__expired(self):
+        twunnel3.logger.trace("SOCKS5InputProtocol.timer__expired")
+        
+        if self.connection_state == 1:
+            twunnel3.logger.debug("input_protocol: timeout")
+            
+            if self.data_state != 3:
+                self.output_protocol_connection_manager.input_protocol__handshake_failed(self, "timeout")
+            
+            self.transport.close()
+    
+    def output_protocol__pause_writing(self):
+        twunnel3.logger.trace("SOCKS5InputProtocol.output_protocol__pause_writing")
         
         if self.connection_state == 1:
             self.transport.pause_reading()
     
+    def output_protocol__resume_writing(self):
+        twunnel3.logger.trace("SOCKS5InputProtocol.output_protocol__resume_writing")
+        
+        if self.connection_state == 1:
+            self.transport.resume_reading()
+    
+    def pause_writing(self):
+        twunnel3.logger.trace("SOCKS5InputProtocol.pause_writing")
+        
+        if self.connection_state == 1:
+            if self.output_protocol is not None:
+                self.output_protocol.input_protocol__pause_writing()
+    
     def resume_writing(self):
         twunnel3.logger.trace("SOCKS5InputProtocol.resume_writing")
         
         if self.connection_state == 1:
-            self.transport.resume_reading()
+            if self.output_protocol is not None:
+                self.output_protocol.input_protocol__resume_writing()
 
 class SOCKS5InputProtocolFactory(object):
+    __slots__ = ("configuration", "output_protocol_connection_manager", "account_store")
+    
     def __init__(self, configuration, output_protocol_connection_manager):
         twunnel3.logger.trace("SOCKS5InputProtocolFactory.__init__")
         
         self.configuration = configuration
         self.output_protocol_connection_manager = output_protocol_connection_manager
+        self.account_store = twunnel3.account_store.AccountStore(self.configuration["LOCAL_PROXY_SERVER"])
     
     def __call__(self):
         twunnel3.logger.trace("SOCKS5InputProtocolFactory.__call__")
@@ -326,8 +454,10 @@ class SOCKS5InputProtocolFactory(object):
         input_protocol = SOCKS5InputProtocol()
         input_protocol.configuration = self.configuration
         input_protocol.output_protocol_connection_manager = self.output_protocol_connection_manager
+        input_protocol.account_store = self.account_store
         return input_protocol
 
 def create_socks5_server(configuration, output_protocol_connection_manager):
     input_protocol_factory = SOCKS5InputProtocolFactory(configuration, output_protocol_connection_manager)
-    return asyncio.get_event_loop().create_server(input_protocol_factory, host=configuration["LOCAL_PROXY_SERVER"]["ADDRESS"], port=configuration["LOCAL_PROXY_SERVER"]["PORT"])
\ No newline at end of file
+    
+    return output_protocol_connection_manager.create_server(input_protocol_factory, configuration["LOCAL_PROXY_SERVER"]["ADDRESS"], configuration["LOCAL_PROXY_SERVER"]["PORT"], reuse_port=configuration["LOCAL_PROXY_SERVER"]["REUSE_PORT"])
\ No newline at end of file
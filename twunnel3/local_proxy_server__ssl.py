@@ -3,44 +3,215 @@
 
 import asyncio
 import ssl as _ssl
+import time
+import twunnel3.compat
 import twunnel3.local_proxy_server
 import twunnel3.logger
+import twunnel3.multiplexer
 import twunnel3.proxy_server
 import twunnel3.proxy_server__socks5
 
+class SSLSessionCache(object):
+    def __init__(self, maximum_number_of_ssl_objects=64):
+        twunnel3.logger.trace("SSLSessionCache.__init__")
+        
+        self.ssl_session = None
+        self.ssl_objects = []
+        self.maximum_number_of_ssl_objects = maximum_number_of_ssl_objects
+        self.number_of_hits = 0
+        self.number_of_misses = 0
+    
+    def get_ssl_session(self):
+        twunnel3.logger.trace("SSLSessionCache.get_ssl_session")
+        
+        self.update()
+        
+        if self.ssl_session is not None:
+            if self.ssl_session.time + self.ssl_session.timeout <= time.time():
+                self.ssl_session = None
+        
+        return self.ssl_session
+    
+    def add_ssl_object(self, ssl_object):
+        twunnel3.logger.trace("SSLSessionCache.add_ssl_object")
+        
+        self.ssl_objects.append([ssl_object, False])
+        
+        if len(self.ssl_objects) > self.maximum_number_of_ssl_objects:
+            self.ssl_objects.pop(0)
+    
+    def update(self):
+        twunnel3.logger.trace("SSLSessionCache.update")
+        
+        ssl_objects = []
+        
+        i = 0
+        while i < len(self.ssl_objects):
+            ssl_object = self.ssl_objects[i][0]
+            
+            if ssl_object.version() is None:
+                ssl_objects.append(self.ssl_objects[i])
+            else:
+                if not self.ssl_objects[i][1]:
+                    self.ssl_objects[i][1] = True
+                    
+                    if ssl_object.session_reused:
+                        self.number_of_hits = self.number_of_hits + 1
+                    else:
+                        self.number_of_misses = self.number_of_misses + 1
+                
+                ssl_session = ssl_object.session
+                
+                if ssl_session is not None and (ssl_session.has_ticket or ssl_object.version() != "TLSv1.3"):
+                    self.ssl_session = ssl_session
+                else:
+                    ssl_objects.append(self.ssl_objects[i])
+            
+            i = i + 1
+        
+        self.ssl_objects = ssl_objects
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("SSLSessionCache.get_statistics")
+        
+        self.update()
+        
+        statistics = {}
+        statistics["NUMBER_OF_HITS"] = self.number_of_hits
+        statistics["NUMBER_OF_MISSES"] = self.number_of_misses
+        
+        return statistics
+
+class SSLContext(_ssl.SSLContext):
+    def __init__(self, *args, **kwargs):
+        twunnel3.logger.trace("SSLContext.__init__")
+        
+        self.ssl_session_cache = None
+        if hasattr(_ssl, "SSLSession"):
+            self.ssl_session_cache = SSLSessionCache()
+    
+    def wrap_socket(self, *args, **kwargs):
+        twunnel3.logger.trace("SSLContext.wrap_socket")
+        
+        if self.ssl_session_cache is None or kwargs.get("server_side", False):
+            return _ssl.SSLContext.wrap_socket(self, *args, **kwargs)
+        
+        if kwargs.get("session", None) is None:
+            kwargs["session"] = self.ssl_session_cache.get_ssl_session()
+        
+        ssl_socket = _ssl.SSLContext.wrap_socket(self, *args, **kwargs)
+        
+        self.ssl_session_cache.add_ssl_object(ssl_socket)
+        
+        return ssl_socket
+    
+    def wrap_bio(self, *args, **kwargs):
+        twunnel3.logger.trace("SSLContext.wrap_bio")
+        
+        if self.ssl_session_cache is None or kwargs.get("server_side", False):
+            return _ssl.SSLContext.wrap_bio(self, *args, **kwargs)
+        
+        if kwargs.get("session", None) is None:
+            kwargs["session"] = self.ssl_session_cache.get_ssl_session()
+        
+        ssl_object = _ssl.SSLContext.wrap_bio(self, *args, **kwargs)
+        
+        self.ssl_session_cache.add_ssl_object(ssl_object)
+        
+        return ssl_object
+
 class SSLOutputProtocolConnection(object):
     def __init__(self, configuration):
         twunnel3.logger.trace("SSLOutputProtocolConnection.__init__")
         
         self.configuration = configuration
+        self.tunnel = twunnel3.proxy_server.create_tunnel(self.configuration)
+        
+        self.ssl = SSLContext(_ssl.PROTOCOL_SSLv23)
+        self.ssl.options |= _ssl.OP_NO_SSLv2
+        self.ssl.set_default_verify_paths()
+        self.ssl.verify_mode = _ssl.CERT_REQUIRED
+        if self.configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["AUTHORITY"]["FILE"] != "":
+            self.ssl.load_verify_locations(cafile=self.configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["AUTHORITY"]["FILE"])
+        
+        self.ssl_address = self.configuration["REMOTE_PROXY_SERVER"]["ADDRESS"]
+        if self.configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["ADDRESS"] != "":
+            self.ssl_address = self.configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["ADDRESS"]
+        
+        self.multiplexers = []
+        
+        self.tunnel_output_protocol_configuration = {}
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"] = {}
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"]["TYPE"] = "SOCKS5"
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"]["ADDRESS"] = self.configuration["REMOTE_PROXY_SERVER"]["ADDRESS"]
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"]["PORT"] = self.configuration["REMOTE_PROXY_SERVER"]["PORT"]
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"]["ACCOUNT"] = {}
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"] = self.configuration["REMOTE_PROXY_SERVER"]["ACCOUNT"]["NAME"]
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"]["ACCOUNT"]["PASSWORD"] = self.configuration["REMOTE_PROXY_SERVER"]["ACCOUNT"]["PASSWORD"]
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"]["PIPELINE"] = self.configuration["REMOTE_PROXY_SERVER"]["PIPELINE"]
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"]["TIMEOUT"] = {}
+        self.tunnel_output_protocol_configuration["PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"] = self.configuration["REMOTE_PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"]
+        self.tunnel_output_protocol_plan = twunnel3.proxy_server__socks5.SOCKS5TunnelOutputProtocolPlan(self.tunnel_output_protocol_configuration, None, None)
     
-    def connect(self, remote_address, remote_port, input_protocol):
+    def connect(self, remote_address, remote_port, input_protocol, balancer_backend=None):
         twunnel3.logger.trace("SSLOutputProtocolConnection.connect")
         
-        configuration = {}
-        configuration["PROXY_SERVER"] = {}
-        configuration["PROXY_SERVER"]["TYPE"] = "SOCKS5"
-        configuration["PROXY_SERVER"]["ADDRESS"] = self.configuration["REMOTE_PROXY_SERVER"]["ADDRESS"]
-        configuration["PROXY_SERVER"]["PORT"] = self.configuration["REMOTE_PROXY_SERVER"]["PORT"]
-        configuration["PROXY_SERVER"]["ACCOUNT"] = {}
-        configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"] = self.configuration["REMOTE_PROXY_SERVER"]["ACCOUNT"]["NAME"]
-        configuration["PROXY_SERVER"]["ACCOUNT"]["PASSWORD"] = self.configuration["REMOTE_PROXY_SERVER"]["ACCOUNT"]["PASSWORD"]
+        output_protocol_factory = twunnel3.local_proxy_server.OutputProtocolFactory(input_protocol, balancer_backend)
         
-        output_protocol_factory = twunnel3.local_proxy_server.OutputProtocolFactory(input_protocol)
-        
-        tunnel_output_protocol_factory = twunnel3.proxy_server__socks5.SOCKS5TunnelOutputProtocolFactory(configuration, remote_address, remote_port)
+        tunnel_output_protocol_factory = twunnel3.proxy_server__socks5.SOCKS5TunnelOutputProtocolFactory(self.tunnel_output_protocol_configuration, remote_address, remote_port, self.tunnel_output_protocol_plan)
         tunnel_protocol_factory = twunnel3.proxy_server.TunnelProtocolFactory(tunnel_output_protocol_factory, output_protocol_factory, None, None)
+        tunnel_protocol_factory.tunnel_timing = twunnel3.proxy_server.TunnelTiming(1)
         
-        ssl = _ssl.SSLContext(_ssl.PROTOCOL_SSLv23)
-        ssl.options |= _ssl.OP_NO_SSLv2
-        ssl.set_default_verify_paths()
-        ssl.verify_mode = _ssl.CERT_REQUIRED
-        if self.configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["AUTHORITY"]["FILE"] != "":
-            ssl.load_verify_locations(cafile=self.configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["AUTHORITY"]["FILE"])
+        if self.configuration["REMOTE_PROXY_SERVER"]["MULTIPLEXER"]["NUMBER_OF_CONNECTIONS"] > 0:
+            multiplexer = self.get_multiplexer()
+            multiplexer.create_stream(tunnel_protocol_factory)
+        else:
+            future = twunnel3.compat.ensure_future(self.tunnel.create_connection(tunnel_protocol_factory, address=self.configuration["REMOTE_PROXY_SERVER"]["ADDRESS"], port=self.configuration["REMOTE_PROXY_SERVER"]["PORT"], ssl=self.ssl, ssl_address=self.ssl_address))
+            future.add_done_callback(output_protocol_factory.connection_done)
+    
+    def get_multiplexer(self):
+        twunnel3.logger.trace("SSLOutputProtocolConnection.get_multiplexer")
         
-        ssl_address = self.configuration["REMOTE_PROXY_SERVER"]["ADDRESS"]
-        if self.configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["ADDRESS"] != "":
-            ssl_address = self.configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["ADDRESS"]
+        i = 0
+        while i < len(self.multiplexers):
+            if self.multiplexers[i].connection_state == 2:
+                del self.multiplexers[i]
+            else:
+                i = i + 1
+        
+        if len(self.multiplexers) < self.configuration["REMOTE_PROXY_SERVER"]["MULTIPLEXER"]["NUMBER_OF_CONNECTIONS"]:
+            multiplexer = twunnel3.multiplexer.MultiplexerProtocol(self.configuration["REMOTE_PROXY_SERVER"], None)
+            
+            self.multiplexers.append(multiplexer)
+            
+            future = twunnel3.compat.ensure_future(self.tunnel.create_connection(lambda: multiplexer, address=self.configuration["REMOTE_PROXY_SERVER"]["ADDRESS"], port=self.configuration["REMOTE_PROXY_SERVER"]["PORT"], ssl=self.ssl, ssl_address=self.ssl_address))
+            future.add_done_callback(lambda future: self.multiplexer__connection_made(multiplexer, future))
+            
+            return multiplexer
+        
+        multiplexer = self.multiplexers[0]
+        
+        i = 1
+        while i < len(self.multiplexers):
+            if len(self.multiplexers[i].streams) < len(multiplexer.streams):
+                multiplexer = self.multiplexers[i]
+            
+            i = i + 1
+        
+        return multiplexer
+    
+    def multiplexer__connection_made(self, multiplexer, future):
+        twunnel3.logger.trace("SSLOutputProtocolConnection.multiplexer__connection_made")
+        
+        if future.cancelled() or future.exception() is not None:
+            if multiplexer.connection_state == 0:
+                multiplexer.connection_lost(None)
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("SSLOutputProtocolConnection.get_statistics")
+        
+        statistics = {}
+        if self.ssl.ssl_session_cache is not None:
+            statistics["SSL_SESSION_CACHE"] = self.ssl.ssl_session_cache.get_statistics()
         
-        tunnel = twunnel3.proxy_server.create_tunnel(self.configuration)
-        asyncio.async(tunnel.create_connection(tunnel_protocol_factory, address=self.configuration["REMOTE_PROXY_SERVER"]["ADDRESS"], port=self.configuration["REMOTE_PROXY_SERVER"]["PORT"], ssl=ssl, ssl_address=ssl_address))
\ No newline at end of file
+        return statistics
\ No newline at end of file
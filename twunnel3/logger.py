@@ -1,6 +1,10 @@
 # Copyright (c) Jeroen Van Steirteghem
 # See LICENSE
 
+import atexit
+import collections
+import sys
+import threading
 import time
 import datetime
 
@@ -13,6 +17,26 @@ class LoggerMessage(object):
 class Logger(object):
     def __init__(self, configuration):
         self.configuration = configuration
+        self.file = None
+        self.messages = None
+        self.number_of_messages = 0
+        self.number_of_dropped_messages = 0
+        self.thread = None
+        self.thread_event = None
+        self.thread_state = 0
+        
+        if self.configuration["LOGGER"]["FILE"] != "":
+            self.file = open(self.configuration["LOGGER"]["FILE"], "a")
+        
+        if self.configuration["LOGGER"]["BUFFER"]["SIZE"] > 0:
+            self.messages = collections.deque(maxlen=self.configuration["LOGGER"]["BUFFER"]["SIZE"])
+            
+            self.thread_event = threading.Event()
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+            
+            atexit.register(self.close)
     
     def log(self, message_level, message_text, *message_text_arguments):
         if message_level <= self.configuration["LOGGER"]["LEVEL"]:
@@ -24,7 +48,72 @@ class Logger(object):
             self.print_message(message)
     
     def print_message(self, message):
-        print(self.format_message(message))
+        if self.messages is None:
+            self.write_messages([message])
+        else:
+            if len(self.messages) == self.messages.maxlen:
+                self.number_of_dropped_messages = self.number_of_dropped_messages + 1
+            
+            self.messages.append(message)
+            self.number_of_messages = self.number_of_messages + 1
+            
+            if len(self.messages) * 2 >= self.messages.maxlen:
+                self.thread_event.set()
+    
+    def write_messages(self, messages):
+        text = "".join([self.format_message(message) + "\n" for message in messages])
+        
+        file = self.file
+        if file is None:
+            file = sys.stdout
+        
+        file.write(text)
+        file.flush()
+    
+    def run(self):
+        number_of_dropped_messages = 0
+        
+        while self.thread_state == 0:
+            self.thread_event.wait(self.configuration["LOGGER"]["BUFFER"]["INTERVAL"])
+            self.thread_event.clear()
+            
+            messages = []
+            while True:
+                try:
+                    messages.append(self.messages.popleft())
+                except IndexError:
+                    break
+            
+            if self.number_of_dropped_messages != number_of_dropped_messages:
+                message = LoggerMessage()
+                message.time = int(round(time.time() * 1000))
+                message.level = 2
+                message.text = "logger: dropped " + str(self.number_of_dropped_messages - number_of_dropped_messages) + " messages"
+                
+                messages.append(message)
+                
+                number_of_dropped_messages = self.number_of_dropped_messages
+            
+            if len(messages) > 0:
+                self.write_messages(messages)
+    
+    def close(self):
+        if self.thread is not None:
+            self.thread_state = 1
+            self.thread_event.set()
+            self.thread.join()
+            self.thread = None
+        
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    def get_statistics(self):
+        statistics = {}
+        statistics["NUMBER_OF_MESSAGES"] = self.number_of_messages
+        statistics["NUMBER_OF_DROPPED_MESSAGES"] = self.number_of_dropped_messages
+        
+        return statistics
     
     def format_message(self, message):
         return "{0} - {1} - {2}".format(self.format_message_time(message.time), self.format_message_level(message.level), self.format_message_text(message.text))
@@ -52,6 +141,15 @@ class Logger(object):
 default_logger = None
 default_logger_class = Logger
 
+def get_default_logger():
+    global default_logger
+    
+    if default_logger is None:
+        configuration = {}
+        configure(configuration)
+    
+    return default_logger
+
 def get_default_logger_class():
     global default_logger_class
     
@@ -66,13 +164,42 @@ def set_default_configuration(configuration, keys):
     if "LOGGER" in keys:
         configuration.setdefault("LOGGER", {})
         configuration["LOGGER"].setdefault("LEVEL", 0)
+        configuration["LOGGER"].setdefault("FILE", "")
+        configuration["LOGGER"].setdefault("BUFFER", {})
+        configuration["LOGGER"]["BUFFER"].setdefault("SIZE", 0)
+        configuration["LOGGER"]["BUFFER"].setdefault("INTERVAL", 1)
 
 def configure(configuration):
-    global default_logger, default_logger_class
+    global default_logger, default_logger_class, error, warning, info, debug, trace
     
     set_default_configuration(configuration, ["LOGGER"])
     
+    if default_logger is not None:
+        default_logger.close()
+    
     default_logger = default_logger_class(configuration)
+    
+    error = create_log_function(1)
+    warning = create_log_function(2)
+    info = create_log_function(3)
+    debug = create_log_function(4)
+    trace = create_log_function(5)
+
+def create_log_function(message_level):
+    global default_logger
+    
+    if message_level > default_logger.configuration["LOGGER"]["LEVEL"]:
+        return log_none
+    
+    logger = default_logger
+    
+    def log_function(message_text, *message_text_arguments):
+        logger.log(message_level, message_text, *message_text_arguments)
+    
+    return log_function
+
+def log_none(message_text, *message_text_arguments):
+    pass
 
 def log(message_level, message_text, *message_text_arguments):
     global default_logger
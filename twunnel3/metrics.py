@@ -0,0 +1,261 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import bisect
+import twunnel3.compat
+import twunnel3.logger
+
+HISTOGRAM_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+def set_default_configuration(configuration, keys):
+    if "METRICS" in keys:
+        configuration.setdefault("METRICS", {})
+        configuration["METRICS"].setdefault("ADDRESS", "127.0.0.1")
+        configuration["METRICS"].setdefault("PORT", 0)
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    
+    return repr(float(value))
+
+def format_labels(label_name, label_value, labels=""):
+    if label_name != "":
+        if labels != "":
+            labels = labels + ","
+        
+        labels = labels + label_name + "=\"" + label_value + "\""
+    
+    if labels == "":
+        return ""
+    
+    return "{" + labels + "}"
+
+class Counter(object):
+    __slots__ = ("name", "help", "label_name", "label_values", "label_indexes", "values")
+    
+    type = "counter"
+    
+    def __init__(self, name, help, label_name="", label_values=("",)):
+        twunnel3.logger.trace("Counter.__init__")
+        
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.label_values = label_values
+        self.label_indexes = {}
+        self.values = [0] * len(label_values)
+        
+        i = 0
+        while i < len(self.label_values):
+            self.label_indexes[self.label_values[i]] = i
+            
+            i = i + 1
+    
+    def increase(self, value=1, label_value=""):
+        twunnel3.logger.trace("Counter.increase")
+        
+        i = self.label_indexes[label_value]
+        
+        self.values[i] = self.values[i] + value
+    
+    def export(self, lines):
+        twunnel3.logger.trace("Counter.export")
+        
+        lines.append("# HELP " + self.name + " " + self.help)
+        lines.append("# TYPE " + self.name + " " + self.type)
+        
+        i = 0
+        while i < len(self.label_values):
+            lines.append(self.name + format_labels(self.label_name, self.label_values[i]) + " " + format_value(self.values[i]))
+            
+            i = i + 1
+
+class Gauge(Counter):
+    __slots__ = ()
+    
+    type = "gauge"
+    
+    def decrease(self, value=1, label_value=""):
+        twunnel3.logger.trace("Gauge.decrease")
+        
+        i = self.label_indexes[label_value]
+        
+        self.values[i] = self.values[i] - value
+    
+    def set(self, value, label_value=""):
+        twunnel3.logger.trace("Gauge.set")
+        
+        self.values[self.label_indexes[label_value]] = value
+
+class Histogram(object):
+    __slots__ = ("name", "help", "label_name", "label_values", "label_indexes", "buckets", "counts", "sums")
+    
+    type = "histogram"
+    
+    def __init__(self, name, help, label_name="", label_values=("",), buckets=HISTOGRAM_BUCKETS):
+        twunnel3.logger.trace("Histogram.__init__")
+        
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.label_values = label_values
+        self.label_indexes = {}
+        self.buckets = buckets
+        self.counts = []
+        self.sums = [0.0] * len(label_values)
+        
+        i = 0
+        while i < len(self.label_values):
+            self.label_indexes[self.label_values[i]] = i
+            self.counts.append([0] * (len(self.buckets) + 1))
+            
+            i = i + 1
+    
+    def observe(self, value, label_value=""):
+        twunnel3.logger.trace("Histogram.observe")
+        
+        i = self.label_indexes[label_value]
+        j = bisect.bisect_left(self.buckets, value)
+        
+        self.counts[i][j] = self.counts[i][j] + 1
+        self.sums[i] = self.sums[i] + value
+    
+    def export(self, lines):
+        twunnel3.logger.trace("Histogram.export")
+        
+        lines.append("# HELP " + self.name + " " + self.help)
+        lines.append("# TYPE " + self.name + " " + self.type)
+        
+        i = 0
+        while i < len(self.label_values):
+            count = 0
+            
+            j = 0
+            while j < len(self.buckets):
+                count = count + self.counts[i][j]
+                
+                lines.append(self.name + "_bucket" + format_labels(self.label_name, self.label_values[i], "le=\"" + format_value(self.buckets[j]) + "\"") + " " + str(count))
+                
+                j = j + 1
+            
+            count = count + self.counts[i][j]
+            
+            lines.append(self.name + "_bucket" + format_labels(self.label_name, self.label_values[i], "le=\"+Inf\"") + " " + str(count))
+            lines.append(self.name + "_sum" + format_labels(self.label_name, self.label_values[i]) + " " + format_value(self.sums[i]))
+            lines.append(self.name + "_count" + format_labels(self.label_name, self.label_values[i]) + " " + str(count))
+            
+            i = i + 1
+
+class Registry(object):
+    def __init__(self):
+        twunnel3.logger.trace("Registry.__init__")
+        
+        self.metrics = []
+    
+    def add_metric(self, metric):
+        twunnel3.logger.trace("Registry.add_metric")
+        
+        self.metrics.append(metric)
+        
+        return metric
+    
+    def create_counter(self, name, help, label_name="", label_values=("",)):
+        twunnel3.logger.trace("Registry.create_counter")
+        
+        return self.add_metric(Counter(name, help, label_name, label_values))
+    
+    def create_gauge(self, name, help, label_name="", label_values=("",)):
+        twunnel3.logger.trace("Registry.create_gauge")
+        
+        return self.add_metric(Gauge(name, help, label_name, label_values))
+    
+    def create_histogram(self, name, help, label_name="", label_values=("",), buckets=HISTOGRAM_BUCKETS):
+        twunnel3.logger.trace("Registry.create_histogram")
+        
+        return self.add_metric(Histogram(name, help, label_name, label_values, buckets))
+    
+    def export(self):
+        twunnel3.logger.trace("Registry.export")
+        
+        lines = []
+        
+        for metric in self.metrics:
+            metric.export(lines)
+        
+        return "\n".join(lines) + "\n"
+
+registry = None
+
+def get_registry():
+    global registry
+    
+    if registry is None:
+        registry = Registry()
+    
+    return registry
+
+relayed_bytes_metric = get_registry().create_counter("twunnel3_relayed_bytes_total", "Number of relayed bytes.", "direction", ("upstream", "downstream"))
+
+class MetricsProtocol(asyncio.Protocol):
+    def __init__(self):
+        twunnel3.logger.trace("MetricsProtocol.__init__")
+        
+        self.data = bytearray()
+        self.transport = None
+    
+    def connection_made(self, transport):
+        twunnel3.logger.trace("MetricsProtocol.connection_made")
+        
+        self.transport = transport
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.trace("MetricsProtocol.connection_lost")
+        
+        self.transport = None
+    
+    def data_received(self, data):
+        twunnel3.logger.trace("MetricsProtocol.data_received")
+        
+        self.data += data
+        
+        i = self.data.find(b"\r\n\r\n", max(len(self.data) - len(data) - 3, 0))
+        
+        if i == -1:
+            if len(self.data) > 65536:
+                self.transport.close()
+            
+            return
+        
+        request_line = bytes(self.data[:self.data.find(b"\r\n")]).split(None, 2)
+        
+        if len(request_line) < 2 or request_line[0].upper() != b"GET":
+            response = b"HTTP/1.1 405 Method Not Allowed\r\n"
+            response = response + b"Allow: GET\r\n"
+            response = response + b"Content-Length: 0\r\n"
+            response = response + b"Connection: close\r\n"
+            response = response + b"\r\n"
+        else:
+            if request_line[1].split(b"?", 1)[0] != b"/metrics":
+                response = b"HTTP/1.1 404 Not Found\r\n"
+                response = response + b"Content-Length: 0\r\n"
+                response = response + b"Connection: close\r\n"
+                response = response + b"\r\n"
+            else:
+                body = get_registry().export().encode()
+                
+                response = b"HTTP/1.1 200 OK\r\n"
+                response = response + b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                response = response + b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                response = response + b"Connection: close\r\n"
+                response = response + b"\r\n"
+                response = response + body
+        
+        self.transport.write(response)
+        self.transport.close()
+
+def create_server(configuration):
+    set_default_configuration(configuration, ["METRICS"])
+    
+    return twunnel3.compat.ensure_future(asyncio.get_event_loop().create_server(MetricsProtocol, host=configuration["METRICS"]["ADDRESS"], port=configuration["METRICS"]["PORT"]))
\ No newline at end of file
@@ -0,0 +1,481 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import collections
+import struct
+import twunnel3.logger
+import twunnel3.parser
+
+FRAME_TYPE_OPEN = 0x01
+FRAME_TYPE_DATA = 0x02
+FRAME_TYPE_CLOSE = 0x03
+FRAME_TYPE_WINDOW = 0x04
+
+FRAME_HEADER_FORMAT = "!BIH"
+FRAME_HEADER_LENGTH = struct.calcsize(FRAME_HEADER_FORMAT)
+
+MAXIMUM_FRAME_SIZE = 65535
+
+INITIAL_WINDOW_SIZE = 65536
+
+def set_default_configuration(configuration, keys):
+    if "MULTIPLEXER" in keys:
+        configuration.setdefault("MULTIPLEXER", {})
+        configuration["MULTIPLEXER"].setdefault("NUMBER_OF_CONNECTIONS", 0)
+        configuration["MULTIPLEXER"].setdefault("WINDOW_SIZE", 262144)
+        configuration["MULTIPLEXER"].setdefault("FRAME_SIZE", 16384)
+        
+        frame_size = min(max(configuration["MULTIPLEXER"]["FRAME_SIZE"], 1), MAXIMUM_FRAME_SIZE)
+        
+        if frame_size != configuration["MULTIPLEXER"]["FRAME_SIZE"]:
+            twunnel3.logger.warning("multiplexer: FRAME_SIZE " + str(configuration["MULTIPLEXER"]["FRAME_SIZE"]) + " is out of range, using " + str(frame_size))
+            
+            configuration["MULTIPLEXER"]["FRAME_SIZE"] = frame_size
+
+class MultiplexerStream(asyncio.Transport):
+    __slots__ = ("multiplexer", "stream_id", "protocol", "stream_state", "input_data", "input_data_closed", "input_window", "input_window_length", "output_data", "output_data_queued", "output_window", "reading", "writing", "high_water_mark", "low_water_mark")
+    
+    def __init__(self, multiplexer, stream_id):
+        twunnel3.logger.trace("MultiplexerStream.__init__")
+        
+        asyncio.Transport.__init__(self)
+        
+        self.multiplexer = multiplexer
+        self.stream_id = stream_id
+        self.protocol = None
+        self.stream_state = 0
+        self.input_data = bytearray()
+        self.input_data_closed = False
+        self.input_window = INITIAL_WINDOW_SIZE
+        self.input_window_length = 0
+        self.output_data = bytearray()
+        self.output_data_queued = False
+        self.output_window = INITIAL_WINDOW_SIZE
+        self.reading = True
+        self.writing = True
+        self.high_water_mark = 65536
+        self.low_water_mark = 16384
+    
+    def get_extra_info(self, name, default=None):
+        twunnel3.logger.trace("MultiplexerStream.get_extra_info")
+        
+        if name == "socket":
+            return default
+        
+        if self.multiplexer.transport is None:
+            return default
+        
+        return self.multiplexer.transport.get_extra_info(name, default)
+    
+    def is_closing(self):
+        twunnel3.logger.trace("MultiplexerStream.is_closing")
+        
+        return self.stream_state != 0
+    
+    def close(self):
+        twunnel3.logger.trace("MultiplexerStream.close")
+        
+        if self.stream_state == 0:
+            self.stream_state = 1
+            
+            self.flush()
+    
+    def abort(self):
+        twunnel3.logger.trace("MultiplexerStream.abort")
+        
+        if self.stream_state < 2:
+            self.output_data = bytearray()
+            self.stream_state = 1
+            
+            self.flush()
+    
+    def pause_reading(self):
+        twunnel3.logger.trace("MultiplexerStream.pause_reading")
+        
+        self.reading = False
+    
+    def resume_reading(self):
+        twunnel3.logger.trace("MultiplexerStream.resume_reading")
+        
+        if not self.reading:
+            self.reading = True
+            
+            if len(self.input_data) > 0 or self.input_data_closed:
+                asyncio.get_event_loop().call_soon(self.read)
+    
+    def is_reading(self):
+        twunnel3.logger.trace("MultiplexerStream.is_reading")
+        
+        return self.reading
+    
+    def write(self, data):
+        twunnel3.logger.trace("MultiplexerStream.write")
+        
+        if self.stream_state != 0 or len(data) == 0:
+            return
+        
+        self.output_data += data
+        
+        self.multiplexer.stream__data_written(self)
+        
+        if self.writing and len(self.output_data) > self.high_water_mark:
+            self.writing = False
+            
+            self.protocol.pause_writing()
+    
+    def can_write_eof(self):
+        twunnel3.logger.trace("MultiplexerStream.can_write_eof")
+        
+        return False
+    
+    def get_write_buffer_size(self):
+        twunnel3.logger.trace("MultiplexerStream.get_write_buffer_size")
+        
+        return len(self.output_data)
+    
+    def get_write_buffer_limits(self):
+        twunnel3.logger.trace("MultiplexerStream.get_write_buffer_limits")
+        
+        return (self.low_water_mark, self.high_water_mark)
+    
+    def set_write_buffer_limits(self, high=None, low=None):
+        twunnel3.logger.trace("MultiplexerStream.set_write_buffer_limits")
+        
+        if high is None:
+            if low is None:
+                high = 65536
+            else:
+                high = 4 * low
+        if low is None:
+            low = high // 4
+        
+        self.high_water_mark = high
+        self.low_water_mark = low
+    
+    def read(self):
+        twunnel3.logger.trace("MultiplexerStream.read")
+        
+        if self.stream_state == 2 or not self.reading:
+            return
+        
+        if len(self.input_data) > 0:
+            data = bytes(self.input_data)
+            self.input_data = bytearray()
+            
+            self.protocol.data_received(data)
+            
+            self.multiplexer.stream__data_read(self, len(data))
+        
+        if self.input_data_closed and len(self.input_data) == 0:
+            self.multiplexer.stream__connection_lost(self, None)
+    
+    def flush(self):
+        twunnel3.logger.trace("MultiplexerStream.flush")
+        
+        if self.stream_state == 2:
+            return
+        
+        if not self.writing and len(self.output_data) <= self.low_water_mark:
+            self.writing = True
+            
+            self.protocol.resume_writing()
+        
+        if len(self.output_data) == 0:
+            if self.stream_state == 1:
+                self.multiplexer.stream__connection_closed(self)
+        else:
+            if self.output_window > 0:
+                self.multiplexer.stream__data_written(self)
+    
+    def data_received(self, data):
+        twunnel3.logger.trace("MultiplexerStream.data_received")
+        
+        if self.stream_state != 0:
+            return
+        
+        if self.reading and len(self.input_data) == 0:
+            self.protocol.data_received(data)
+            
+            self.multiplexer.stream__data_read(self, len(data))
+        else:
+            self.input_data += data
+    
+    def data_closed(self):
+        twunnel3.logger.trace("MultiplexerStream.data_closed")
+        
+        self.input_data_closed = True
+        
+        if self.reading and len(self.input_data) == 0:
+            self.multiplexer.stream__connection_lost(self, None)
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.trace("MultiplexerStream.connection_lost")
+        
+        if self.stream_state != 2:
+            self.stream_state = 2
+            self.input_data = bytearray()
+            self.output_data = bytearray()
+            
+            asyncio.get_event_loop().call_soon(self.protocol.connection_lost, exception)
+
+class MultiplexerProtocol(asyncio.Protocol):
+    __slots__ = ("configuration", "protocol_factory", "connection_state", "data", "frames", "streams", "stream_id", "output_streams", "flush_handle", "writing", "transport")
+    
+    def __init__(self, configuration, protocol_factory):
+        twunnel3.logger.trace("MultiplexerProtocol.__init__")
+        
+        self.configuration = configuration
+        self.protocol_factory = protocol_factory
+        self.connection_state = 0
+        self.data = twunnel3.parser.Parser(1048576)
+        self.frames = []
+        self.streams = {}
+        self.stream_id = 0
+        self.output_streams = collections.deque()
+        self.flush_handle = None
+        self.writing = True
+        self.transport = None
+    
+    def connection_made(self, transport):
+        twunnel3.logger.trace("MultiplexerProtocol.connection_made")
+        
+        self.transport = transport
+        
+        if self.connection_state == 0:
+            self.connection_state = 1
+            
+            if len(self.frames) > 0:
+                self.transport.write(b"".join(self.frames))
+                
+                self.frames = []
+            
+            self.flush()
+        else:
+            self.transport.close()
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.trace("MultiplexerProtocol.connection_lost")
+        
+        self.connection_state = 2
+        self.frames = []
+        self.output_streams.clear()
+        
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        
+        streams = list(self.streams.values())
+        self.streams = {}
+        
+        for stream in streams:
+            stream.connection_lost(exception)
+        
+        self.transport = None
+    
+    def data_received(self, data):
+        twunnel3.logger.trace("MultiplexerProtocol.data_received")
+        
+        if not self.data.write(data):
+            self.transport.close()
+            
+            return
+        
+        data = self.data
+        
+        while len(data) >= FRAME_HEADER_LENGTH:
+            frame_type, stream_id, frame_length = data.unpack(FRAME_HEADER_FORMAT)
+            
+            if len(data) < frame_length:
+                data.rollback()
+                
+                break
+            
+            frame_data = data.read(frame_length)
+            
+            data.commit()
+            
+            if not self.process_frame(frame_type, stream_id, frame_data):
+                self.transport.close()
+                
+                return
+    
+    def process_frame(self, frame_type, stream_id, frame_data):
+        twunnel3.logger.trace("MultiplexerProtocol.process_frame")
+        
+        if frame_type == FRAME_TYPE_OPEN:
+            if self.protocol_factory is None or stream_id in self.streams or stream_id <= self.stream_id:
+                return False
+            
+            self.stream_id = stream_id
+            
+            stream = MultiplexerStream(self, stream_id)
+            stream.set_write_buffer_limits(self.configuration["MULTIPLEXER"]["WINDOW_SIZE"])
+            stream.protocol = self.protocol_factory()
+            
+            self.streams[stream_id] = stream
+            
+            self.open_window(stream)
+            
+            stream.protocol.connection_made(stream)
+            
+            return True
+        
+        stream = self.streams.get(stream_id)
+        
+        if frame_type == FRAME_TYPE_DATA:
+            if stream is not None:
+                stream.input_window = stream.input_window - len(frame_data)
+                
+                if stream.input_window < 0:
+                    return False
+                
+                stream.data_received(frame_data)
+            
+            return True
+        else:
+            if frame_type == FRAME_TYPE_CLOSE:
+                if stream is not None:
+                    stream.data_closed()
+                
+                return True
+            else:
+                if frame_type == FRAME_TYPE_WINDOW:
+                    if stream is not None:
+                        window_length, = struct.unpack("!I", frame_data)
+                        
+                        stream.output_window = stream.output_window + window_length
+                        stream.flush()
+                    
+                    return True
+                else:
+                    return False
+    
+    def pause_writing(self):
+        twunnel3.logger.trace("MultiplexerProtocol.pause_writing")
+        
+        self.writing = False
+    
+    def resume_writing(self):
+        twunnel3.logger.trace("MultiplexerProtocol.resume_writing")
+        
+        self.writing = True
+        
+        self.flush()
+    
+    def create_stream(self, protocol_factory):
+        twunnel3.logger.trace("MultiplexerProtocol.create_stream")
+        
+        self.stream_id = self.stream_id + 1
+        
+        stream = MultiplexerStream(self, self.stream_id)
+        stream.set_write_buffer_limits(self.configuration["MULTIPLEXER"]["WINDOW_SIZE"])
+        stream.protocol = protocol_factory()
+        
+        if self.connection_state == 2:
+            stream.protocol.connection_made(stream)
+            stream.connection_lost(None)
+            
+            return stream
+        
+        self.streams[stream.stream_id] = stream
+        
+        self.write_frame(FRAME_TYPE_OPEN, stream.stream_id, b"")
+        
+        self.open_window(stream)
+        
+        stream.protocol.connection_made(stream)
+        
+        return stream
+    
+    def open_window(self, stream):
+        twunnel3.logger.trace("MultiplexerProtocol.open_window")
+        
+        if self.configuration["MULTIPLEXER"]["WINDOW_SIZE"] > INITIAL_WINDOW_SIZE:
+            window_length = self.configuration["MULTIPLEXER"]["WINDOW_SIZE"] - INITIAL_WINDOW_SIZE
+            
+            stream.input_window = stream.input_window + window_length
+            
+            self.write_frame(FRAME_TYPE_WINDOW, stream.stream_id, struct.pack("!I", window_length))
+    
+    def write_frame(self, frame_type, stream_id, frame_data):
+        twunnel3.logger.trace("MultiplexerProtocol.write_frame")
+        
+        frame = struct.pack(FRAME_HEADER_FORMAT, frame_type, stream_id, len(frame_data)) + frame_data
+        
+        if self.connection_state == 0:
+            self.frames.append(frame)
+        else:
+            if self.connection_state == 1:
+                self.transport.write(frame)
+    
+    def flush(self):
+        twunnel3.logger.trace("MultiplexerProtocol.flush")
+        
+        self.flush_handle = None
+        
+        if self.connection_state != 1:
+            return
+        
+        frame_size = self.configuration["MULTIPLEXER"]["FRAME_SIZE"]
+        
+        while len(self.output_streams) > 0 and self.writing:
+            stream = self.output_streams.popleft()
+            stream.output_data_queued = False
+            
+            if stream.stream_state == 2:
+                continue
+            
+            frame_length = min(len(stream.output_data), stream.output_window, frame_size)
+            
+            if frame_length > 0:
+                frame_data = bytes(stream.output_data[:frame_length])
+                del stream.output_data[:frame_length]
+                
+                stream.output_window = stream.output_window - frame_length
+                
+                self.write_frame(FRAME_TYPE_DATA, stream.stream_id, frame_data)
+            
+            stream.flush()
+    
+    def stream__data_written(self, stream):
+        twunnel3.logger.trace("MultiplexerProtocol.stream__data_written")
+        
+        if not stream.output_data_queued and stream.output_window > 0:
+            stream.output_data_queued = True
+            
+            self.output_streams.append(stream)
+            
+            if self.flush_handle is None and self.connection_state == 1:
+                self.flush_handle = asyncio.get_event_loop().call_soon(self.flush)
+    
+    def stream__data_read(self, stream, length):
+        twunnel3.logger.trace("MultiplexerProtocol.stream__data_read")
+        
+        if stream.stream_state == 2:
+            return
+        
+        stream.input_window_length = stream.input_window_length + length
+        
+        if stream.input_window_length >= self.configuration["MULTIPLEXER"]["WINDOW_SIZE"] // 2:
+            stream.input_window = stream.input_window + stream.input_window_length
+            
+            self.write_frame(FRAME_TYPE_WINDOW, stream.stream_id, struct.pack("!I", stream.input_window_length))
+            
+            stream.input_window_length = 0
+    
+    def stream__connection_closed(self, stream):
+        twunnel3.logger.trace("MultiplexerProtocol.stream__connection_closed")
+        
+        if not stream.input_data_closed:
+            self.write_frame(FRAME_TYPE_CLOSE, stream.stream_id, b"")
+        
+        self.stream__connection_lost(stream, None)
+    
+    def stream__connection_lost(self, stream, exception):
+        twunnel3.logger.trace("MultiplexerProtocol.stream__connection_lost")
+        
+        if self.streams.get(stream.stream_id) is stream:
+            del self.streams[stream.stream_id]
+        
+        stream.connection_lost(exception)
\ No newline at end of file
@@ -0,0 +1,99 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import struct
+import twunnel3.logger
+
+class Parser(object):
+    def __init__(self, maximum_length=65536):
+        twunnel3.logger.trace("Parser.__init__")
+        
+        self.data = bytearray()
+        self.data_i = 0
+        self.data_j = -1
+        self.data_k = 0
+        self.maximum_length = maximum_length
+    
+    def __len__(self):
+        return len(self.data) - self.data_i
+    
+    def write(self, data):
+        twunnel3.logger.trace("Parser.write")
+        
+        if self.maximum_length > 0 and len(self.data) + len(data) > self.maximum_length:
+            return False
+        
+        self.data += data
+        self.data_i = 0
+        
+        return True
+    
+    def get_available_length(self):
+        twunnel3.logger.trace("Parser.get_available_length")
+        
+        return self.maximum_length - len(self.data)
+    
+    def read(self, length):
+        twunnel3.logger.trace("Parser.read")
+        
+        i = self.data_i
+        j = self.data_i + length
+        
+        with memoryview(self.data) as data:
+            data = data[i:j].tobytes()
+        
+        self.data_i = j
+        
+        return data
+    
+    def skip(self, length):
+        twunnel3.logger.trace("Parser.skip")
+        
+        self.data_i = self.data_i + length
+    
+    def unpack(self, format):
+        twunnel3.logger.trace("Parser.unpack")
+        
+        values = struct.unpack_from(format, self.data, self.data_i)
+        
+        self.data_i = self.data_i + struct.calcsize(format)
+        
+        return values
+    
+    def find(self, data):
+        twunnel3.logger.trace("Parser.find")
+        
+        i = self.data_i
+        if self.data_j == self.data_i:
+            i = self.data_k - len(data) + 1
+            if i < self.data_i:
+                i = self.data_i
+        
+        i = self.data.find(data, i)
+        
+        if i == -1:
+            self.data_j = self.data_i
+            self.data_k = len(self.data)
+            
+            return -1
+        
+        return i - self.data_i
+    
+    def commit(self):
+        twunnel3.logger.trace("Parser.commit")
+        
+        if self.data_i > 0:
+            del self.data[:self.data_i]
+            
+            self.data_j = self.data_j - self.data_i
+            self.data_k = self.data_k - self.data_i
+            if self.data_j < 0:
+                self.data_j = -1
+                self.data_k = 0
+            
+            self.data_i = 0
+    
+    def rollback(self):
+        twunnel3.logger.trace("Parser.rollback")
+        
+        self.data_i = 0
\ No newline at end of file
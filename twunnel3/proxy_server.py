@@ -2,8 +2,19 @@
 # See LICENSE
 
 import asyncio
+import collections
 import socket
+import time
+import twunnel3.compat
 import twunnel3.logger
+import twunnel3.metrics
+import weakref
+
+hop_connect_duration_metric = twunnel3.metrics.get_registry().create_histogram("twunnel3_hop_connect_duration_seconds", "Time to open a tunnel through a proxy server.", "type", ("HTTPS", "SOCKS4", "SOCKS5"))
+hop_failures_metric = twunnel3.metrics.get_registry().create_counter("twunnel3_hop_failures_total", "Number of failed tunnels through a proxy server.", "type", ("HTTPS", "SOCKS4", "SOCKS5"))
+hop_response_duration_metric = twunnel3.metrics.get_registry().create_histogram("twunnel3_hop_response_duration_seconds", "Time between a request to a proxy server and its reply.", "type", ("HTTPS", "SOCKS4", "SOCKS5"))
+tunnel_tls_handshake_duration_metric = twunnel3.metrics.get_registry().create_histogram("twunnel3_tunnel_tls_handshake_duration_seconds", "Time to complete a TLS handshake through a tunnel.")
+tunnel_first_byte_duration_metric = twunnel3.metrics.get_registry().create_histogram("twunnel3_tunnel_first_byte_duration_seconds", "Time to receive the first byte through an open tunnel.")
 
 def is_ipv4_address(address):
     try:
@@ -44,33 +55,70 @@ def set_default_configuration(configuration, keys):
                         configuration["PROXY_SERVERS"][i].setdefault("ACCOUNT", {})
                         configuration["PROXY_SERVERS"][i]["ACCOUNT"].setdefault("NAME", "")
                         configuration["PROXY_SERVERS"][i]["ACCOUNT"].setdefault("PASSWORD", "")
+                        configuration["PROXY_SERVERS"][i].setdefault("PIPELINE", False)
+            configuration["PROXY_SERVERS"][i].setdefault("TIMEOUT", {})
+            configuration["PROXY_SERVERS"][i]["TIMEOUT"].setdefault("HANDSHAKE", 10)
             i = i + 1
+    
+    if "POOL" in keys:
+        configuration.setdefault("POOL", {})
+        configuration["POOL"].setdefault("SIZE", 0)
+        configuration["POOL"].setdefault("MAXIMUM_IDLE_TIME", 60)
+        configuration["POOL"].setdefault("PROBE_INTERVAL", 10)
+    
+    if "RESOLVER" in keys:
+        configuration.setdefault("RESOLVER", {})
+        configuration["RESOLVER"].setdefault("TTL", 60)
+        configuration["RESOLVER"].setdefault("NEGATIVE_TTL", 5)
+        configuration["RESOLVER"].setdefault("MAXIMUM_NUMBER_OF_ENTRIES", 4096)
+        configuration["RESOLVER"].setdefault("MAXIMUM_NUMBER_OF_QUERIES", 8)
+        configuration["RESOLVER"].setdefault("CONNECTION_ATTEMPT_DELAY", 0.25)
+        configuration["RESOLVER"].setdefault("ADDRESS_FAMILY", "IPV6")
 
 class TunnelProtocol(asyncio.Protocol):
+    __slots__ = ("data", "factory", "connection_time", "transport", "pipeline_state")
+    
     def __init__(self):
         twunnel3.logger.trace("TunnelProtocol.__init__")
         
         self.data = b""
         self.factory = None
+        self.connection_time = 0
         self.transport = None
+        self.pipeline_state = 0
     
     def connection_made(self, transport):
         twunnel3.logger.trace("TunnelProtocol.connection_made")
         
         self.transport = transport
         
+        if self.factory.tunnel_connection is not None:
+            self.factory.tunnel_connection.transport = self.transport
+        
         if self.factory.tunnel_output_protocol is None:
+            self.connection_time = time.time()
+            
+            if self.factory.tunnel_timing is not None:
+                self.factory.tunnel_timing.hop_started(self.factory.tunnel_output_protocol_factory.configuration)
+            
             self.factory.tunnel_output_protocol_factory.tunnel_protocol = self
             self.factory.tunnel_output_protocol = self.factory.tunnel_output_protocol_factory()
             self.factory.tunnel_output_protocol.connection_made(self.transport)
         else:
             if self.factory.output_protocol is None:
+                if self.factory.tunnel_timing is not None:
+                    self.factory.tunnel_timing.hop_completed()
+                
                 self.factory.tunnel_output_protocol = None
+                self.factory.tunnel_output_protocol_factory = None
                 
                 self.factory.output_protocol = self.factory.output_protocol_factory()
                 self.factory.output_protocol.connection_made(self.transport)
                 
                 if len(self.data) > 0:
+                    if self.factory.tunnel_timing is not None:
+                        self.factory.tunnel_timing.data_received()
+                    
                     self.factory.output_protocol.data_received(self.data)
                     
                     self.data = b""
@@ -78,12 +126,25 @@ class TunnelProtocol(asyncio.Protocol):
     def connection_lost(self, exception):
         twunnel3.logger.trace("TunnelProtocol.connection_lost")
         
+        if self.factory.tunnel_connection is not None:
+            self.factory.tunnel_connection.tunnel_protocol__connection_lost(exception)
+        
         if self.factory.tunnel_output_protocol is not None:
+            hop_failures_metric.increase(1, self.factory.tunnel_output_protocol_factory.configuration["PROXY_SERVER"]["TYPE"])
+            
             self.factory.tunnel_output_protocol.connection_lost(exception)
+            
+            if self.pipeline_state == 1 and self.factory.connection_retry is not None:
+                self.factory.connection_retry()
+            else:
+                self.factory.connection_failed(exception)
         else:
             if self.factory.output_protocol is not None:
                 self.factory.output_protocol.connection_lost(exception)
         
+        if self.factory.tunnel_timing is not None:
+            self.factory.tunnel_timing.finish()
+        
         self.transport = None
     
     def data_received(self, data):
@@ -93,16 +154,85 @@ class TunnelProtocol(asyncio.Protocol):
             self.factory.tunnel_output_protocol.data_received(data)
         else:
             if self.factory.output_protocol is not None:
+                if self.factory.tunnel_timing is not None:
+                    self.factory.tunnel_timing.data_received()
+                
                 self.factory.output_protocol.data_received(data)
     
+    def pause_writing(self):
+        twunnel3.logger.trace("TunnelProtocol.pause_writing")
+        
+        if self.factory.tunnel_output_protocol is None:
+            if self.factory.output_protocol is not None:
+                self.factory.output_protocol.pause_writing()
+    
+    def resume_writing(self):
+        twunnel3.logger.trace("TunnelProtocol.resume_writing")
+        
+        if self.factory.tunnel_output_protocol is None:
+            if self.factory.output_protocol is not None:
+                self.factory.output_protocol.resume_writing()
+    
     def tunnel_output_protocol__connection_made(self, transport, data):
         twunnel3.logger.trace("TunnelProtocol.tunnel_output_protocol__connection_made")
         
+        hop_connect_duration_metric.observe(time.time() - self.connection_time, self.factory.tunnel_output_protocol_factory.configuration["PROXY_SERVER"]["TYPE"])
+        
+        if self.factory.tunnel_timing is not None:
+            self.factory.tunnel_timing.response_received()
+        
         self.data = data
         
-        asyncio.async(asyncio.get_event_loop().create_connection(lambda: self, sock=self.transport.get_extra_info("socket"), ssl=self.factory.ssl, server_hostname=self.factory.ssl_address))
+        if self.factory.ssl is None:
+            self.connection_made(self.transport)
+        else:
+            if self.factory.tunnel_timing is not None:
+                self.factory.tunnel_timing.tls_started()
+            
+            loop = asyncio.get_event_loop()
+            
+            # loop.start_tls was added in Python 3.7, before that the tunnel socket is wrapped in a second transport that takes over reading from the first one.
+            if not hasattr(loop, "start_tls"):
+                twunnel3.compat.ensure_future(loop.create_connection(lambda: self, sock=self.transport.get_extra_info("socket"), ssl=self.factory.ssl, server_hostname=self.factory.ssl_address))
+                
+                return
+            
+            future = twunnel3.compat.ensure_future(loop.start_tls(self.transport, self, self.factory.ssl, server_hostname=self.factory.ssl_address))
+            future.add_done_callback(self.transport__upgraded)
+    
+    def transport__upgraded(self, future):
+        twunnel3.logger.trace("TunnelProtocol.transport__upgraded")
+        
+        if self.transport is None:
+            return
+        
+        if future.cancelled() or future.exception() is not None:
+            self.transport.close()
+            
+            return
+        
+        self.connection_made(future.result())
+    
+    def tunnel_output_protocol__request_sent(self):
+        twunnel3.logger.trace("TunnelProtocol.tunnel_output_protocol__request_sent")
+        
+        if self.factory.tunnel_timing is not None:
+            self.factory.tunnel_timing.request_sent()
+    
+    def tunnel_output_protocol__connection_ready(self):
+        twunnel3.logger.trace("TunnelProtocol.tunnel_output_protocol__connection_ready")
+        
+        if self.factory.tunnel_connection is not None:
+            self.factory.tunnel_connection.tunnel_protocol__connection_ready(self)
+    
+    def tunnel_output_protocol__pipeline_failed(self):
+        twunnel3.logger.trace("TunnelProtocol.tunnel_output_protocol__pipeline_failed")
+        
+        self.pipeline_state = 1
 
 class TunnelProtocolFactory(object):
+    __slots__ = ("tunnel_output_protocol", "tunnel_output_protocol_factory", "output_protocol", "output_protocol_factory", "ssl", "ssl_address", "tunnel_connection", "tunnel_timing", "connection_retry")
+    
     def __init__(self, tunnel_output_protocol_factory, output_protocol_factory, ssl, ssl_address):
         twunnel3.logger.trace("TunnelProtocolFactory.__init__")
         
@@ -112,6 +242,9 @@ class TunnelProtocolFactory(object):
         self.output_protocol_factory = output_protocol_factory
         self.ssl = ssl
         self.ssl_address = ssl_address
+        self.tunnel_connection = None
+        self.tunnel_timing = None
+        self.connection_retry = None
     
     def __call__(self):
         twunnel3.logger.trace("TunnelProtocolFactory.__call__")
@@ -119,12 +252,746 @@ class TunnelProtocolFactory(object):
         protocol = TunnelProtocol()
         protocol.factory = self
         return protocol
+    
+    def connection_done(self, future):
+        twunnel3.logger.trace("TunnelProtocolFactory.connection_done")
+        
+        if future.cancelled():
+            self.connection_failed(None)
+        else:
+            if future.exception() is not None:
+                self.connection_failed(future.exception())
+    
+    def connection_failed(self, exception):
+        twunnel3.logger.trace("TunnelProtocolFactory.connection_failed")
+        
+        if self.output_protocol is None and hasattr(self.output_protocol_factory, "connection_failed"):
+            self.output_protocol_factory.connection_failed(exception)
+
+class TunnelConnection(object):
+    __slots__ = ("tunnel_connection_pool", "tunnel_protocol_factories", "tunnel_protocol", "transport", "connection_state", "connection_time")
+    
+    def __init__(self, tunnel_connection_pool):
+        twunnel3.logger.trace("TunnelConnection.__init__")
+        
+        self.tunnel_connection_pool = tunnel_connection_pool
+        self.tunnel_protocol_factories = []
+        self.tunnel_protocol = None
+        self.transport = None
+        self.connection_state = 0
+        self.connection_time = time.time()
+    
+    def connect(self, output_protocol_factory, address, port, ssl, ssl_address):
+        twunnel3.logger.trace("TunnelConnection.connect")
+        
+        self.connection_state = 2
+        
+        tunnel_timing = TunnelTiming(1)
+        tunnel_timing.hop_started(self.tunnel_protocol.factory.tunnel_output_protocol_factory.configuration)
+        
+        for tunnel_protocol_factory in self.tunnel_protocol_factories:
+            tunnel_protocol_factory.tunnel_connection = None
+            tunnel_protocol_factory.tunnel_timing = tunnel_timing
+        
+        self.tunnel_protocol.factory.output_protocol_factory = output_protocol_factory
+        self.tunnel_protocol.factory.ssl = ssl
+        self.tunnel_protocol.factory.ssl_address = ssl_address
+        self.tunnel_protocol.factory.tunnel_output_protocol.connect(address, port)
+        
+        future = asyncio.Future()
+        future.set_result((self.transport, self.tunnel_protocol))
+        return future
+    
+    def close(self):
+        twunnel3.logger.trace("TunnelConnection.close")
+        
+        if self.connection_state < 2:
+            self.connection_state = 3
+            
+            if self.transport is not None:
+                self.transport.close()
+            
+            self.tunnel_connection_pool.tunnel_connection__connection_lost(self)
+    
+    def tunnel_protocol__connection_ready(self, tunnel_protocol):
+        twunnel3.logger.trace("TunnelConnection.tunnel_protocol__connection_ready")
+        
+        if self.connection_state == 0:
+            self.tunnel_protocol = tunnel_protocol
+            self.connection_state = 1
+            self.connection_time = time.time()
+            
+            sock = self.transport.get_extra_info("socket")
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                if hasattr(socket, "TCP_KEEPIDLE") and hasattr(socket, "TCP_KEEPINTVL"):
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.tunnel_connection_pool.configuration["POOL"]["PROBE_INTERVAL"])
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.tunnel_connection_pool.configuration["POOL"]["PROBE_INTERVAL"])
+            
+            self.tunnel_connection_pool.tunnel_connection__connection_ready(self)
+    
+    def tunnel_protocol__connection_lost(self, exception):
+        twunnel3.logger.trace("TunnelConnection.tunnel_protocol__connection_lost")
+        
+        if self.connection_state < 2:
+            self.connection_state = 3
+            
+            self.tunnel_connection_pool.tunnel_connection__connection_lost(self)
+
+class TunnelConnectionPool(object):
+    def __init__(self, tunnel):
+        twunnel3.logger.trace("TunnelConnectionPool.__init__")
+        
+        self.tunnel = tunnel
+        self.configuration = tunnel.configuration
+        self.tunnel_connections = []
+        self.number_of_tunnel_connections = 0
+        self.probe_handle = None
+    
+    def get_tunnel_connection(self):
+        twunnel3.logger.trace("TunnelConnectionPool.get_tunnel_connection")
+        
+        tunnel_connection = None
+        
+        while len(self.tunnel_connections) > 0:
+            tunnel_connection = self.tunnel_connections.pop()
+            
+            if time.time() - tunnel_connection.connection_time <= self.configuration["POOL"]["MAXIMUM_IDLE_TIME"]:
+                self.number_of_tunnel_connections = self.number_of_tunnel_connections - 1
+                
+                break
+            
+            tunnel_connection.close()
+            tunnel_connection = None
+        
+        self.fill()
+        
+        return tunnel_connection
+    
+    def fill(self):
+        twunnel3.logger.trace("TunnelConnectionPool.fill")
+        
+        if self.probe_handle is None:
+            self.probe_handle = asyncio.get_event_loop().call_later(self.configuration["POOL"]["PROBE_INTERVAL"], self.probe)
+        
+        while self.number_of_tunnel_connections < self.configuration["POOL"]["SIZE"]:
+            self.number_of_tunnel_connections = self.number_of_tunnel_connections + 1
+            
+            tunnel_connection = TunnelConnection(self)
+            
+            future = self.tunnel.create_tunnel_connection(tunnel_connection)
+            future.add_done_callback(lambda future, tunnel_connection=tunnel_connection: self.tunnel_connection__connection_made(tunnel_connection, future))
+    
+    def probe(self):
+        twunnel3.logger.trace("TunnelConnectionPool.probe")
+        
+        self.probe_handle = None
+        
+        for tunnel_connection in list(self.tunnel_connections):
+            if time.time() - tunnel_connection.connection_time > self.configuration["POOL"]["MAXIMUM_IDLE_TIME"]:
+                tunnel_connection.close()
+            else:
+                if len(tunnel_connection.tunnel_protocol.factory.tunnel_output_protocol.data) > 0:
+                    tunnel_connection.close()
+        
+        self.fill()
+    
+    def tunnel_connection__connection_made(self, tunnel_connection, future):
+        twunnel3.logger.trace("TunnelConnectionPool.tunnel_connection__connection_made")
+        
+        if future.cancelled() or future.exception() is not None:
+            if tunnel_connection.connection_state == 0:
+                tunnel_connection.connection_state = 3
+                
+                self.tunnel_connection__connection_lost(tunnel_connection)
+    
+    def tunnel_connection__connection_ready(self, tunnel_connection):
+        twunnel3.logger.trace("TunnelConnectionPool.tunnel_connection__connection_ready")
+        
+        self.tunnel_connections.append(tunnel_connection)
+    
+    def tunnel_connection__connection_lost(self, tunnel_connection):
+        twunnel3.logger.trace("TunnelConnectionPool.tunnel_connection__connection_lost")
+        
+        if tunnel_connection in self.tunnel_connections:
+            self.tunnel_connections.remove(tunnel_connection)
+        
+        self.number_of_tunnel_connections = self.number_of_tunnel_connections - 1
+
+class TunnelPlanHop(object):
+    __slots__ = ("configuration", "tunnel_output_protocol_factory_class", "tunnel_output_protocol_plan", "address", "port")
+    
+    def __init__(self, configuration, tunnel_output_protocol_factory_class, tunnel_output_protocol_plan, address, port):
+        twunnel3.logger.trace("TunnelPlanHop.__init__")
+        
+        self.configuration = configuration
+        self.tunnel_output_protocol_factory_class = tunnel_output_protocol_factory_class
+        self.tunnel_output_protocol_plan = tunnel_output_protocol_plan
+        self.address = address
+        self.port = port
+
+class TunnelPlan(object):
+    __slots__ = ("hops", "address", "port")
+    
+    def __init__(self, hops, address, port):
+        twunnel3.logger.trace("TunnelPlan.__init__")
+        
+        self.hops = tuple(hops)
+        self.address = address
+        self.port = port
+
+def get_duration(start_time, end_time):
+    if start_time == 0 or end_time == 0:
+        return None
+    
+    return end_time - start_time
+
+class TunnelTimingHop(object):
+    __slots__ = ("type", "address", "port", "start_time", "request_time", "response_time")
+    
+    def __init__(self, configuration):
+        twunnel3.logger.trace("TunnelTimingHop.__init__")
+        
+        self.type = configuration["PROXY_SERVER"]["TYPE"]
+        self.address = configuration["PROXY_SERVER"]["ADDRESS"]
+        self.port = configuration["PROXY_SERVER"]["PORT"]
+        self.start_time = time.time()
+        self.request_time = 0
+        self.response_time = 0
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("TunnelTimingHop.get_statistics")
+        
+        statistics = {}
+        statistics["TYPE"] = self.type
+        statistics["ADDRESS"] = self.address
+        statistics["PORT"] = self.port
+        statistics["NEGOTIATION_DURATION"] = get_duration(self.start_time, self.request_time)
+        statistics["RESPONSE_DURATION"] = get_duration(self.request_time, self.response_time)
+        statistics["DURATION"] = get_duration(self.start_time, self.response_time)
+        
+        return statistics
+
+class TunnelTiming(object):
+    __slots__ = ("number_of_hops", "hops", "connection_time", "connection_made_time", "tls_time", "ready_time", "first_byte_time", "finished")
+    
+    def __init__(self, number_of_hops):
+        twunnel3.logger.trace("TunnelTiming.__init__")
+        
+        self.number_of_hops = number_of_hops
+        self.hops = []
+        self.connection_time = time.time()
+        self.connection_made_time = 0
+        self.tls_time = 0
+        self.ready_time = 0
+        self.first_byte_time = 0
+        self.finished = False
+    
+    def hop_started(self, configuration):
+        twunnel3.logger.trace("TunnelTiming.hop_started")
+        
+        hop = TunnelTimingHop(configuration)
+        
+        if len(self.hops) == 0:
+            self.connection_made_time = hop.start_time
+        
+        self.hops.append(hop)
+    
+    def request_sent(self):
+        twunnel3.logger.trace("TunnelTiming.request_sent")
+        
+        self.hops[-1].request_time = time.time()
+    
+    def response_received(self):
+        twunnel3.logger.trace("TunnelTiming.response_received")
+        
+        hop = self.hops[-1]
+        hop.response_time = time.time()
+        
+        if hop.request_time != 0:
+            hop_response_duration_metric.observe(hop.response_time - hop.request_time, hop.type)
+    
+    def tls_started(self):
+        twunnel3.logger.trace("TunnelTiming.tls_started")
+        
+        self.tls_time = time.time()
+    
+    def hop_completed(self):
+        twunnel3.logger.trace("TunnelTiming.hop_completed")
+        
+        if len(self.hops) < self.number_of_hops:
+            return
+        
+        self.ready_time = time.time()
+        
+        if self.tls_time != 0:
+            tunnel_tls_handshake_duration_metric.observe(self.ready_time - self.tls_time)
+    
+    def data_received(self):
+        twunnel3.logger.trace("TunnelTiming.data_received")
+        
+        if self.ready_time == 0 or self.first_byte_time != 0:
+            return
+        
+        self.first_byte_time = time.time()
+        
+        tunnel_first_byte_duration_metric.observe(self.first_byte_time - self.ready_time)
+        
+        self.finish()
+    
+    def finish(self):
+        twunnel3.logger.trace("TunnelTiming.finish")
+        
+        if self.finished:
+            return
+        
+        self.finished = True
+        
+        tunnel_timing_callback = get_tunnel_timing_callback()
+        
+        if tunnel_timing_callback is not None:
+            tunnel_timing_callback(self.get_statistics())
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("TunnelTiming.get_statistics")
+        
+        statistics = {}
+        statistics["CONNECTION_DURATION"] = get_duration(self.connection_time, self.connection_made_time)
+        statistics["HOPS"] = []
+        statistics["TLS_HANDSHAKE_DURATION"] = get_duration(self.tls_time, self.ready_time)
+        statistics["FIRST_BYTE_DURATION"] = get_duration(self.ready_time, self.first_byte_time)
+        statistics["DURATION"] = get_duration(self.connection_time, self.ready_time)
+        
+        i = 0
+        while i < len(self.hops):
+            statistics["HOPS"].append(self.hops[i].get_statistics())
+            
+            i = i + 1
+        
+        return statistics
+
+class Resolver(object):
+    def __init__(self, configuration):
+        twunnel3.logger.trace("Resolver.__init__")
+        
+        self.configuration = configuration
+        self.entries = collections.OrderedDict()
+        self.address_families = collections.OrderedDict()
+        self.futures = {}
+        self.keys = collections.deque()
+        self.number_of_queries = 0
+        self.number_of_hits = 0
+        self.number_of_misses = 0
+        self.number_of_coalesced_lookups = 0
+        self.number_of_completed_queries = 0
+        self.number_of_failed_queries = 0
+        self.latency = 0.0
+        self.maximum_latency = 0.0
+        self.number_of_connection_attempts = 0
+    
+    def resolve(self, address, port, family=0, type=socket.SOCK_STREAM, protocol=0, flags=0):
+        twunnel3.logger.trace("Resolver.resolve")
+        
+        future = asyncio.Future()
+        
+        if is_ipv4_address(address):
+            future.set_result([(socket.AF_INET, type, protocol, "", (address, port))])
+            
+            return future
+        
+        if is_ipv6_address(address):
+            future.set_result([(socket.AF_INET6, type, protocol, "", (address, port, 0, 0))])
+            
+            return future
+        
+        key = (address, port, family, type, protocol, flags)
+        
+        entry = self.entries.get(key)
+        if entry is not None:
+            expiration_time, addresses, error = entry
+            
+            if expiration_time > asyncio.get_event_loop().time():
+                self.entries.move_to_end(key)
+                
+                self.number_of_hits = self.number_of_hits + 1
+                
+                if error is not None:
+                    future.set_exception(create_exception(error))
+                else:
+                    future.set_result(addresses)
+                
+                return future
+            
+            del self.entries[key]
+        
+        self.number_of_misses = self.number_of_misses + 1
+        
+        futures = self.futures.get(key)
+        if futures is not None:
+            self.number_of_coalesced_lookups = self.number_of_coalesced_lookups + 1
+            
+            futures.append(future)
+            
+            return future
+        
+        self.futures[key] = [future]
+        
+        if self.number_of_queries < self.configuration["RESOLVER"]["MAXIMUM_NUMBER_OF_QUERIES"]:
+            self.query(key)
+        else:
+            self.keys.append(key)
+        
+        return future
+    
+    def query(self, key):
+        twunnel3.logger.trace("Resolver.query")
+        
+        self.number_of_queries = self.number_of_queries + 1
+        
+        query_time = asyncio.get_event_loop().time()
+        
+        address, port, family, type, protocol, flags = key
+        
+        future = asyncio.get_event_loop().run_in_executor(None, socket.getaddrinfo, address, port, family, type, protocol, flags)
+        future.add_done_callback(lambda future: self.query__done(key, query_time, future))
+    
+    def query__done(self, key, query_time, future):
+        twunnel3.logger.trace("Resolver.query__done")
+        
+        self.number_of_queries = self.number_of_queries - 1
+        self.number_of_completed_queries = self.number_of_completed_queries + 1
+        
+        current_time = asyncio.get_event_loop().time()
+        
+        latency = current_time - query_time
+        
+        self.latency = self.latency + (latency - self.latency) / self.number_of_completed_queries
+        self.maximum_latency = max(self.maximum_latency, latency)
+        
+        addresses = None
+        error = None
+        
+        if future.cancelled():
+            error = (OSError, ("getaddrinfo cancelled",))
+        else:
+            exception = future.exception()
+            
+            if exception is not None:
+                error = (type(exception), exception.args)
+            else:
+                addresses = future.result()
+        
+        if error is not None:
+            self.number_of_failed_queries = self.number_of_failed_queries + 1
+            
+            expiration_time = current_time + self.configuration["RESOLVER"]["NEGATIVE_TTL"]
+        else:
+            expiration_time = current_time + self.configuration["RESOLVER"]["TTL"]
+        
+        if expiration_time > current_time:
+            self.entries[key] = (expiration_time, addresses, error)
+            
+            while len(self.entries) > self.configuration["RESOLVER"]["MAXIMUM_NUMBER_OF_ENTRIES"]:
+                self.entries.popitem(last=False)
+        
+        for resolver_future in self.futures.pop(key):
+            if not resolver_future.done():
+                if error is not None:
+                    resolver_future.set_exception(create_exception(error))
+                else:
+                    resolver_future.set_result(addresses)
+        
+        while len(self.keys) > 0 and self.number_of_queries < self.configuration["RESOLVER"]["MAXIMUM_NUMBER_OF_QUERIES"]:
+            self.query(self.keys.popleft())
+    
+    def get_address_family(self, address):
+        twunnel3.logger.trace("Resolver.get_address_family")
+        
+        address_family = self.address_families.get(address)
+        if address_family is not None:
+            return address_family
+        
+        if self.configuration["RESOLVER"]["ADDRESS_FAMILY"] == "IPV4":
+            return socket.AF_INET
+        
+        return socket.AF_INET6
+    
+    def set_address_family(self, address, address_family):
+        twunnel3.logger.trace("Resolver.set_address_family")
+        
+        self.address_families[address] = address_family
+        self.address_families.move_to_end(address)
+        
+        while len(self.address_families) > self.configuration["RESOLVER"]["MAXIMUM_NUMBER_OF_ENTRIES"]:
+            self.address_families.popitem(last=False)
+    
+    def sort_addresses(self, address, addresses):
+        twunnel3.logger.trace("Resolver.sort_addresses")
+        
+        address_family = self.get_address_family(address)
+        
+        preferred_addresses = collections.deque()
+        other_addresses = collections.deque()
+        
+        for resolved_address in addresses:
+            if resolved_address[0] == address_family:
+                preferred_addresses.append(resolved_address)
+            else:
+                other_addresses.append(resolved_address)
+        
+        sorted_addresses = collections.deque()
+        
+        while len(preferred_addresses) > 0 or len(other_addresses) > 0:
+            if len(preferred_addresses) > 0:
+                sorted_addresses.append(preferred_addresses.popleft())
+            
+            if len(other_addresses) > 0:
+                sorted_addresses.append(other_addresses.popleft())
+        
+        return sorted_addresses
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("Resolver.get_statistics")
+        
+        statistics = {}
+        statistics["NUMBER_OF_ENTRIES"] = len(self.entries)
+        statistics["NUMBER_OF_HITS"] = self.number_of_hits
+        statistics["NUMBER_OF_MISSES"] = self.number_of_misses
+        statistics["NUMBER_OF_COALESCED_LOOKUPS"] = self.number_of_coalesced_lookups
+        statistics["NUMBER_OF_QUERIES"] = self.number_of_queries
+        statistics["NUMBER_OF_QUEUED_QUERIES"] = len(self.keys)
+        statistics["NUMBER_OF_COMPLETED_QUERIES"] = self.number_of_completed_queries
+        statistics["NUMBER_OF_FAILED_QUERIES"] = self.number_of_failed_queries
+        statistics["HIT_RATE"] = 0.0
+        if self.number_of_hits + self.number_of_misses > 0:
+            statistics["HIT_RATE"] = self.number_of_hits / (self.number_of_hits + self.number_of_misses)
+        statistics["LATENCY"] = self.latency
+        statistics["MAXIMUM_LATENCY"] = self.maximum_latency
+        statistics["NUMBER_OF_ADDRESS_FAMILIES"] = len(self.address_families)
+        statistics["NUMBER_OF_CONNECTION_ATTEMPTS"] = self.number_of_connection_attempts
+        
+        return statistics
+
+def create_exception(error):
+    exception_type, exception_arguments = error
+    
+    return exception_type(*exception_arguments)
+
+resolvers = weakref.WeakValueDictionary()
+
+def get_resolver(configuration):
+    key = tuple(sorted(configuration["RESOLVER"].items()))
+    
+    resolver = resolvers.get(key)
+    if resolver is None:
+        resolver = Resolver(configuration)
+        
+        resolvers[key] = resolver
+    
+    return resolver
+
+def get_resolver_statistics():
+    statistics = None
+    
+    number_of_completed_queries = 0
+    latency = 0.0
+    
+    for resolver in resolvers.values():
+        resolver_statistics = resolver.get_statistics()
+        
+        if statistics is None:
+            statistics = resolver_statistics
+        else:
+            for key in ["NUMBER_OF_ENTRIES", "NUMBER_OF_HITS", "NUMBER_OF_MISSES", "NUMBER_OF_COALESCED_LOOKUPS", "NUMBER_OF_QUERIES", "NUMBER_OF_QUEUED_QUERIES", "NUMBER_OF_COMPLETED_QUERIES", "NUMBER_OF_FAILED_QUERIES", "NUMBER_OF_ADDRESS_FAMILIES", "NUMBER_OF_CONNECTION_ATTEMPTS"]:
+                statistics[key] = statistics[key] + resolver_statistics[key]
+            
+            statistics["MAXIMUM_LATENCY"] = max(statistics["MAXIMUM_LATENCY"], resolver_statistics["MAXIMUM_LATENCY"])
+        
+        number_of_completed_queries = number_of_completed_queries + resolver.number_of_completed_queries
+        latency = latency + resolver.latency * resolver.number_of_completed_queries
+    
+    if statistics is None:
+        return None
+    
+    statistics["HIT_RATE"] = 0.0
+    if statistics["NUMBER_OF_HITS"] + statistics["NUMBER_OF_MISSES"] > 0:
+        statistics["HIT_RATE"] = statistics["NUMBER_OF_HITS"] / (statistics["NUMBER_OF_HITS"] + statistics["NUMBER_OF_MISSES"])
+    statistics["LATENCY"] = 0.0
+    if number_of_completed_queries > 0:
+        statistics["LATENCY"] = latency / number_of_completed_queries
+    
+    return statistics
+
+class ResolverConnection(object):
+    def __init__(self, configuration, protocol_factory, address, port, local_address_port, family, protocol, flags, ssl, ssl_address):
+        twunnel3.logger.trace("ResolverConnection.__init__")
+        
+        self.configuration = configuration
+        self.protocol_factory = protocol_factory
+        self.address = address
+        self.port = port
+        self.local_address_port = local_address_port
+        self.family = family
+        self.protocol = protocol
+        self.flags = flags
+        self.ssl = ssl
+        self.ssl_address = ssl_address
+        self.resolver = get_resolver(self.configuration)
+        self.addresses = collections.deque()
+        self.connection_futures = []
+        self.connection_handle = None
+        self.connection_socket = None
+        self.future = asyncio.Future()
+    
+    def connect(self):
+        twunnel3.logger.trace("ResolverConnection.connect")
+        
+        future = self.resolver.resolve(self.address, self.port, self.family, socket.SOCK_STREAM, self.protocol, self.flags)
+        future.add_done_callback(self.resolver__resolved)
+        
+        return self.future
+    
+    def connect_address(self):
+        twunnel3.logger.trace("ResolverConnection.connect_address")
+        
+        if self.connection_handle is not None:
+            self.connection_handle.cancel()
+            self.connection_handle = None
+        
+        if self.future.done() or self.connection_socket is not None:
+            return
+        
+        family, type, protocol, name, address = self.addresses.popleft()
+        
+        self.resolver.number_of_connection_attempts = self.resolver.number_of_connection_attempts + 1
+        
+        connection_socket = None
+        
+        try:
+            connection_socket = socket.socket(family, type, protocol)
+            connection_socket.setblocking(False)
+            
+            if self.local_address_port is not None:
+                local_address, local_port = self.local_address_port
+                
+                connection_socket.bind((local_address or "", local_port or 0))
+        except OSError as exception:
+            if connection_socket is not None:
+                connection_socket.close()
+                connection_socket = None
+            
+            future = asyncio.Future()
+            future.set_exception(exception)
+        else:
+            future = twunnel3.compat.ensure_future(asyncio.get_event_loop().sock_connect(connection_socket, address))
+        
+        future.add_done_callback(lambda future: self.socket__connected(future, connection_socket, family))
+        
+        self.connection_futures.append(future)
+        
+        if len(self.addresses) > 0:
+            self.connection_handle = asyncio.get_event_loop().call_later(self.configuration["RESOLVER"]["CONNECTION_ATTEMPT_DELAY"], self.connect_address)
+    
+    def resolver__resolved(self, future):
+        twunnel3.logger.trace("ResolverConnection.resolver__resolved")
+        
+        if self.future.done():
+            return
+        
+        if future.exception() is not None:
+            self.future.set_exception(future.exception())
+            
+            return
+        
+        self.addresses = self.resolver.sort_addresses(self.address, future.result())
+        
+        if len(self.addresses) == 0:
+            self.future.set_exception(OSError("getaddrinfo returned an empty list"))
+            
+            return
+        
+        self.connect_address()
+    
+    def socket__connected(self, future, connection_socket, family):
+        twunnel3.logger.trace("ResolverConnection.socket__connected")
+        
+        self.connection_futures.remove(future)
+        
+        if self.future.done() or self.connection_socket is not None:
+            if connection_socket is not None:
+                connection_socket.close()
+            
+            return
+        
+        if future.cancelled() or future.exception() is not None:
+            if connection_socket is not None:
+                connection_socket.close()
+            
+            if len(self.addresses) > 0:
+                self.connect_address()
+            else:
+                if len(self.connection_futures) == 0:
+                    if future.cancelled():
+                        self.future.cancel()
+                    else:
+                        self.future.set_exception(future.exception())
+            
+            return
+        
+        self.connection_socket = connection_socket
+        
+        if self.connection_handle is not None:
+            self.connection_handle.cancel()
+            self.connection_handle = None
+        
+        for connection_future in self.connection_futures:
+            connection_future.cancel()
+        
+        self.resolver.set_address_family(self.address, family)
+        
+        future = twunnel3.compat.ensure_future(asyncio.get_event_loop().create_connection(self.protocol_factory, sock=connection_socket, ssl=self.ssl, server_hostname=self.ssl_address))
+        future.add_done_callback(self.connection__made)
+    
+    def connection__made(self, future):
+        twunnel3.logger.trace("ResolverConnection.connection__made")
+        
+        if self.future.done():
+            if not future.cancelled() and future.exception() is None:
+                transport, protocol = future.result()
+                transport.close()
+            
+            return
+        
+        if future.cancelled():
+            self.future.cancel()
+            
+            return
+        
+        if future.exception() is not None:
+            self.future.set_exception(future.exception())
+            
+            return
+        
+        self.future.set_result(future.result())
+
+def create_connection(configuration, protocol_factory, address, port, local_address_port=None, family=0, protocol=0, flags=0, ssl=None, ssl_address=None):
+    resolver_connection = ResolverConnection(configuration, protocol_factory, address, port, local_address_port, family, protocol, flags, ssl, ssl_address)
+    
+    return resolver_connection.connect()
 
 class Tunnel(object):
+    __slots__ = ("configuration", "tunnel_plan", "tunnel_connection_pool", "resolver")
+    
     def __init__(self, configuration):
         twunnel3.logger.trace("Tunnel.__init__")
         
         self.configuration = configuration
+        self.resolver = get_resolver(self.configuration)
+        self.tunnel_plan = self.create_tunnel_plan()
+        self.tunnel_connection_pool = None
+        
+        if self.configuration["POOL"]["SIZE"] > 0 and len(self.configuration["PROXY_SERVERS"]) > 0:
+            self.tunnel_connection_pool = TunnelConnectionPool(self)
     
     def create_connection(self, output_protocol_factory, address=None, port=None, *, local_address=None, local_port=None, address_family=0, address_protocol=0, address_flags=0, ssl=None, ssl_address=None):
         twunnel3.logger.trace("Tunnel.create_connection")
@@ -136,33 +1003,111 @@ class Tunnel(object):
         if ssl and not ssl_address:
             ssl_address = address
         
-        if len(self.configuration["PROXY_SERVERS"]) == 0:
-            return asyncio.get_event_loop().create_connection(output_protocol_factory, host=address, port=port, local_addr=local_address_port, family=address_family, proto=address_protocol, flags=address_flags, ssl=ssl, server_hostname=ssl_address)
+        if len(self.tunnel_plan.hops) == 0:
+            return create_connection(self.configuration, output_protocol_factory, address, port, local_address_port, address_family, address_protocol, address_flags, ssl, ssl_address)
         else:
-            i = len(self.configuration["PROXY_SERVERS"])
+            if self.tunnel_connection_pool is not None and local_address_port is None and address_family == 0 and address_protocol == 0 and address_flags == 0:
+                tunnel_connection = self.tunnel_connection_pool.get_tunnel_connection()
+                
+                if tunnel_connection is not None:
+                    return tunnel_connection.connect(output_protocol_factory, address, port, ssl, ssl_address)
             
+            connection_retry = lambda: self.retry_connection(output_protocol_factory, address, port, local_address_port, address_family, address_protocol, address_flags, ssl, ssl_address)
+            
+            tunnel_protocol_factory = self.create_tunnel_protocol_factory(output_protocol_factory, address, port, ssl, ssl_address, None, connection_retry)
+            
+            return create_connection(self.configuration, tunnel_protocol_factory, self.tunnel_plan.address, self.tunnel_plan.port, local_address_port, address_family, address_protocol, address_flags)
+    
+    def retry_connection(self, output_protocol_factory, address, port, local_address_port, address_family, address_protocol, address_flags, ssl, ssl_address):
+        twunnel3.logger.trace("Tunnel.retry_connection")
+        
+        tunnel_protocol_factory = self.create_tunnel_protocol_factory(output_protocol_factory, address, port, ssl, ssl_address, None, None)
+        
+        future = create_connection(self.configuration, tunnel_protocol_factory, self.tunnel_plan.address, self.tunnel_plan.port, local_address_port, address_family, address_protocol, address_flags)
+        future.add_done_callback(tunnel_protocol_factory.connection_done)
+    
+    def fill_tunnel_connection_pool(self):
+        twunnel3.logger.trace("Tunnel.fill_tunnel_connection_pool")
+        
+        if self.tunnel_connection_pool is not None:
+            self.tunnel_connection_pool.fill()
+    
+    def create_tunnel_connection(self, tunnel_connection):
+        twunnel3.logger.trace("Tunnel.create_tunnel_connection")
+        
+        tunnel_protocol_factory = self.create_tunnel_protocol_factory(None, None, None, None, None, tunnel_connection, None)
+        
+        return create_connection(self.configuration, tunnel_protocol_factory, self.tunnel_plan.address, self.tunnel_plan.port)
+    
+    def create_tunnel_plan(self):
+        twunnel3.logger.trace("Tunnel.create_tunnel_plan")
+        
+        hops = []
+        
+        i = 0
+        while i < len(self.configuration["PROXY_SERVERS"]):
             configuration = {}
-            configuration["PROXY_SERVER"] = self.configuration["PROXY_SERVERS"][i - 1]
+            configuration["PROXY_SERVER"] = self.configuration["PROXY_SERVERS"][i]
+            
+            address = None
+            port = None
+            if i < len(self.configuration["PROXY_SERVERS"]) - 1:
+                address = self.configuration["PROXY_SERVERS"][i + 1]["ADDRESS"]
+                port = self.configuration["PROXY_SERVERS"][i + 1]["PORT"]
             
             tunnel_output_protocol_factory_class = self.get_tunnel_output_protocol_factory_class(configuration["PROXY_SERVER"]["TYPE"])
-            tunnel_output_protocol_factory = tunnel_output_protocol_factory_class(configuration, address, port)
+            tunnel_output_protocol_plan_class = self.get_tunnel_output_protocol_plan_class(configuration["PROXY_SERVER"]["TYPE"])
+            tunnel_output_protocol_plan = tunnel_output_protocol_plan_class(configuration, address, port)
             
-            tunnel_protocol_factory = TunnelProtocolFactory(tunnel_output_protocol_factory, output_protocol_factory, ssl, ssl_address)
+            hop = TunnelPlanHop(configuration, tunnel_output_protocol_factory_class, tunnel_output_protocol_plan, address, port)
+            hops.append(hop)
             
-            i = i - 1
+            i = i + 1
+        
+        if len(hops) == 0:
+            return TunnelPlan(hops, None, None)
+        
+        return TunnelPlan(hops, self.configuration["PROXY_SERVERS"][0]["ADDRESS"], self.configuration["PROXY_SERVERS"][0]["PORT"])
+    
+    def create_tunnel_protocol_factory(self, output_protocol_factory, address, port, ssl, ssl_address, tunnel_connection, connection_retry):
+        twunnel3.logger.trace("Tunnel.create_tunnel_protocol_factory")
+        
+        i = len(self.tunnel_plan.hops)
+        
+        hop = self.tunnel_plan.hops[i - 1]
+        
+        tunnel_output_protocol_factory = hop.tunnel_output_protocol_factory_class(hop.configuration, address, port, hop.tunnel_output_protocol_plan)
+        
+        tunnel_timing = None
+        if tunnel_connection is None:
+            tunnel_timing = TunnelTiming(len(self.tunnel_plan.hops))
+        
+        tunnel_protocol_factory = TunnelProtocolFactory(tunnel_output_protocol_factory, output_protocol_factory, ssl, ssl_address)
+        tunnel_protocol_factory.tunnel_timing = tunnel_timing
+        tunnel_protocol_factory.connection_retry = connection_retry
+        
+        if tunnel_connection is not None:
+            tunnel_protocol_factory.tunnel_connection = tunnel_connection
+            tunnel_connection.tunnel_protocol_factories.append(tunnel_protocol_factory)
+        
+        i = i - 1
+        
+        while i > 0:
+            hop = self.tunnel_plan.hops[i - 1]
             
-            while i > 0:
-                configuration = {}
-                configuration["PROXY_SERVER"] = self.configuration["PROXY_SERVERS"][i - 1]
-                
-                tunnel_output_protocol_factory_class = self.get_tunnel_output_protocol_factory_class(configuration["PROXY_SERVER"]["TYPE"])
-                tunnel_output_protocol_factory = tunnel_output_protocol_factory_class(configuration, self.configuration["PROXY_SERVERS"][i]["ADDRESS"], self.configuration["PROXY_SERVERS"][i]["PORT"])
-                
-                tunnel_protocol_factory = TunnelProtocolFactory(tunnel_output_protocol_factory, tunnel_protocol_factory, None, None)
-                
-                i = i - 1
+            tunnel_output_protocol_factory = hop.tunnel_output_protocol_factory_class(hop.configuration, hop.address, hop.port, hop.tunnel_output_protocol_plan)
             
-            return asyncio.get_event_loop().create_connection(tunnel_protocol_factory, host=self.configuration["PROXY_SERVERS"][i]["ADDRESS"], port=self.configuration["PROXY_SERVERS"][i]["PORT"], local_addr=local_address_port, family=address_family, proto=address_protocol, flags=address_flags)
+            tunnel_protocol_factory = TunnelProtocolFactory(tunnel_output_protocol_factory, tunnel_protocol_factory, None, None)
+            tunnel_protocol_factory.tunnel_timing = tunnel_timing
+            tunnel_protocol_factory.connection_retry = connection_retry
+            
+            if tunnel_connection is not None:
+                tunnel_protocol_factory.tunnel_connection = tunnel_connection
+                tunnel_connection.tunnel_protocol_factories.append(tunnel_protocol_factory)
+            
+            i = i - 1
+        
+        return tunnel_protocol_factory
     
     def get_tunnel_output_protocol_factory_class(self, type):
         twunnel3.logger.trace("Tunnel.get_tunnel_output_protocol_factory_class")
@@ -183,6 +1128,26 @@ class Tunnel(object):
                     return SOCKS5TunnelOutputProtocolFactory
                 else:
                     return None
+    
+    def get_tunnel_output_protocol_plan_class(self, type):
+        twunnel3.logger.trace("Tunnel.get_tunnel_output_protocol_plan_class")
+        
+        if type == "HTTPS":
+            from twunnel3.proxy_server__https import HTTPSTunnelOutputProtocolPlan
+            
+            return HTTPSTunnelOutputProtocolPlan
+        else:
+            if type == "SOCKS4":
+                from twunnel3.proxy_server__socks4 import SOCKS4TunnelOutputProtocolPlan
+                
+                return SOCKS4TunnelOutputProtocolPlan
+            else:
+                if type == "SOCKS5":
+                    from twunnel3.proxy_server__socks5 import SOCKS5TunnelOutputProtocolPlan
+                    
+                    return SOCKS5TunnelOutputProtocolPlan
+                else:
+                    return None
 
 default_tunnel_class = Tunnel
 
@@ -196,8 +1161,20 @@ def set_default_tunnel_class(tunnel_class):
     
     default_tunnel_class = tunnel_class
 
+tunnel_timing_callback = None
+
+def get_tunnel_timing_callback():
+    global tunnel_timing_callback
+    
+    return tunnel_timing_callback
+
+def set_tunnel_timing_callback(callback):
+    global tunnel_timing_callback
+    
+    tunnel_timing_callback = callback
+
 def create_tunnel(configuration):
-    set_default_configuration(configuration, ["PROXY_SERVERS"])
+    set_default_configuration(configuration, ["PROXY_SERVERS", "POOL", "RESOLVER"])
     
     tunnel_class = get_default_tunnel_class()
     tunnel = tunnel_class(configuration)
@@ -4,16 +4,21 @@
 import asyncio
 import base64
 import twunnel3.logger
+import twunnel3.parser
+import twunnel3.timer
 
 from twunnel3.proxy_server import is_ipv4_address, is_ipv6_address
 
 class HTTPSTunnelOutputProtocol(asyncio.Protocol):
+    __slots__ = ("data", "data_state", "factory", "timer", "transport")
+    
     def __init__(self):
         twunnel3.logger.trace("HTTPSTunnelOutputProtocol.__init__")
         
-        self.data = b""
+        self.data = twunnel3.parser.Parser()
         self.data_state = 0
         self.factory = None
+        self.timer = None
         self.transport = None
         
     def connection_made(self, transport):
@@ -21,31 +26,50 @@ class HTTPSTunnelOutputProtocol(asyncio.Protocol):
         
         self.transport = transport
         
-        request = b"CONNECT "
+        self.timer = twunnel3.timer.Timer(self.timer__expired)
+        self.timer.start(self.factory.configuration["PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
         
-        if is_ipv6_address(self.factory.address) == True:
-            request = request + b"[" + self.factory.address.encode() + b"]:" + str(self.factory.port).encode()
+        if self.factory.address is not None:
+            self.write_request()
         else:
-            request = request + self.factory.address.encode() + b":" + str(self.factory.port).encode()
+            self.timer.cancel()
+            
+            self.factory.tunnel_protocol.tunnel_output_protocol__connection_ready()
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.trace("HTTPSTunnelOutputProtocol.connection_lost")
         
-        request = request + b" HTTP/1.1\r\n"
+        self.timer.cancel()
         
-        if self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode() != b"":
-            request = request + b"Proxy-Authorization: Basic " + base64.standard_b64encode(self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode() + b":" + self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["PASSWORD"].encode()) + b"\r\n"
+        self.transport = None
+    
+    def connect(self, address, port):
+        twunnel3.logger.trace("HTTPSTunnelOutputProtocol.connect")
         
-        request = request + b"\r\n"
+        self.timer.start(self.factory.configuration["PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
         
-        self.transport.write(request)
+        self.factory.address = address
+        self.factory.port = port
         
-    def connection_lost(self, exception):
-        twunnel3.logger.trace("HTTPSTunnelOutputProtocol.connection_lost")
+        self.write_request()
+    
+    def write_request(self):
+        twunnel3.logger.trace("HTTPSTunnelOutputProtocol.write_request")
         
-        self.transport = None
+        request = self.factory.plan.get_request(self.factory.address, self.factory.port)
+        
+        self.transport.write(request)
+        
+        self.factory.tunnel_protocol.tunnel_output_protocol__request_sent()
     
     def data_received(self, data):
         twunnel3.logger.trace("HTTPSTunnelOutputProtocol.data_received")
         
-        self.data = self.data + data
+        if not self.data.write(data):
+            self.transport.close()
+            
+            return
+        
         if self.data_state == 0:
             if self.process_data_state0():
                 return
@@ -62,9 +86,9 @@ class HTTPSTunnelOutputProtocol(asyncio.Protocol):
             
         i = i + 4
         
-        response = data[:i]
+        response = data.read(i)
         
-        data = data[i:]
+        data.commit()
         
         response_lines = response.split(b"\r\n")
         response_line = response_lines[0].split(b" ", 2)
@@ -83,19 +107,79 @@ class HTTPSTunnelOutputProtocol(asyncio.Protocol):
             
             return True
         
-        self.factory.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
+        data = data.read(len(data))
+        
+        self.data.commit()
+        
+        self.timer.cancel()
         
-        self.data = b""
+        self.factory.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
         
         return True
+    
+    def timer__expired(self):
+        twunnel3.logger.trace("HTTPSTunnelOutputProtocol.timer__expired")
+        
+        if self.transport is not None:
+            twunnel3.logger.debug("tunnel_output_protocol: timeout")
+            
+            self.transport.close()
 
-class HTTPSTunnelOutputProtocolFactory(object):
+class HTTPSTunnelOutputProtocolPlan(object):
+    __slots__ = ("configuration", "address", "port", "authorization", "request")
+    
     def __init__(self, configuration, address, port):
+        twunnel3.logger.trace("HTTPSTunnelOutputProtocolPlan.__init__")
+        
+        self.configuration = configuration
+        self.address = address
+        self.port = port
+        
+        self.authorization = b""
+        if self.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode() != b"":
+            self.authorization = b"Proxy-Authorization: Basic " + base64.standard_b64encode(self.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode() + b":" + self.configuration["PROXY_SERVER"]["ACCOUNT"]["PASSWORD"].encode()) + b"\r\n"
+        
+        self.request = None
+        if self.address is not None:
+            self.request = self.create_request(self.address, self.port)
+    
+    def get_request(self, address, port):
+        twunnel3.logger.trace("HTTPSTunnelOutputProtocolPlan.get_request")
+        
+        if self.request is not None and address == self.address and port == self.port:
+            return self.request
+        
+        return self.create_request(address, port)
+    
+    def create_request(self, address, port):
+        twunnel3.logger.trace("HTTPSTunnelOutputProtocolPlan.create_request")
+        
+        request = b"CONNECT "
+        
+        if is_ipv6_address(address) == True:
+            request = request + b"[" + address.encode() + b"]:" + str(port).encode()
+        else:
+            request = request + address.encode() + b":" + str(port).encode()
+        
+        request = request + b" HTTP/1.1\r\n"
+        request = request + self.authorization
+        request = request + b"\r\n"
+        
+        return request
+
+class HTTPSTunnelOutputProtocolFactory(object):
+    __slots__ = ("configuration", "address", "port", "plan", "tunnel_protocol")
+    
+    def __init__(self, configuration, address, port, plan=None):
         twunnel3.logger.trace("HTTPSTunnelOutputProtocolFactory.__init__")
         
+        if plan is None:
+            plan = HTTPSTunnelOutputProtocolPlan(configuration, None, None)
+        
         self.configuration = configuration
         self.address = address
         self.port = port
+        self.plan = plan
         self.tunnel_protocol = None
     
     def __call__(self):
@@ -5,16 +5,21 @@ import asyncio
 import socket
 import struct
 import twunnel3.logger
+import twunnel3.parser
+import twunnel3.timer
 
 from twunnel3.proxy_server import is_ipv4_address, is_ipv6_address
 
 class SOCKS4TunnelOutputProtocol(asyncio.Protocol):
+    __slots__ = ("data", "data_state", "factory", "timer", "transport")
+    
     def __init__(self):
         twunnel3.logger.trace("SOCKS4TunnelOutputProtocol.__init__")
         
-        self.data = b""
+        self.data = twunnel3.parser.Parser()
         self.data_state = 0
         self.factory = None
+        self.timer = None
         self.transport = None
     
     def connection_made(self, transport):
@@ -22,53 +27,52 @@ class SOCKS4TunnelOutputProtocol(asyncio.Protocol):
         
         self.transport = transport
         
-        address_type = 0x03
-        if is_ipv4_address(self.factory.address) == True:
-            address_type = 0x01
-        
-        request = struct.pack("!BB", 0x04, 0x01)
+        self.timer = twunnel3.timer.Timer(self.timer__expired)
+        self.timer.start(self.factory.configuration["PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
         
-        port = self.factory.port
+        if self.factory.address is not None:
+            self.write_request()
+        else:
+            self.timer.cancel()
+            
+            self.factory.tunnel_protocol.tunnel_output_protocol__connection_ready()
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.trace("SOCKS4TunnelOutputProtocol.connection_lost")
         
-        request = request + struct.pack("!H", port)
+        self.timer.cancel()
         
-        address = 0
-        if address_type == 0x01:
-            address = self.factory.address
-            address = socket.inet_pton(socket.AF_INET, address)
-            address, = struct.unpack("!I", address)
-        else:
-            if address_type == 0x03:
-                address = 1
+        self.transport = None
+    
+    def connect(self, address, port):
+        twunnel3.logger.trace("SOCKS4TunnelOutputProtocol.connect")
         
-        request = request + struct.pack("!I", address)
+        self.timer.start(self.factory.configuration["PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
         
-        name = self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode()
-        name = name + b"\x00"
-        name_length = len(name)
+        self.factory.address = address
+        self.factory.port = port
         
-        request = request + struct.pack("!%ds" % name_length, name)
+        self.write_request()
+    
+    def write_request(self):
+        twunnel3.logger.trace("SOCKS4TunnelOutputProtocol.write_request")
         
-        if address_type == 0x03:
-            address = self.factory.address.encode()
-            address = address + b"\x00"
-            address_length = len(address)
-            
-            request = request + struct.pack("!%ds" % address_length, address)
+        request = self.factory.plan.get_request(self.factory.address, self.factory.port)
         
         self.transport.write(request)
         
-        self.data_state = 0
+        self.factory.tunnel_protocol.tunnel_output_protocol__request_sent()
         
-    def connection_lost(self, exception):
-        twunnel3.logger.trace("SOCKS4TunnelOutputProtocol.connection_lost")
-        
-        self.transport = None
+        self.data_state = 0
     
     def data_received(self, data):
         twunnel3.logger.trace("SOCKS4TunnelOutputProtocol.data_received")
         
-        self.data = self.data + data
+        if not self.data.write(data):
+            self.transport.close()
+            
+            return
+        
         if self.data_state == 0:
             if self.process_data_state0():
                 return
@@ -81,28 +85,104 @@ class SOCKS4TunnelOutputProtocol(asyncio.Protocol):
         if len(data) < 8:
             return True
         
-        status, = struct.unpack("!B", data[1:2])
+        version, status, port, address = data.unpack("!BBHI")
         
-        data = data[8:]
+        data.commit()
         
         if status != 0x5a:
             self.transport.close()
             
             return True
         
-        self.factory.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
+        data = data.read(len(data))
         
-        self.data = b""
+        self.data.commit()
+        
+        self.timer.cancel()
+        
+        self.factory.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
         
         return True
+    
+    def timer__expired(self):
+        twunnel3.logger.trace("SOCKS4TunnelOutputProtocol.timer__expired")
+        
+        if self.transport is not None:
+            twunnel3.logger.debug("tunnel_output_protocol: timeout")
+            
+            self.transport.close()
 
-class SOCKS4TunnelOutputProtocolFactory(object):
+class SOCKS4TunnelOutputProtocolPlan(object):
+    __slots__ = ("configuration", "address", "port", "name", "request")
+    
     def __init__(self, configuration, address, port):
+        twunnel3.logger.trace("SOCKS4TunnelOutputProtocolPlan.__init__")
+        
+        self.configuration = configuration
+        self.address = address
+        self.port = port
+        
+        name = self.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode()
+        name = name + b"\x00"
+        name_length = len(name)
+        
+        self.name = struct.pack("!%ds" % name_length, name)
+        
+        self.request = None
+        if self.address is not None:
+            self.request = self.create_request(self.address, self.port)
+    
+    def get_request(self, address, port):
+        twunnel3.logger.trace("SOCKS4TunnelOutputProtocolPlan.get_request")
+        
+        if self.request is not None and address == self.address and port == self.port:
+            return self.request
+        
+        return self.create_request(address, port)
+    
+    def create_request(self, address, port):
+        twunnel3.logger.trace("SOCKS4TunnelOutputProtocolPlan.create_request")
+        
+        address_type = 0x03
+        if is_ipv4_address(address) == True:
+            address_type = 0x01
+        
+        request = struct.pack("!BB", 0x04, 0x01)
+        
+        request = request + struct.pack("!H", port)
+        
+        if address_type == 0x01:
+            ipv4_address = socket.inet_pton(socket.AF_INET, address)
+            ipv4_address, = struct.unpack("!I", ipv4_address)
+            
+            request = request + struct.pack("!I", ipv4_address)
+        else:
+            request = request + struct.pack("!I", 1)
+        
+        request = request + self.name
+        
+        if address_type == 0x03:
+            domain_name_address = address.encode()
+            domain_name_address = domain_name_address + b"\x00"
+            domain_name_address_length = len(domain_name_address)
+            
+            request = request + struct.pack("!%ds" % domain_name_address_length, domain_name_address)
+        
+        return request
+
+class SOCKS4TunnelOutputProtocolFactory(object):
+    __slots__ = ("configuration", "address", "port", "plan", "tunnel_protocol")
+    
+    def __init__(self, configuration, address, port, plan=None):
         twunnel3.logger.trace("SOCKS4TunnelOutputProtocolFactory.__init__")
         
+        if plan is None:
+            plan = SOCKS4TunnelOutputProtocolPlan(configuration, None, None)
+        
         self.configuration = configuration
         self.address = address
         self.port = port
+        self.plan = plan
         self.tunnel_protocol = None
     
     def __call__(self):
@@ -5,38 +5,86 @@ import asyncio
 import socket
 import struct
 import twunnel3.logger
+import twunnel3.parser
+import twunnel3.timer
 
 from twunnel3.proxy_server import is_ipv4_address, is_ipv6_address
 
+PIPELINE_FAILURE_TIME = 300
+
+pipeline_failures = {}
+
+def is_pipeline_failed(proxy_server_address_port):
+    if proxy_server_address_port not in pipeline_failures:
+        return False
+    
+    if pipeline_failures[proxy_server_address_port] <= asyncio.get_event_loop().time():
+        del pipeline_failures[proxy_server_address_port]
+        
+        return False
+    
+    return True
+
 class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
+    __slots__ = ("data", "data_state", "factory", "timer", "transport", "pipeline")
+    
     def __init__(self):
         twunnel3.logger.trace("SOCKS5TunnelOutputProtocol.__init__")
         
-        self.data = b""
+        self.data = twunnel3.parser.Parser()
         self.data_state = 0
         self.factory = None
+        self.timer = None
         self.transport = None
+        self.pipeline = False
     
     def connection_made(self, transport):
         twunnel3.logger.trace("SOCKS5TunnelOutputProtocol.connection_made")
         
         self.transport = transport
         
-        request = struct.pack("!BBBB", 0x05, 0x02, 0x00, 0x02)
+        self.timer = twunnel3.timer.Timer(self.timer__expired)
+        self.timer.start(self.factory.configuration["PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
+        
+        if self.factory.plan.pipeline == True and self.factory.address is not None and not is_pipeline_failed(self.factory.plan.proxy_server_address_port):
+            request = self.factory.plan.pipeline_request + self.factory.plan.get_request(self.factory.address, self.factory.port)
+            
+            self.pipeline = True
+        else:
+            request = self.factory.plan.greeting_request
         
         self.transport.write(request)
         
+        if self.pipeline == True:
+            self.factory.tunnel_protocol.tunnel_output_protocol__request_sent()
+        
         self.data_state = 0
         
     def connection_lost(self, exception):
         twunnel3.logger.trace("SOCKS5TunnelOutputProtocol.connection_lost")
         
+        self.timer.cancel()
+        
         self.transport = None
     
+    def connect(self, address, port):
+        twunnel3.logger.trace("SOCKS5TunnelOutputProtocol.connect")
+        
+        self.timer.start(self.factory.configuration["PROXY_SERVER"]["TIMEOUT"]["HANDSHAKE"])
+        
+        self.factory.address = address
+        self.factory.port = port
+        
+        self.process_data_state2()
+    
     def data_received(self, data):
         twunnel3.logger.trace("SOCKS5TunnelOutputProtocol.data_received")
         
-        self.data = self.data + data
+        if not self.data.write(data):
+            self.transport.close()
+            
+            return
+        
         if self.data_state == 0:
             if self.process_data_state0():
                 return
@@ -58,11 +106,24 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
         if len(data) < 2:
             return True
         
-        version, method = struct.unpack("!BB", data[:2])
+        version, method = data.unpack("!BB")
         
-        data = data[2:]
+        data.commit()
         
-        self.data = data
+        if self.pipeline == True:
+            if method != self.factory.plan.method:
+                self.pipeline_failed()
+                
+                self.transport.close()
+                
+                return True
+            
+            if method == 0x00:
+                self.data_state = 3
+            else:
+                self.data_state = 1
+            
+            return False
         
         if method == 0x00:
             self.data_state = 2
@@ -70,15 +131,7 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
             return False
         else:
             if method == 0x02:
-                name = self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode()
-                name_length = len(name)
-                
-                password = self.factory.configuration["PROXY_SERVER"]["ACCOUNT"]["PASSWORD"].encode()
-                password_length = len(password)
-                
-                request = struct.pack("!B", 0x01)
-                request = request + struct.pack("!B%ds" % name_length, name_length, name)
-                request = request + struct.pack("!B%ds" % password_length, password_length, password)
+                request = self.factory.plan.authentication_request
                 
                 self.transport.write(request)
                 
@@ -98,59 +151,38 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
         if len(data) < 2:
             return True
         
-        version, status = struct.unpack("!BB", data[:2])
+        version, status = data.unpack("!BB")
         
-        data = data[2:]
-        
-        self.data = data
+        data.commit()
         
         if status != 0x00:
             self.transport.close()
             
             return True
         
-        self.data_state = 2
+        if self.pipeline == True:
+            self.data_state = 3
+        else:
+            self.data_state = 2
         
         return False
         
     def process_data_state2(self):
         twunnel3.logger.trace("SOCKS5TunnelOutputProtocol.process_data_state2")
         
-        address_type = 0x03
-        if is_ipv4_address(self.factory.address) == True:
-            address_type = 0x01
-        else:
-            if is_ipv6_address(self.factory.address) == True:
-                address_type = 0x04
-        
-        request = struct.pack("!BBB", 0x05, 0x01, 0x00)
-        
-        if address_type == 0x01:
-            address = self.factory.address
-            address = socket.inet_pton(socket.AF_INET, address)
-            address, = struct.unpack("!I", address)
+        if self.factory.address is None:
+            self.timer.cancel()
             
-            request = request + struct.pack("!BI", 0x01, address)
-        else:
-            if address_type == 0x03:
-                address = self.factory.address.encode()
-                address_length = len(address)
-                
-                request = request + struct.pack("!BB%ds" % address_length, 0x03, address_length, address)
-            else:
-                if address_type == 0x04:
-                    address = self.factory.address
-                    address = socket.inet_pton(socket.AF_INET6, address)
-                    address1, address2, address3, address4 = struct.unpack("!IIII", address)
-                    
-                    request = request + struct.pack("!BIIII", 0x04, address1, address2, address3, address4)
-        
-        port = self.factory.port
+            self.factory.tunnel_protocol.tunnel_output_protocol__connection_ready()
+            
+            return True
         
-        request = request + struct.pack("!H", port)
+        request = self.factory.plan.get_request(self.factory.address, self.factory.port)
         
         self.transport.write(request)
         
+        self.factory.tunnel_protocol.tunnel_output_protocol__request_sent()
+        
         self.data_state = 3
         
         return True
@@ -163,9 +195,7 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
         if len(data) < 4:
             return True
         
-        version, status, reserved, address_type = struct.unpack("!BBBB", data[:4])
-        
-        data = data[4:]
+        version, status, reserved, address_type = data.unpack("!BBBB")
         
         if status != 0x00:
             self.transport.close()
@@ -174,59 +204,163 @@ class SOCKS5TunnelOutputProtocol(asyncio.Protocol):
         
         if address_type == 0x01:
             if len(data) < 4:
+                data.rollback()
+                
                 return True
             
-            address, = struct.unpack("!I", data[:4])
-            address = struct.pack("!I", address)
+            address = data.read(4)
             address = socket.inet_ntop(socket.AF_INET, address)
-            
-            data = data[4:]
         else:
             if address_type == 0x03:
                 if len(data) < 1:
+                    data.rollback()
+                    
                     return True
                 
-                address_length, = struct.unpack("!B", data[:1])
-                
-                data = data[1:]
+                address_length, = data.unpack("!B")
                 
                 if len(data) < address_length:
+                    data.rollback()
+                    
                     return True
                 
-                address, = struct.unpack("!%ds" % address_length, data[:address_length])
-                
-                data = data[address_length:]
+                address = data.read(address_length)
             else:
                 if address_type == 0x04:
                     if len(data) < 16:
+                        data.rollback()
+                        
                         return True
                     
-                    address1, address2, address3, address4 = struct.unpack("!IIII", data[:16])
-                    address = struct.pack("!IIII", address1, address2, address3, address4)
+                    address = data.read(16)
                     address = socket.inet_ntop(socket.AF_INET6, address)
-                    
-                    data = data[16:]
         
         if len(data) < 2:
+            data.rollback()
+            
             return True
         
-        port, = struct.unpack("!H", data[:2])
+        port, = data.unpack("!H")
         
-        data = data[2:]
+        data = data.read(len(data))
         
-        self.factory.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
+        self.data.commit()
         
-        self.data = b""
+        self.timer.cancel()
+        
+        self.factory.tunnel_protocol.tunnel_output_protocol__connection_made(self.transport, data)
         
         return True
+    
+    def timer__expired(self):
+        twunnel3.logger.trace("SOCKS5TunnelOutputProtocol.timer__expired")
+        
+        if self.transport is not None:
+            twunnel3.logger.debug("tunnel_output_protocol: timeout")
+            
+            self.transport.close()
+    
+    def pipeline_failed(self):
+        twunnel3.logger.trace("SOCKS5TunnelOutputProtocol.pipeline_failed")
+        
+        self.pipeline = False
+        
+        pipeline_failures[self.factory.plan.proxy_server_address_port] = asyncio.get_event_loop().time() + PIPELINE_FAILURE_TIME
+        
+        self.factory.tunnel_protocol.tunnel_output_protocol__pipeline_failed()
+        
+        twunnel3.logger.warning("proxy_server: pipelined handshake failed, using stepwise handshake for the next " + str(PIPELINE_FAILURE_TIME) + " seconds")
 
-class SOCKS5TunnelOutputProtocolFactory(object):
+class SOCKS5TunnelOutputProtocolPlan(object):
+    __slots__ = ("configuration", "address", "port", "proxy_server_address_port", "pipeline", "method", "greeting_request", "authentication_request", "pipeline_request", "request")
+    
     def __init__(self, configuration, address, port):
+        twunnel3.logger.trace("SOCKS5TunnelOutputProtocolPlan.__init__")
+        
+        self.configuration = configuration
+        self.address = address
+        self.port = port
+        self.proxy_server_address_port = (self.configuration["PROXY_SERVER"]["ADDRESS"], self.configuration["PROXY_SERVER"]["PORT"])
+        self.pipeline = self.configuration["PROXY_SERVER"]["PIPELINE"]
+        
+        name = self.configuration["PROXY_SERVER"]["ACCOUNT"]["NAME"].encode()
+        name_length = len(name)
+        
+        password = self.configuration["PROXY_SERVER"]["ACCOUNT"]["PASSWORD"].encode()
+        password_length = len(password)
+        
+        self.greeting_request = struct.pack("!BBBB", 0x05, 0x02, 0x00, 0x02)
+        
+        self.authentication_request = struct.pack("!B", 0x01)
+        self.authentication_request = self.authentication_request + struct.pack("!B%ds" % name_length, name_length, name)
+        self.authentication_request = self.authentication_request + struct.pack("!B%ds" % password_length, password_length, password)
+        
+        if name_length > 0:
+            self.method = 0x02
+            self.pipeline_request = struct.pack("!BBB", 0x05, 0x01, 0x02) + self.authentication_request
+        else:
+            self.method = 0x00
+            self.pipeline_request = struct.pack("!BBB", 0x05, 0x01, 0x00)
+        
+        self.request = None
+        if self.address is not None:
+            self.request = self.create_request(self.address, self.port)
+    
+    def get_request(self, address, port):
+        twunnel3.logger.trace("SOCKS5TunnelOutputProtocolPlan.get_request")
+        
+        if self.request is not None and address == self.address and port == self.port:
+            return self.request
+        
+        return self.create_request(address, port)
+    
+    def create_request(self, address, port):
+        twunnel3.logger.trace("SOCKS5TunnelOutputProtocolPlan.create_request")
+        
+        address_type = 0x03
+        if is_ipv4_address(address) == True:
+            address_type = 0x01
+        else:
+            if is_ipv6_address(address) == True:
+                address_type = 0x04
+        
+        request = struct.pack("!BBB", 0x05, 0x01, 0x00)
+        
+        if address_type == 0x01:
+            ipv4_address = socket.inet_pton(socket.AF_INET, address)
+            ipv4_address, = struct.unpack("!I", ipv4_address)
+            
+            request = request + struct.pack("!BI", 0x01, ipv4_address)
+        else:
+            if address_type == 0x03:
+                domain_name_address = address.encode()
+                domain_name_address_length = len(domain_name_address)
+                
+                request = request + struct.pack("!BB%ds" % domain_name_address_length, 0x03, domain_name_address_length, domain_name_address)
+            else:
+                if address_type == 0x04:
+                    ipv6_address = socket.inet_pton(socket.AF_INET6, address)
+                    address1, address2, address3, address4 = struct.unpack("!IIII", ipv6_address)
+                    
+                    request = request + struct.pack("!BIIII", 0x04, address1, address2, address3, address4)
+        
+        request = request + struct.pack("!H", port)
+        
+        return request
+
+class SOCKS5TunnelOutputProtocolFactory(object):
+    __slots__ = ("configuration", "address", "port", "plan", "tunnel_protocol")
+    
+    def __init__(self, configuration, address, port, plan=None):
         twunnel3.logger.trace("SOCKS5TunnelOutputProtocolFactory.__init__")
         
+        if plan is None:
+            plan = SOCKS5TunnelOutputProtocolPlan(configuration, None, None)
+        
         self.configuration = configuration
         self.address = address
         self.port = port
+        self.plan = plan
         self.tunnel_protocol = None
     
     def __call__(self):
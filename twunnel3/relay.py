@@ -0,0 +1,459 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import os
+import socket
+import twunnel3.logger
+import twunnel3.metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+if hasattr(asyncio, "BufferedProtocol"):
+    BufferedProtocol = asyncio.BufferedProtocol
+else:
+    BufferedProtocol = asyncio.Protocol
+
+class SpliceRelayPipe(object):
+    def __init__(self, relay, input_file_descriptor, output_file_descriptor, size, direction):
+        twunnel3.logger.trace("SpliceRelayPipe.__init__")
+        
+        self.relay = relay
+        self.input_file_descriptor = input_file_descriptor
+        self.output_file_descriptor = output_file_descriptor
+        self.size = size
+        self.direction = direction
+        self.pipe_input_file_descriptor = -1
+        self.pipe_output_file_descriptor = -1
+        self.data_length = 0
+        self.reading = False
+        self.writing = False
+    
+    def open(self):
+        twunnel3.logger.trace("SpliceRelayPipe.open")
+        
+        self.pipe_output_file_descriptor, self.pipe_input_file_descriptor = os.pipe()
+        
+        if fcntl is not None and hasattr(fcntl, "F_SETPIPE_SZ"):
+            try:
+                fcntl.fcntl(self.pipe_input_file_descriptor, fcntl.F_SETPIPE_SZ, self.size)
+            except OSError:
+                pass
+        
+        self.resume_reading()
+    
+    def close(self):
+        twunnel3.logger.trace("SpliceRelayPipe.close")
+        
+        self.pause_reading()
+        self.pause_writing()
+        
+        if self.pipe_input_file_descriptor != -1:
+            os.close(self.pipe_input_file_descriptor)
+            self.pipe_input_file_descriptor = -1
+        
+        if self.pipe_output_file_descriptor != -1:
+            os.close(self.pipe_output_file_descriptor)
+            self.pipe_output_file_descriptor = -1
+    
+    def pause_reading(self):
+        twunnel3.logger.trace("SpliceRelayPipe.pause_reading")
+        
+        if self.reading:
+            asyncio.get_event_loop().remove_reader(self.input_file_descriptor)
+            self.reading = False
+    
+    def resume_reading(self):
+        twunnel3.logger.trace("SpliceRelayPipe.resume_reading")
+        
+        if not self.reading:
+            asyncio.get_event_loop().add_reader(self.input_file_descriptor, self.read)
+            self.reading = True
+    
+    def pause_writing(self):
+        twunnel3.logger.trace("SpliceRelayPipe.pause_writing")
+        
+        if self.writing:
+            asyncio.get_event_loop().remove_writer(self.output_file_descriptor)
+            self.writing = False
+    
+    def resume_writing(self):
+        twunnel3.logger.trace("SpliceRelayPipe.resume_writing")
+        
+        if not self.writing:
+            asyncio.get_event_loop().add_writer(self.output_file_descriptor, self.write)
+            self.writing = True
+    
+    def read(self):
+        twunnel3.logger.trace("SpliceRelayPipe.read")
+        
+        try:
+            data_length = os.splice(self.input_file_descriptor, self.pipe_input_file_descriptor, self.size, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exception:
+            self.relay.close(exception)
+            return
+        
+        if data_length == 0:
+            self.pause_reading()
+            
+            self.relay.pipe__data_closed(self)
+            return
+        
+        self.data_length = self.data_length + data_length
+        
+        twunnel3.metrics.relayed_bytes_metric.increase(data_length, self.direction)
+        
+        self.write()
+    
+    def write(self):
+        twunnel3.logger.trace("SpliceRelayPipe.write")
+        
+        while self.data_length > 0:
+            try:
+                data_length = os.splice(self.pipe_output_file_descriptor, self.output_file_descriptor, self.data_length, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            except (BlockingIOError, InterruptedError):
+                self.pause_reading()
+                self.resume_writing()
+                return
+            except OSError as exception:
+                self.relay.close(exception)
+                return
+            
+            self.data_length = self.data_length - data_length
+        
+        self.pause_writing()
+        
+        if self.relay.relay_state == 1:
+            self.resume_reading()
+        else:
+            if self.relay.relay_state == 2:
+                self.relay.pipe__data_closed(self)
+
+class SpliceRelay(object):
+    def __init__(self, configuration, input_transport, output_transport):
+        twunnel3.logger.trace("SpliceRelay.__init__")
+        
+        self.configuration = configuration
+        self.input_transport = input_transport
+        self.output_transport = output_transport
+        self.input_socket = None
+        self.output_socket = None
+        self.input_pipe = None
+        self.output_pipe = None
+        self.relay_state = 0
+    
+    def start(self):
+        twunnel3.logger.trace("SpliceRelay.start")
+        
+        if not hasattr(os, "splice"):
+            return False
+        
+        if self.input_transport.get_extra_info("sslcontext") is not None or self.output_transport.get_extra_info("sslcontext") is not None:
+            return False
+        
+        input_socket = self.input_transport.get_extra_info("socket")
+        output_socket = self.output_transport.get_extra_info("socket")
+        
+        if input_socket is None or output_socket is None:
+            return False
+        
+        if input_socket.type != socket.SOCK_STREAM or output_socket.type != socket.SOCK_STREAM:
+            return False
+        
+        if self.input_transport.get_write_buffer_size() != 0 or self.output_transport.get_write_buffer_size() != 0:
+            return False
+        
+        self.input_transport.pause_reading()
+        self.output_transport.pause_reading()
+        
+        self.input_socket = socket.fromfd(input_socket.fileno(), input_socket.family, input_socket.type)
+        self.input_socket.setblocking(False)
+        self.output_socket = socket.fromfd(output_socket.fileno(), output_socket.family, output_socket.type)
+        self.output_socket.setblocking(False)
+        
+        self.relay_state = 1
+        
+        self.input_pipe = SpliceRelayPipe(self, self.input_socket.fileno(), self.output_socket.fileno(), self.configuration["SIZE"], "upstream")
+        self.input_pipe.open()
+        self.output_pipe = SpliceRelayPipe(self, self.output_socket.fileno(), self.input_socket.fileno(), self.configuration["SIZE"], "downstream")
+        self.output_pipe.open()
+        
+        twunnel3.logger.debug("relay: splice")
+        
+        return True
+    
+    def pipe__data_closed(self, pipe):
+        twunnel3.logger.trace("SpliceRelay.pipe__data_closed")
+        
+        if self.relay_state == 1:
+            self.relay_state = 2
+            
+            self.input_pipe.pause_reading()
+            self.output_pipe.pause_reading()
+        
+        if self.relay_state == 2:
+            if self.input_pipe.data_length == 0 and self.output_pipe.data_length == 0:
+                self.close(None)
+    
+    def close(self, exception):
+        twunnel3.logger.trace("SpliceRelay.close")
+        
+        if self.relay_state == 3:
+            return
+        
+        self.relay_state = 3
+        
+        if exception is not None:
+            twunnel3.logger.debug("relay: " + str(exception))
+        
+        self.input_pipe.close()
+        self.output_pipe.close()
+        
+        self.input_socket.close()
+        self.output_socket.close()
+        
+        self.input_transport.close()
+        self.output_transport.close()
+
+class BufferPool(object):
+    def __init__(self, configuration):
+        twunnel3.logger.trace("BufferPool.__init__")
+        
+        self.configuration = configuration
+        self.sizes = sorted(self.configuration["BUFFER"]["SIZES"])
+        self.buffers = {}
+        self.number_of_used_buffers = {}
+        self.number_of_allocations = {}
+        self.number_of_reuses = {}
+        self.number_of_discards = {}
+        
+        i = 0
+        while i < len(self.sizes):
+            self.buffers[self.sizes[i]] = []
+            self.number_of_used_buffers[self.sizes[i]] = 0
+            self.number_of_allocations[self.sizes[i]] = 0
+            self.number_of_reuses[self.sizes[i]] = 0
+            self.number_of_discards[self.sizes[i]] = 0
+            
+            i = i + 1
+    
+    def get_buffer(self, i):
+        twunnel3.logger.trace("BufferPool.get_buffer")
+        
+        size = self.sizes[i]
+        
+        if len(self.buffers[size]) > 0:
+            buffer = self.buffers[size].pop()
+            
+            self.number_of_reuses[size] = self.number_of_reuses[size] + 1
+        else:
+            buffer = bytearray(size)
+            
+            self.number_of_allocations[size] = self.number_of_allocations[size] + 1
+        
+        self.number_of_used_buffers[size] = self.number_of_used_buffers[size] + 1
+        
+        return buffer
+    
+    def put_buffer(self, buffer):
+        twunnel3.logger.trace("BufferPool.put_buffer")
+        
+        size = len(buffer)
+        
+        self.number_of_used_buffers[size] = self.number_of_used_buffers[size] - 1
+        
+        if len(self.buffers[size]) < self.configuration["BUFFER"]["MAXIMUM_NUMBER_OF_BUFFERS"]:
+            self.buffers[size].append(buffer)
+        else:
+            self.number_of_discards[size] = self.number_of_discards[size] + 1
+    
+    def discard_buffer(self, buffer):
+        twunnel3.logger.trace("BufferPool.discard_buffer")
+        
+        size = len(buffer)
+        
+        self.number_of_used_buffers[size] = self.number_of_used_buffers[size] - 1
+        self.number_of_discards[size] = self.number_of_discards[size] + 1
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("BufferPool.get_statistics")
+        
+        statistics = {}
+        statistics["NUMBER_OF_BUFFERS"] = 0
+        statistics["NUMBER_OF_USED_BUFFERS"] = 0
+        statistics["NUMBER_OF_ALLOCATIONS"] = 0
+        statistics["NUMBER_OF_REUSES"] = 0
+        statistics["NUMBER_OF_DISCARDS"] = 0
+        statistics["SIZE"] = 0
+        statistics["BUFFERS"] = []
+        
+        i = 0
+        while i < len(self.sizes):
+            size = self.sizes[i]
+            
+            buffer_statistics = {}
+            buffer_statistics["SIZE"] = size
+            buffer_statistics["NUMBER_OF_BUFFERS"] = len(self.buffers[size])
+            buffer_statistics["NUMBER_OF_USED_BUFFERS"] = self.number_of_used_buffers[size]
+            buffer_statistics["NUMBER_OF_ALLOCATIONS"] = self.number_of_allocations[size]
+            buffer_statistics["NUMBER_OF_REUSES"] = self.number_of_reuses[size]
+            buffer_statistics["NUMBER_OF_DISCARDS"] = self.number_of_discards[size]
+            
+            statistics["NUMBER_OF_BUFFERS"] = statistics["NUMBER_OF_BUFFERS"] + buffer_statistics["NUMBER_OF_BUFFERS"]
+            statistics["NUMBER_OF_USED_BUFFERS"] = statistics["NUMBER_OF_USED_BUFFERS"] + buffer_statistics["NUMBER_OF_USED_BUFFERS"]
+            statistics["NUMBER_OF_ALLOCATIONS"] = statistics["NUMBER_OF_ALLOCATIONS"] + buffer_statistics["NUMBER_OF_ALLOCATIONS"]
+            statistics["NUMBER_OF_REUSES"] = statistics["NUMBER_OF_REUSES"] + buffer_statistics["NUMBER_OF_REUSES"]
+            statistics["NUMBER_OF_DISCARDS"] = statistics["NUMBER_OF_DISCARDS"] + buffer_statistics["NUMBER_OF_DISCARDS"]
+            statistics["SIZE"] = statistics["SIZE"] + size * (buffer_statistics["NUMBER_OF_BUFFERS"] + buffer_statistics["NUMBER_OF_USED_BUFFERS"])
+            statistics["BUFFERS"].append(buffer_statistics)
+            
+            i = i + 1
+        
+        return statistics
+
+buffer_pool = None
+
+def get_buffer_pool(configuration):
+    global buffer_pool
+    
+    if buffer_pool is None:
+        buffer_pool = BufferPool(configuration)
+    
+    return buffer_pool
+
+class BufferedRelayProtocol(BufferedProtocol):
+    __slots__ = ("relay", "transport", "other_transport", "direction", "protocol", "buffer", "written_buffer", "i")
+    
+    def __init__(self, relay, transport, other_transport, direction):
+        twunnel3.logger.trace("BufferedRelayProtocol.__init__")
+        
+        self.relay = relay
+        self.transport = transport
+        self.other_transport = other_transport
+        self.direction = direction
+        self.protocol = transport.get_protocol()
+        self.buffer = None
+        self.written_buffer = None
+        self.i = 0
+    
+    def connection_made(self, transport):
+        twunnel3.logger.trace("BufferedRelayProtocol.connection_made")
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.trace("BufferedRelayProtocol.connection_lost")
+        
+        if self.buffer is not None:
+            self.relay.buffer_pool.put_buffer(self.buffer)
+            self.buffer = None
+        
+        self.put_written_buffer()
+        
+        if self.written_buffer is not None:
+            self.relay.buffer_pool.discard_buffer(self.written_buffer)
+            self.written_buffer = None
+        
+        self.protocol.connection_lost(exception)
+    
+    def get_buffer(self, size):
+        twunnel3.logger.trace("BufferedRelayProtocol.get_buffer")
+        
+        if self.buffer is None:
+            self.buffer = self.relay.buffer_pool.get_buffer(self.i)
+        
+        return memoryview(self.buffer)
+    
+    def buffer_updated(self, data_length):
+        twunnel3.logger.trace("BufferedRelayProtocol.buffer_updated")
+        
+        buffer = self.buffer
+        self.buffer = None
+        
+        twunnel3.metrics.relayed_bytes_metric.increase(data_length, self.direction)
+        
+        self.put_written_buffer()
+        
+        if self.written_buffer is None and self.other_transport.get_write_buffer_size() == 0 and self.other_transport.get_extra_info("sslcontext") is None:
+            self.other_transport.write(memoryview(buffer)[:data_length])
+            
+            if self.other_transport.get_write_buffer_size() == 0:
+                self.relay.buffer_pool.put_buffer(buffer)
+            else:
+                self.written_buffer = buffer
+        else:
+            with memoryview(buffer) as data:
+                data = data[:data_length].tobytes()
+            
+            self.relay.buffer_pool.put_buffer(buffer)
+            
+            self.other_transport.write(data)
+        
+        if data_length == len(buffer):
+            if self.i < len(self.relay.buffer_pool.sizes) - 1:
+                self.i = self.i + 1
+        else:
+            if self.i > 0 and data_length <= self.relay.buffer_pool.sizes[self.i - 1]:
+                self.i = self.i - 1
+    
+    def put_written_buffer(self):
+        twunnel3.logger.trace("BufferedRelayProtocol.put_written_buffer")
+        
+        if self.written_buffer is not None and self.other_transport.get_write_buffer_size() == 0:
+            self.relay.buffer_pool.put_buffer(self.written_buffer)
+            self.written_buffer = None
+    
+    def eof_received(self):
+        twunnel3.logger.trace("BufferedRelayProtocol.eof_received")
+        
+        return self.protocol.eof_received()
+    
+    def pause_writing(self):
+        twunnel3.logger.trace("BufferedRelayProtocol.pause_writing")
+        
+        self.other_transport.pause_reading()
+    
+    def resume_writing(self):
+        twunnel3.logger.trace("BufferedRelayProtocol.resume_writing")
+        
+        if self is self.relay.input_protocol:
+            self.relay.output_protocol.put_written_buffer()
+        else:
+            self.relay.input_protocol.put_written_buffer()
+        
+        self.other_transport.resume_reading()
+
+class BufferedRelay(object):
+    def __init__(self, configuration, input_transport, output_transport):
+        twunnel3.logger.trace("BufferedRelay.__init__")
+        
+        self.configuration = configuration
+        self.input_transport = input_transport
+        self.output_transport = output_transport
+        self.input_protocol = None
+        self.output_protocol = None
+        self.buffer_pool = None
+    
+    def start(self):
+        twunnel3.logger.trace("BufferedRelay.start")
+        
+        if BufferedProtocol is asyncio.Protocol:
+            return False
+        
+        if self.input_transport.get_extra_info("socket") is None or self.output_transport.get_extra_info("socket") is None:
+            return False
+        
+        self.buffer_pool = get_buffer_pool(self.configuration)
+        
+        self.input_protocol = BufferedRelayProtocol(self, self.input_transport, self.output_transport, "upstream")
+        self.output_protocol = BufferedRelayProtocol(self, self.output_transport, self.input_transport, "downstream")
+        
+        self.input_transport.set_protocol(self.input_protocol)
+        self.output_transport.set_protocol(self.output_protocol)
+        
+        twunnel3.logger.debug("relay: buffered")
+        
+        return True
\ No newline at end of file
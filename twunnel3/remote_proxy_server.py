@@ -1,6 +1,10 @@
 # Copyright (c) Jeroen Van Steirteghem
 # See LICENSE
 
+import twunnel3.account_store
+import twunnel3.admission
+import twunnel3.bandwidth
+import twunnel3.multiplexer
 import twunnel3.proxy_server
 
 def set_default_configuration(configuration, keys):
@@ -12,6 +16,16 @@ def set_default_configuration(configuration, keys):
         if configuration["REMOTE_PROXY_SERVER"]["TYPE"] == "SSL":
             configuration["REMOTE_PROXY_SERVER"].setdefault("ADDRESS", "")
             configuration["REMOTE_PROXY_SERVER"].setdefault("PORT", 0)
+            configuration["REMOTE_PROXY_SERVER"].setdefault("REUSE_PORT", False)
+            configuration["REMOTE_PROXY_SERVER"].setdefault("WRITE_BUFFER", {})
+            configuration["REMOTE_PROXY_SERVER"]["WRITE_BUFFER"].setdefault("HIGH_WATER_MARK", 65536)
+            configuration["REMOTE_PROXY_SERVER"]["WRITE_BUFFER"].setdefault("LOW_WATER_MARK", 16384)
+            configuration["REMOTE_PROXY_SERVER"].setdefault("EARLY_DATA", {})
+            configuration["REMOTE_PROXY_SERVER"]["EARLY_DATA"].setdefault("MAXIMUM_LENGTH", 65536)
+            configuration["REMOTE_PROXY_SERVER"].setdefault("TIMEOUT", {})
+            configuration["REMOTE_PROXY_SERVER"]["TIMEOUT"].setdefault("HANDSHAKE", 10)
+            configuration["REMOTE_PROXY_SERVER"]["TIMEOUT"].setdefault("CONNECT", 30)
+            configuration["REMOTE_PROXY_SERVER"]["TIMEOUT"].setdefault("IDLE", 0)
             configuration["REMOTE_PROXY_SERVER"].setdefault("CERTIFICATE", {})
             configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"].setdefault("FILE", "")
             configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"].setdefault("KEY", {})
@@ -22,9 +36,13 @@ def set_default_configuration(configuration, keys):
                 configuration["REMOTE_PROXY_SERVER"]["ACCOUNTS"][i].setdefault("NAME", "")
                 configuration["REMOTE_PROXY_SERVER"]["ACCOUNTS"][i].setdefault("PASSWORD", "")
                 i = i + 1
+            twunnel3.account_store.set_default_configuration(configuration["REMOTE_PROXY_SERVER"], ["ACCOUNTS_FILE"])
+            twunnel3.admission.set_default_configuration(configuration["REMOTE_PROXY_SERVER"], ["ADMISSION"])
+            twunnel3.bandwidth.set_default_configuration(configuration["REMOTE_PROXY_SERVER"], ["BANDWIDTH"])
+            twunnel3.multiplexer.set_default_configuration(configuration["REMOTE_PROXY_SERVER"], ["MULTIPLEXER"])
 
 def create_server(configuration):
-    set_default_configuration(configuration, ["PROXY_SERVERS", "REMOTE_PROXY_SERVER"])
+    set_default_configuration(configuration, ["PROXY_SERVERS", "POOL", "RESOLVER", "REMOTE_PROXY_SERVER"])
     
     if configuration["REMOTE_PROXY_SERVER"]["TYPE"] == "SSL":
         from twunnel3.remote_proxy_server__ssl import create_ssl_server
@@ -6,9 +6,60 @@ import ssl as _ssl
 import twunnel3.local_proxy_server
 import twunnel3.local_proxy_server__socks5
 import twunnel3.logger
+import twunnel3.multiplexer
 import twunnel3.proxy_server
 
+class SSLInputProtocol(asyncio.Protocol):
+    __slots__ = ("factory", "protocol", "transport")
+    
+    def __init__(self):
+        twunnel3.logger.trace("SSLInputProtocol.__init__")
+        
+        self.factory = None
+        self.protocol = None
+        self.transport = None
+    
+    def connection_made(self, transport):
+        twunnel3.logger.trace("SSLInputProtocol.connection_made")
+        
+        self.transport = transport
+    
+    def connection_lost(self, exception):
+        twunnel3.logger.trace("SSLInputProtocol.connection_lost")
+        
+        if self.protocol is not None:
+            self.protocol.connection_lost(exception)
+        
+        self.transport = None
+    
+    def data_received(self, data):
+        twunnel3.logger.trace("SSLInputProtocol.data_received")
+        
+        if self.protocol is None:
+            if data[0] == 0x05:
+                self.protocol = twunnel3.local_proxy_server__socks5.SOCKS5InputProtocolFactory.__call__(self.factory)
+            else:
+                self.protocol = twunnel3.multiplexer.MultiplexerProtocol(self.factory.configuration["REMOTE_PROXY_SERVER"], lambda: twunnel3.local_proxy_server__socks5.SOCKS5InputProtocolFactory.__call__(self.factory))
+            
+            self.protocol.connection_made(self.transport)
+        
+        self.protocol.data_received(data)
+    
+    def pause_writing(self):
+        twunnel3.logger.trace("SSLInputProtocol.pause_writing")
+        
+        if self.protocol is not None:
+            self.protocol.pause_writing()
+    
+    def resume_writing(self):
+        twunnel3.logger.trace("SSLInputProtocol.resume_writing")
+        
+        if self.protocol is not None:
+            self.protocol.resume_writing()
+
 class SSLInputProtocolFactory(twunnel3.local_proxy_server__socks5.SOCKS5InputProtocolFactory):
+    __slots__ = ()
+    
     def __init__(self, configuration):
         twunnel3.logger.trace("SSLInputProtocolFactory.__init__")
         
@@ -16,10 +67,17 @@ class SSLInputProtocolFactory(twunnel3.local_proxy_server__socks5.SOCKS5InputPro
         
         configuration = {}
         configuration["PROXY_SERVERS"] = self.configuration["PROXY_SERVERS"]
+        configuration["POOL"] = self.configuration["POOL"]
+        configuration["RESOLVER"] = self.configuration["RESOLVER"]
         configuration["LOCAL_PROXY_SERVER"] = {}
         configuration["LOCAL_PROXY_SERVER"]["TYPE"] = "SOCKS5"
         configuration["LOCAL_PROXY_SERVER"]["ADDRESS"] = self.configuration["REMOTE_PROXY_SERVER"]["ADDRESS"]
         configuration["LOCAL_PROXY_SERVER"]["PORT"] = self.configuration["REMOTE_PROXY_SERVER"]["PORT"]
+        configuration["LOCAL_PROXY_SERVER"]["WRITE_BUFFER"] = self.configuration["REMOTE_PROXY_SERVER"]["WRITE_BUFFER"]
+        configuration["LOCAL_PROXY_SERVER"]["EARLY_DATA"] = self.configuration["REMOTE_PROXY_SERVER"]["EARLY_DATA"]
+        configuration["LOCAL_PROXY_SERVER"]["TIMEOUT"] = self.configuration["REMOTE_PROXY_SERVER"]["TIMEOUT"]
+        configuration["LOCAL_PROXY_SERVER"]["ADMISSION"] = self.configuration["REMOTE_PROXY_SERVER"]["ADMISSION"]
+        configuration["LOCAL_PROXY_SERVER"]["BANDWIDTH"] = self.configuration["REMOTE_PROXY_SERVER"]["BANDWIDTH"]
         configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"] = []
         i = 0
         while i < len(self.configuration["REMOTE_PROXY_SERVER"]["ACCOUNTS"]):
@@ -27,11 +85,22 @@ class SSLInputProtocolFactory(twunnel3.local_proxy_server__socks5.SOCKS5InputPro
             configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i]["NAME"] = self.configuration["REMOTE_PROXY_SERVER"]["ACCOUNTS"][i]["NAME"]
             configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS"][i]["PASSWORD"] = self.configuration["REMOTE_PROXY_SERVER"]["ACCOUNTS"][i]["PASSWORD"]
             i = i + 1
+        configuration["LOCAL_PROXY_SERVER"]["ACCOUNTS_FILE"] = self.configuration["REMOTE_PROXY_SERVER"]["ACCOUNTS_FILE"]
         configuration["REMOTE_PROXY_SERVERS"] = []
+        configuration["REMOTE_PROXY_SERVER"] = self.configuration["REMOTE_PROXY_SERVER"]
+        
+        twunnel3.local_proxy_server.set_default_configuration(configuration, ["LOCAL_PROXY_SERVER", "BALANCER"])
         
         output_protocol_connection_manager = twunnel3.local_proxy_server.OutputProtocolConnectionManager(configuration)
         
         twunnel3.local_proxy_server__socks5.SOCKS5InputProtocolFactory.__init__(self, configuration, output_protocol_connection_manager)
+    
+    def __call__(self):
+        twunnel3.logger.trace("SSLInputProtocolFactory.__call__")
+        
+        input_protocol = SSLInputProtocol()
+        input_protocol.factory = self
+        return input_protocol
 
 def create_ssl_server(configuration):
     input_protocol_factory = SSLInputProtocolFactory(configuration)
@@ -40,4 +109,4 @@ def create_ssl_server(configuration):
     ssl.options |= _ssl.OP_NO_SSLv2
     ssl.load_cert_chain(configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["FILE"], keyfile=configuration["REMOTE_PROXY_SERVER"]["CERTIFICATE"]["KEY"]["FILE"])
     
-    return asyncio.get_event_loop().create_server(input_protocol_factory, host=configuration["REMOTE_PROXY_SERVER"]["ADDRESS"], port=configuration["REMOTE_PROXY_SERVER"]["PORT"], ssl=ssl)
\ No newline at end of file
+    return input_protocol_factory.output_protocol_connection_manager.create_server(input_protocol_factory, configuration["REMOTE_PROXY_SERVER"]["ADDRESS"], configuration["REMOTE_PROXY_SERVER"]["PORT"], ssl=ssl, reuse_port=configuration["REMOTE_PROXY_SERVER"]["REUSE_PORT"])
\ No newline at end of file
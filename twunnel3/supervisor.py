@@ -0,0 +1,411 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import copy
+import errno
+import json
+import os
+import select
+import signal
+import time
+import twunnel3.local_proxy_server
+import twunnel3.logger
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def set_default_configuration(configuration, keys):
+    if "SUPERVISOR" in keys:
+        configuration.setdefault("SUPERVISOR", {})
+        configuration["SUPERVISOR"].setdefault("NUMBER_OF_WORKERS", 1)
+        configuration["SUPERVISOR"].setdefault("CPUS", [])
+        configuration["SUPERVISOR"].setdefault("RESTART_TIME", 1)
+        configuration["SUPERVISOR"].setdefault("MAXIMUM_RESTART_TIME", 60)
+        configuration["SUPERVISOR"].setdefault("DRAIN_TIME", 10)
+        configuration["SUPERVISOR"].setdefault("STATISTICS", {})
+        configuration["SUPERVISOR"]["STATISTICS"].setdefault("INTERVAL", 5)
+
+class SupervisorWorker(object):
+    def __init__(self, supervisor, i):
+        twunnel3.logger.trace("SupervisorWorker.__init__")
+        
+        self.supervisor = supervisor
+        self.configuration = supervisor.configuration
+        self.i = i
+        self.process_id = 0
+        self.file_descriptor = -1
+        self.data = b""
+        self.statistics = {}
+        self.number_of_restarts = 0
+        self.start_time = 0
+        self.restart_time = 0
+        self.server = None
+        self.drain_time = 0
+    
+    def get_cpus(self):
+        twunnel3.logger.trace("SupervisorWorker.get_cpus")
+        
+        if len(self.configuration["SUPERVISOR"]["CPUS"]) == 0:
+            return []
+        
+        return [self.configuration["SUPERVISOR"]["CPUS"][self.i % len(self.configuration["SUPERVISOR"]["CPUS"])]]
+    
+    def run(self, file_descriptor):
+        twunnel3.logger.trace("SupervisorWorker.run")
+        
+        self.file_descriptor = file_descriptor
+        os.set_blocking(self.file_descriptor, False)
+        
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        
+        cpus = self.get_cpus()
+        if len(cpus) > 0 and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        
+        if twunnel3.logger.default_logger is not None:
+            twunnel3.logger.configure(twunnel3.logger.default_logger.configuration)
+        
+        configuration = copy.deepcopy(self.configuration)
+        if "LOCAL_PROXY_SERVER" in configuration:
+            configuration["LOCAL_PROXY_SERVER"]["REUSE_PORT"] = True
+        if "REMOTE_PROXY_SERVER" in configuration:
+            configuration["REMOTE_PROXY_SERVER"]["REUSE_PORT"] = True
+        
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        
+        self.server = loop.run_until_complete(self.supervisor.create_server(configuration))
+        
+        loop.add_signal_handler(signal.SIGTERM, self.drain)
+        loop.call_soon(self.write_statistics)
+        
+        twunnel3.logger.info("supervisor: worker " + str(self.i) + " started")
+        
+        loop.run_forever()
+        
+        self.write_statistics()
+        
+        twunnel3.logger.info("supervisor: worker " + str(self.i) + " stopped")
+        
+        if twunnel3.logger.default_logger is not None:
+            twunnel3.logger.default_logger.close()
+    
+    def drain(self):
+        twunnel3.logger.trace("SupervisorWorker.drain")
+        
+        if self.drain_time == 0:
+            self.drain_time = time.time() + self.configuration["SUPERVISOR"]["DRAIN_TIME"]
+            
+            self.server.close()
+            
+            twunnel3.logger.info("supervisor: worker " + str(self.i) + " draining")
+            
+            self.check_drain()
+    
+    def check_drain(self):
+        twunnel3.logger.trace("SupervisorWorker.check_drain")
+        
+        statistics = twunnel3.local_proxy_server.get_statistics()
+        
+        if statistics["NUMBER_OF_CONNECTIONS"] == 0 or time.time() >= self.drain_time:
+            asyncio.get_event_loop().stop()
+        else:
+            asyncio.get_event_loop().call_later(0.1, self.check_drain)
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("SupervisorWorker.get_statistics")
+        
+        statistics = twunnel3.local_proxy_server.get_statistics()
+        statistics["PROCESS_ID"] = os.getpid()
+        
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            
+            statistics["USER_TIME"] = usage.ru_utime
+            statistics["SYSTEM_TIME"] = usage.ru_stime
+            statistics["MAXIMUM_RESIDENT_SET_SIZE"] = usage.ru_maxrss
+        
+        return statistics
+    
+    def write_statistics(self):
+        twunnel3.logger.trace("SupervisorWorker.write_statistics")
+        
+        data = (json.dumps(self.get_statistics()) + "\n").encode()
+        
+        try:
+            os.write(self.file_descriptor, data)
+        except OSError:
+            pass
+        
+        if self.drain_time == 0:
+            asyncio.get_event_loop().call_later(self.configuration["SUPERVISOR"]["STATISTICS"]["INTERVAL"], self.write_statistics)
+    
+    def read_statistics(self):
+        twunnel3.logger.trace("SupervisorWorker.read_statistics")
+        
+        try:
+            data = os.read(self.file_descriptor, 65536)
+        except OSError as exception:
+            if exception.errno == errno.EAGAIN or exception.errno == errno.EINTR:
+                return
+            data = b""
+        
+        if len(data) == 0:
+            self.supervisor.close_worker(self)
+            
+            return
+        
+        self.data = self.data + data
+        
+        i = self.data.rfind(b"\n")
+        
+        if i != -1:
+            lines = self.data[:i].split(b"\n")
+            
+            self.data = self.data[i + 1:]
+            
+            try:
+                self.statistics = json.loads(lines[-1].decode())
+            except ValueError:
+                pass
+
+class Supervisor(object):
+    def __init__(self, configuration, create_server):
+        twunnel3.logger.trace("Supervisor.__init__")
+        
+        self.configuration = configuration
+        self.create_server = create_server
+        self.workers = []
+        self.supervisor_state = 0
+        self.stop_time = 0
+        self.statistics_time = 0
+        self.file_descriptors = None
+        
+        i = 0
+        while i < self.configuration["SUPERVISOR"]["NUMBER_OF_WORKERS"]:
+            worker = SupervisorWorker(self, i)
+            self.workers.append(worker)
+            
+            i = i + 1
+    
+    def run(self):
+        twunnel3.logger.trace("Supervisor.run")
+        
+        self.file_descriptors = os.pipe()
+        os.set_blocking(self.file_descriptors[0], False)
+        os.set_blocking(self.file_descriptors[1], False)
+        
+        signal.set_wakeup_fd(self.file_descriptors[1])
+        signal.signal(signal.SIGINT, self.signal_received)
+        signal.signal(signal.SIGTERM, self.signal_received)
+        signal.signal(signal.SIGCHLD, self.signal_received)
+        
+        for worker in self.workers:
+            self.start_worker(worker)
+        
+        while self.supervisor_state != 2:
+            self.wait_workers()
+            
+            if self.supervisor_state == 1:
+                if self.get_number_of_running_workers() == 0:
+                    self.supervisor_state = 2
+                else:
+                    if time.time() >= self.stop_time:
+                        for worker in self.workers:
+                            if worker.process_id != 0:
+                                os.kill(worker.process_id, signal.SIGKILL)
+            else:
+                for worker in self.workers:
+                    if worker.process_id == 0 and worker.restart_time <= time.time():
+                        self.start_worker(worker)
+                
+                if time.time() >= self.statistics_time:
+                    self.statistics_time = time.time() + self.configuration["SUPERVISOR"]["STATISTICS"]["INTERVAL"]
+                    
+                    twunnel3.logger.debug("supervisor: statistics {0}", json.dumps(self.get_statistics()))
+            
+            self.select()
+        
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        
+        os.close(self.file_descriptors[0])
+        os.close(self.file_descriptors[1])
+        self.file_descriptors = None
+    
+    def stop(self):
+        twunnel3.logger.trace("Supervisor.stop")
+        
+        if self.supervisor_state == 0:
+            self.supervisor_state = 1
+            self.stop_time = time.time() + self.configuration["SUPERVISOR"]["DRAIN_TIME"] + 1
+            
+            twunnel3.logger.info("supervisor: stopping")
+            
+            for worker in self.workers:
+                if worker.process_id != 0:
+                    os.kill(worker.process_id, signal.SIGTERM)
+    
+    def signal_received(self, signal_number, frame):
+        twunnel3.logger.trace("Supervisor.signal_received")
+        
+        if signal_number == signal.SIGINT or signal_number == signal.SIGTERM:
+            self.stop()
+    
+    def select(self):
+        twunnel3.logger.trace("Supervisor.select")
+        
+        file_descriptors = [self.file_descriptors[0]]
+        for worker in self.workers:
+            if worker.file_descriptor != -1:
+                file_descriptors.append(worker.file_descriptor)
+        
+        timeout = 1
+        if self.supervisor_state == 0:
+            for worker in self.workers:
+                if worker.process_id == 0:
+                    timeout = min(timeout, max(worker.restart_time - time.time(), 0))
+        
+        try:
+            file_descriptors, _, _ = select.select(file_descriptors, [], [], timeout)
+        except InterruptedError:
+            return
+        
+        for file_descriptor in file_descriptors:
+            if file_descriptor == self.file_descriptors[0]:
+                try:
+                    os.read(file_descriptor, 4096)
+                except OSError:
+                    pass
+            else:
+                for worker in self.workers:
+                    if worker.file_descriptor == file_descriptor:
+                        worker.read_statistics()
+    
+    def start_worker(self, worker):
+        twunnel3.logger.trace("Supervisor.start_worker")
+        
+        file_descriptors = os.pipe()
+        
+        process_id = os.fork()
+        
+        if process_id == 0:
+            exit_code = 0
+            
+            try:
+                os.close(file_descriptors[0])
+                os.close(self.file_descriptors[0])
+                os.close(self.file_descriptors[1])
+                for other_worker in self.workers:
+                    if other_worker.file_descriptor != -1:
+                        os.close(other_worker.file_descriptor)
+                
+                worker.run(file_descriptors[1])
+            except BaseException as exception:
+                twunnel3.logger.error("supervisor: worker " + str(worker.i) + " failed: " + str(exception))
+                
+                exit_code = 1
+            
+            os._exit(exit_code)
+        
+        os.close(file_descriptors[1])
+        os.set_blocking(file_descriptors[0], False)
+        
+        worker.process_id = process_id
+        worker.file_descriptor = file_descriptors[0]
+        worker.data = b""
+        worker.statistics = {}
+        worker.start_time = time.time()
+        
+        twunnel3.logger.debug("supervisor: worker " + str(worker.i) + " has process id " + str(process_id))
+    
+    def wait_workers(self):
+        twunnel3.logger.trace("Supervisor.wait_workers")
+        
+        while True:
+            try:
+                process_id, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            
+            if process_id == 0:
+                return
+            
+            for worker in self.workers:
+                if worker.process_id == process_id:
+                    self.worker__process_exited(worker, status)
+    
+    def worker__process_exited(self, worker, status):
+        twunnel3.logger.trace("Supervisor.worker__process_exited")
+        
+        worker.process_id = 0
+        
+        if worker.file_descriptor != -1:
+            worker.read_statistics()
+            self.close_worker(worker)
+        
+        if self.supervisor_state == 0:
+            if time.time() - worker.start_time < self.configuration["SUPERVISOR"]["MAXIMUM_RESTART_TIME"]:
+                restart_time = self.configuration["SUPERVISOR"]["RESTART_TIME"] * (2 ** min(worker.number_of_restarts, 16))
+                if restart_time > self.configuration["SUPERVISOR"]["MAXIMUM_RESTART_TIME"]:
+                    restart_time = self.configuration["SUPERVISOR"]["MAXIMUM_RESTART_TIME"]
+            else:
+                restart_time = self.configuration["SUPERVISOR"]["RESTART_TIME"]
+            
+            worker.number_of_restarts = worker.number_of_restarts + 1
+            worker.restart_time = time.time() + restart_time
+            
+            twunnel3.logger.warning("supervisor: worker " + str(worker.i) + " exited with status " + str(status) + ", restarting in " + str(restart_time) + "s")
+    
+    def close_worker(self, worker):
+        twunnel3.logger.trace("Supervisor.close_worker")
+        
+        if worker.file_descriptor != -1:
+            os.close(worker.file_descriptor)
+            worker.file_descriptor = -1
+    
+    def get_number_of_running_workers(self):
+        twunnel3.logger.trace("Supervisor.get_number_of_running_workers")
+        
+        number_of_running_workers = 0
+        
+        for worker in self.workers:
+            if worker.process_id != 0:
+                number_of_running_workers = number_of_running_workers + 1
+        
+        return number_of_running_workers
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("Supervisor.get_statistics")
+        
+        statistics = {}
+        statistics["NUMBER_OF_WORKERS"] = self.get_number_of_running_workers()
+        statistics["WORKERS"] = []
+        
+        for worker in self.workers:
+            worker_statistics = dict(worker.statistics)
+            worker_statistics["NUMBER_OF_RESTARTS"] = worker.number_of_restarts
+            worker_statistics["CPUS"] = worker.get_cpus()
+            
+            statistics["WORKERS"].append(worker_statistics)
+            
+            for key in worker_statistics:
+                if key != "PROCESS_ID" and isinstance(worker_statistics[key], (int, float)) and not isinstance(worker_statistics[key], bool):
+                    statistics[key] = statistics.get(key, 0) + worker_statistics[key]
+        
+        return statistics
+
+def create_supervisor(configuration, create_server):
+    set_default_configuration(configuration, ["SUPERVISOR"])
+    
+    supervisor = Supervisor(configuration, create_server)
+    
+    return supervisor
\ No newline at end of file
@@ -0,0 +1,135 @@
+# Copyright (c) Jeroen Van Steirteghem
+# See LICENSE
+
+import asyncio
+import math
+import twunnel3.logger
+
+TIMER_WHEEL_INTERVAL = 1.0
+TIMER_WHEEL_NUMBER_OF_SLOTS = 512
+
+class Timer(object):
+    __slots__ = ("timer_wheel", "callback", "expiration_tick", "slot")
+    
+    def __init__(self, callback, timer_wheel=None):
+        twunnel3.logger.trace("Timer.__init__")
+        
+        if timer_wheel is None:
+            timer_wheel = get_timer_wheel()
+        
+        self.timer_wheel = timer_wheel
+        self.callback = callback
+        self.expiration_tick = 0
+        self.slot = -1
+    
+    def start(self, timeout):
+        twunnel3.logger.trace("Timer.start")
+        
+        if timeout <= 0:
+            self.cancel()
+        else:
+            self.timer_wheel.add_timer(self, timeout)
+    
+    def cancel(self):
+        twunnel3.logger.trace("Timer.cancel")
+        
+        if self.slot != -1:
+            self.timer_wheel.remove_timer(self)
+
+class TimerWheel(object):
+    def __init__(self, interval, number_of_slots):
+        twunnel3.logger.trace("TimerWheel.__init__")
+        
+        self.interval = interval
+        self.slots = []
+        self.tick = 0
+        self.tick_handle = None
+        self.number_of_timers = 0
+        self.number_of_expirations = 0
+        
+        i = 0
+        while i < number_of_slots:
+            self.slots.append(set())
+            
+            i = i + 1
+    
+    def add_timer(self, timer, timeout):
+        twunnel3.logger.trace("TimerWheel.add_timer")
+        
+        expiration_tick = self.tick + max(int(math.ceil(timeout / self.interval)), 1)
+        
+        if timer.slot != -1:
+            if timer.expiration_tick <= expiration_tick:
+                timer.expiration_tick = expiration_tick
+                
+                return
+            
+            self.remove_timer(timer)
+        
+        timer.expiration_tick = expiration_tick
+        timer.slot = expiration_tick % len(self.slots)
+        
+        self.slots[timer.slot].add(timer)
+        self.number_of_timers = self.number_of_timers + 1
+        
+        if self.tick_handle is None:
+            self.tick_handle = asyncio.get_event_loop().call_later(self.interval, self.process_tick)
+    
+    def remove_timer(self, timer):
+        twunnel3.logger.trace("TimerWheel.remove_timer")
+        
+        self.slots[timer.slot].discard(timer)
+        self.number_of_timers = self.number_of_timers - 1
+        
+        timer.slot = -1
+    
+    def process_tick(self):
+        twunnel3.logger.trace("TimerWheel.process_tick")
+        
+        self.tick = self.tick + 1
+        
+        slot = self.tick % len(self.slots)
+        
+        expired_timers = []
+        
+        for timer in list(self.slots[slot]):
+            if timer.expiration_tick <= self.tick:
+                self.remove_timer(timer)
+                
+                expired_timers.append(timer)
+            else:
+                if timer.expiration_tick % len(self.slots) != slot:
+                    self.slots[slot].discard(timer)
+                    
+                    timer.slot = timer.expiration_tick % len(self.slots)
+                    
+                    self.slots[timer.slot].add(timer)
+        
+        if self.number_of_timers > 0:
+            self.tick_handle = asyncio.get_event_loop().call_later(self.interval, self.process_tick)
+        else:
+            self.tick_handle = None
+        
+        for timer in expired_timers:
+            self.number_of_expirations = self.number_of_expirations + 1
+            
+            timer.callback()
+    
+    def get_statistics(self):
+        twunnel3.logger.trace("TimerWheel.get_statistics")
+        
+        statistics = {}
+        statistics["NUMBER_OF_TIMERS"] = self.number_of_timers
+        statistics["NUMBER_OF_EXPIRATIONS"] = self.number_of_expirations
+        
+        return statistics
+
+timer_wheel = None
+
+def get_timer_wheel():
+    global timer_wheel
+    
+    if timer_wheel is None:
+        timer_wheel = TimerWheel(TIMER_WHEEL_INTERVAL, TIMER_WHEEL_NUMBER_OF_SLOTS)
+    
+    return timer_wheel
\ No newline at end of file